@@ -1,74 +1,79 @@
 from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
 from django import forms
-import json, zipfile, os, tempfile
+import json, zipfile, os, tempfile, time
+from django.core.paginator import Paginator
 from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from django.utils.functional import cached_property
+from django.utils.text import unescape_string_literal
 from django.core.files import File
 from django.conf import settings
-from .models import Card, CardSet, CollectionCard, ImportBatch, CollectionImage, Order
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from django.utils import timezone
+from .models import Card, CardSet, CatalogGeneration, CatalogState, CollectionCard, ImportBatch, CollectionImage, InventoryRollup, Order, OrderLine, OutboundEmail, PricingRule, lookup_key
+from django.http import StreamingHttpResponse
+from . import exporter, generations, metrics, rollups
+from .pricing import reprice, schedule_reprice
+from .valuation import record_price_history
+from .emails import enqueue_tracking_email
+
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    fields = ('description','edition','card_set','quantity','unit_amount')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
 
-SMTP_SERVER = "mail.smtp2go.com"
-SMTP_PORT = 2525  # could also be 587, 8025, or 25
-SMTP_USERNAME = settings.SMTP2GO_USERNAME
-SMTP_PASSWORD = settings.SMTP2GO_PASSWORD
-FROM_EMAIL = "orders@rarehuntertcg.com"
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('stripe_order_id','email','status','tracking_number','created_at')
+    list_filter = ('status',)
+    search_fields = ('=email','=stripe_order_id')
     readonly_fields = ('stripe_order_id','email','items','shipping_name','shipping_address')
+    inlines = [OrderLineInline]
     actions = ['send_tracking_email']
 
     def send_tracking_email(self, request, queryset):
+        # Only enqueue here; the send_outbox worker delivers in batches over
+        # shared SMTP connections and retries failures.
+        already_queued = set(
+            OutboundEmail.objects
+            .filter(kind='tracking', order__in=queryset, status__in=('pending', 'sending'))
+            .values_list('order_id', flat=True)
+        )
+        queued = 0
         for order in queryset:
-            if order.tracking_number and order.status != 'shipped':
-                # --- build email ---
-                msg = MIMEMultipart('mixed')
-                msg['Subject'] = f"Your Rare Hunter TCG Order #{order.stripe_order_id} Has Shipped!"
-                msg['From'] = FROM_EMAIL
-                msg['To'] = order.email
-
-                # plain text
-                text = f"""
-Hi {order.email},
-
-Your Rare Hunter TCG order #{order.stripe_order_id} has shipped.
-Tracking Number: {order.tracking_number}
-
-Thank you for shopping with us!
-"""
-                # optional HTML version
-                html = f"""
-<html>
-  <body>
-    <p>Hi {order.email},</p>
-    <p>Your Rare Hunter TCG order <strong>#{order.stripe_order_id}</strong> has shipped.</p>
-    <p>Tracking Number: <strong>{order.tracking_number}</strong></p>
-    <p>Thank you for shopping with us!</p>
-  </body>
-</html>
-"""
-                msg.attach(MIMEText(text, 'plain'))
-                msg.attach(MIMEText(html, 'html'))
-
-                # --- send via SMTP2GO ---
-                try:
-                    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as smtp:
-                        smtp.ehlo()
-                        smtp.starttls()
-                        smtp.ehlo()
-                        smtp.login(SMTP_USERNAME, SMTP_PASSWORD)
-                        smtp.sendmail(FROM_EMAIL, [order.email], msg.as_string())
-                    order.status = 'shipped'
-                    order.save()
-                    self.message_user(request, f"Sent tracking email to {order.email}")
-                except Exception as e:
-                    self.message_user(request, f"Failed to send to {order.email}: {e}", level='error')
+            if order.tracking_number and order.status != 'shipped' and order.id not in already_queued:
+                enqueue_tracking_email(order)
+                queued += 1
+        self.message_user(request, f"Queued {queued} tracking email(s)")
 
     send_tracking_email.short_description = "Send tracking emails for selected orders"
 
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('to_email','kind','status','attempts','next_attempt_at','sent_at','created_at')
+    list_filter = ('status','kind')
+    search_fields = ('to_email',)
+    readonly_fields = ('order','created_at','sent_at','claimed_at','last_error')
+    actions = ['retry_now']
+
+    def retry_now(self, request, queryset):
+        # not 'sending': a worker may be delivering it right now (stale claims
+        # are picked up again by claim_batch after STALE_CLAIM)
+        n = queryset.filter(status__in=('pending', 'failed')).update(
+            status='pending', next_attempt_at=timezone.now(), attempts=0, claimed_at=None,
+        )
+        self.message_user(request, f"Requeued {n} email(s)")
+
+    retry_now.short_description = "Retry selected emails now"
+
 class ImportBatchForm(forms.ModelForm):
     upload_zip = forms.FileField(
         required=False, 
@@ -110,9 +115,12 @@ class ImportBatchAdmin(admin.ModelAdmin):
                 with open(json_path, 'r', encoding='utf-8') as f:
                     data = json.load(f)
 
-                # Import cards + images in a transaction
+                # Import cards + images in a transaction; a replace import's generation
+                # is switched in after that commits, in a short transaction of its own
                 with transaction.atomic():
-                    created, updated, deleted = self.import_zip_data(obj, data, tmpdir)
+                    created, updated, deleted, generation = self.import_zip_data(obj, data, tmpdir)
+                if generation:
+                    generations.activate(generation)
 
                 self.message_user(
                     request, 
@@ -126,29 +134,26 @@ class ImportBatchAdmin(admin.ModelAdmin):
     def import_zip_data(self, batch, data, tmpdir):
         """
         Replace-capable importer:
-        - If batch.mode == 'replace' -> delete ALL CollectionImage files and CollectionCard rows first
+        - If batch.mode == 'replace' -> build a new catalog generation beside the live one,
+          returned for the caller to activate once this commits (collection.generations);
+          the old rows and their images stay until `manage.py gc_catalog` collects them
         - Then recreate CollectionCard rows from JSON and save images under MEDIA_ROOT with the same basename
         - Merge mode behaves as before (only updates/creates)
         """
         created = updated = deleted = 0
+        images = 0
         incoming_ids = set()
         is_replace = batch.mode == 'replace'
+        started = time.perf_counter()
 
-        # ---------- FULL TABLE WIPE for REPLACE ----------
+        # ---------- NEW GENERATION for REPLACE ----------
+        # the live catalog stays readable (and its carts checkout-able) until activate() below
+        generation = None
+        cards = CollectionCard.objects
         if is_replace:
-            # Delete all image files and image rows
-            for img in CollectionImage.objects.all():
-                try:
-                    path = os.path.join(settings.MEDIA_ROOT, str(img.img))
-                    if os.path.exists(path):
-                        os.remove(path)
-                except Exception:
-                    pass
-                img.delete()
-
-            # Delete all collection cards
+            generation = generations.begin(batch)
+            cards = CollectionCard.all_generations.filter(generation=generation.pk)
             deleted = CollectionCard.objects.count()
-            CollectionCard.objects.all().delete()
 
         # ---------- IMPORT LOOP ----------
         for c in data.get('cards', []):
@@ -174,8 +179,8 @@ class ImportBatchAdmin(admin.ModelAdmin):
                 )
 
             # --- CollectionCard ---
-            # In replace mode the table was just cleared so this will be None and we'll create a new row.
-            coll_card = CollectionCard.objects.filter(
+            # In replace mode the new generation starts empty, so this only finds repeats within this file.
+            coll_card = cards.filter(
                 exported_id=exported_id,
                 import_batch=batch
             ).first()
@@ -250,7 +255,8 @@ class ImportBatchAdmin(admin.ModelAdmin):
                     effective_mid=effective_mid,
                     pricing_source=pricing_source,
                     import_batch=batch,
-                    exported_id=exported_id
+                    exported_id=exported_id,
+                    generation=generation.pk if generation else None,
                 )
                 created += 1
 
@@ -279,12 +285,19 @@ class ImportBatchAdmin(admin.ModelAdmin):
                         collection_card=coll_card,
                         img=img_filename
                     )
+                    images += 1
 
-        # --- If you still want to delete any remaining old rows not present in JSON when using replace, you can do it,
-        #     but we've already nuked the table at the start of replace so there's nothing left to delete here. ---
-        # (keep for parity with previous logic if you switch to less-aggressive replace later)
+        # --- Old rows not present in JSON simply aren't part of the new generation when using replace. ---
 
-        return created, updated, deleted
+        reprice(CollectionCard.all_generations.filter(import_batch=batch))
+        record_price_history(batch, generation=generation.pk if generation else None)
+        if generation is None:
+            # activate() rebuilds them for a replace
+            rollups.schedule_rebuild()
+
+        metrics.import_finished('zip', created + updated, images, time.perf_counter() - started)
+
+        return created, updated, deleted, generation
 
 
 
@@ -297,11 +310,214 @@ class CardAdmin(admin.ModelAdmin):
 class CardSetAdmin(admin.ModelAdmin):
     list_display = ('name','code','release_date')
 
+class CollectionCardActionForm(ActionForm):
+    # parameters for the bulk edit actions
+    percent = forms.DecimalField(required=False, max_digits=6, decimal_places=2, label='Markup %',
+                                 help_text='e.g. 10 or -5')
+    quantity = forms.IntegerField(required=False, min_value=0, label='Quantity')
+
+
+class RollupCountPaginator(Paginator):
+    """Paginator that takes its total from the inventory rollups when it has one, instead of COUNT(*)."""
+
+    def __init__(self, *args, total=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.total = total
+
+    @cached_property
+    def count(self):
+        return self.total if self.total is not None else super().count
+
+
 @admin.register(CollectionCard)
 class CollectionCardAdmin(admin.ModelAdmin):
     list_display = ('card','card_set','edition','quantity','value_mid','import_batch')
+    list_select_related = ('card','card_set','import_batch')
     list_filter = ('import_batch',)
+    # matched as prefixes of the indexed name_key/code_key columns, see get_search_results
     search_fields = ('card__name','card_set__name','card_set__code')
+    search_help_text = 'Card or set name / set code, or Konami ID'
+    # no second COUNT(*) of the whole table next to filtered results
+    show_full_result_count = False
+    action_form = CollectionCardActionForm
+    actions = ['export_json', 'export_zip', 'apply_markup', 'set_quantity', 'reset_reserved']
+
+    def get_search_results(self, request, queryset, search_term):
+        # the whole term prefix-matches an indexed key; icontains across the joins can't use an index
+        term = search_term.strip()
+        if len(term) > 1 and term[0] in '"\'' and term[0] == term[-1]:
+            term = unescape_string_literal(term)
+        key = lookup_key(term)
+        if not key:
+            return queryset, False
+        sets = CardSet.objects.filter(Q(name_key__startswith=key) | Q(code_key__startswith=key)).values('id')
+        match = Q(card__in=Card.objects.filter(name_key__startswith=key).values('id')) | Q(card_set__in=sets)
+        if key.isdigit():
+            match |= Q(card__in=Card.objects.filter(konami_id=int(key)).values('id'))
+        matched = queryset.filter(match)
+        if matched.exists():
+            return matched, False
+        # words from the middle of a name ("white dragon"): Django's per-word icontains search
+        return super().get_search_results(request, queryset, search_term)
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        total = None
+        params = set(request.GET) - {'p', 'o'}
+        if not params:
+            total = rollups.listing_count()
+        elif params == {'import_batch__id__exact'}:
+            total = rollups.listing_count(request.GET['import_batch__id__exact'])
+        return RollupCountPaginator(queryset, per_page, orphans, allow_empty_first_page, total=total)
+
+    # bulk edits: one UPDATE over the selection; .update() skips the
+    # post_save signal, so the catalog version is bumped by hand
+    def _bulk_update(self, request, queryset, message, prices_changed=False, **values):
+        with transaction.atomic():
+            n = queryset.update(**values)
+            if prices_changed:
+                reprice(queryset)
+            CatalogState.bump()
+            rollups.schedule_rebuild()
+        self.message_user(request, message.format(n=n))
+
+    def apply_markup(self, request, queryset):
+        # a storefront markup on top of the pricing rules; the imported market values stay as they are
+        percent = self._action_param(request, 'percent')
+        if percent is None:
+            return
+        self._bulk_update(
+            request, queryset, f"Set a {percent}% markup on {{n}} card(s)", prices_changed=True,
+            markup_percent=float(percent),
+        )
+
+    apply_markup.short_description = "Set storefront markup of selected cards to Markup %% (0 clears it)"
+
+    def set_quantity(self, request, queryset):
+        quantity = self._action_param(request, 'quantity')
+        if quantity is None:
+            return
+        # never below what open checkouts hold
+        self._bulk_update(
+            request, queryset, f"Set quantity to {quantity} on {{n}} card(s)",
+            quantity=Greatest(quantity, F('reserved')),
+        )
+
+    set_quantity.short_description = "Set quantity of selected cards to Quantity"
+
+    def reset_reserved(self, request, queryset):
+        self._bulk_update(request, queryset.filter(reserved__gt=0), "Cleared reservations on {n} card(s)", reserved=0)
+
+    reset_reserved.short_description = "Reset reserved stock of selected cards"
+
+    def _action_param(self, request, name):
+        form = self.action_form(request.POST)
+        # the action choice itself isn't bound here; only this field's cleaning matters
+        form.is_valid()
+        value = form.cleaned_data.get(name)
+        if value is None:
+            label = form.fields[name].label
+            self.message_user(request, f'Enter a valid "{label}" value for this action', level=messages.ERROR)
+        return value
+
+    def _export(self, queryset, fmt):
+        response = StreamingHttpResponse(exporter.stream(fmt, queryset), content_type=exporter.CONTENT_TYPES[fmt])
+        response['Content-Disposition'] = f'attachment; filename="{exporter.filename(fmt)}"'
+        return response
+
+    def export_json(self, request, queryset):
+        return self._export(queryset, 'json')
+
+    export_json.short_description = "Export selected cards (JSON)"
+
+    def export_zip(self, request, queryset):
+        return self._export(queryset, 'zip')
+
+    export_zip.short_description = "Export selected cards with images (ZIP)"
+
+    # edits here can move a listing between groups; regroup on commit
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        reprice(CollectionCard.all_generations.filter(pk=obj.pk))
+        rollups.schedule_rebuild()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        rollups.schedule_rebuild()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        rollups.schedule_rebuild()
+
+@admin.register(PricingRule)
+class PricingRuleAdmin(admin.ModelAdmin):
+    """Every change reprices the whole catalog in one UPDATE once it commits (see collection.pricing)."""
+    list_display = ('name','active','priority','condition','edition','psa','card_set','markup_percent','floor','rounding')
+    list_editable = ('active','priority')
+    list_filter = ('active',)
+    raw_id_fields = ('card_set',)
+    actions = ['reprice_all']
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        schedule_reprice()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        schedule_reprice()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        schedule_reprice()
+
+    def reprice_all(self, request, queryset):
+        n = reprice()
+        # stock values follow the new prices
+        rollups.rebuild()
+        self.message_user(request, f"Repriced {n} listing(s)")
+
+    reprice_all.short_description = "Reprice every listing with the active rules now"
+
+@admin.register(InventoryRollup)
+class InventoryRollupAdmin(admin.ModelAdmin):
+    """Inventory report: reads the precomputed rows only (see collection.rollups)."""
+    list_display = ('label_display','dimension','listings','units','reserved','available','value_display','updated_at')
+    list_display_links = None
+    list_filter = ('dimension',)
+    search_fields = ('label',)
+    ordering = ('dimension','-value')
+
+    @admin.display(description='Group', ordering='label')
+    def label_display(self, obj):
+        return obj.label or '(none)'
+
+    @admin.display(description='Value', ordering='value')
+    def value_display(self, obj):
+        return f"${obj.value:,.2f}"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(CatalogGeneration)
+class CatalogGenerationAdmin(admin.ModelAdmin):
+    """Replace-import generations (see collection.generations); written by the importer and gc_catalog only."""
+    list_display = ('id','status','import_batch','created_at','activated_at','retired_at')
+    list_filter = ('status',)
+    ordering = ('-id',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 @admin.register(CollectionImage)
 class CollectionImageAdmin(admin.ModelAdmin):
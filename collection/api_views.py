@@ -1,8 +1,22 @@
-from django.http import JsonResponse
-from django.shortcuts import get_object_or_404
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404, JsonResponse, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.shortcuts import get_object_or_404, render
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from .models import CollectionCard
+from . import metrics as metrics_registry
+from . import valuation as collection_valuation
+from . import sales as collection_sales
+from . import profiling
+from . import snapshot
 from django.views.decorators.http import require_GET
+from .polling import poll_interval
 
+@poll_interval
 @require_GET
 def card_status(request, card_id):
     card = get_object_or_404(CollectionCard, id=card_id)
@@ -17,3 +31,94 @@ def card_status(request, card_id):
         "reserved": card.reserved,
         "available": available,
     })
+
+
+@poll_interval
+@require_GET
+def catalog_snapshot(request, name):
+    # products.json / status.bin, read from disk without touching the database
+    return snapshot.serve(request, name)
+
+
+@require_GET
+def metrics(request):
+    # Scrapers authenticate with METRICS_TOKEN; without one only staff can look.
+    token = settings.METRICS_TOKEN
+    if token:
+        auth = request.headers.get('Authorization', '')
+        if not constant_time_compare(auth, f"Bearer {token}"):
+            return HttpResponseForbidden()
+    elif not request.user.is_staff:
+        return HttpResponseForbidden()
+
+    return HttpResponse(
+        metrics_registry.render_prometheus(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
+@require_GET
+def valuation(request):
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    return JsonResponse(collection_valuation.current_valuation())
+
+
+@require_GET
+def valuation_history(request):
+    # ?group=set|edition splits the total
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    return JsonResponse(collection_valuation.value_history(request.GET.get('group')))
+
+
+def _since(request):
+    # ?days=N limits a report to the last N days
+    try:
+        days = int(request.GET.get('days', ''))
+    except ValueError:
+        return None
+    return timezone.now() - timedelta(days=days)
+
+
+@require_GET
+def sales(request):
+    # ?group=card|set
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    group = request.GET.get('group', 'card')
+    if group not in collection_sales.GROUPS:
+        return HttpResponseBadRequest('group must be one of: ' + ', '.join(collection_sales.GROUPS))
+    return JsonResponse({'rows': collection_sales.sales_by(group, _since(request))})
+
+
+@require_GET
+def sales_revenue(request):
+    # ?period=day|week|month
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    period = request.GET.get('period', 'day')
+    if period not in collection_sales.PERIODS:
+        return HttpResponseBadRequest('period must be one of: ' + ', '.join(collection_sales.PERIODS))
+    return JsonResponse(collection_sales.revenue_over_time(period, _since(request)))
+
+
+@staff_member_required
+@require_GET
+def profiles(request):
+    # artifacts written by ProfilingMiddleware (?_profile=1)
+    return render(request, 'collection/profiles.html', {
+        **admin.site.each_context(request),
+        'title': 'Request profiles',
+        'profiles': profiling.summaries(),
+        'param': profiling.PROFILE_PARAM,
+    })
+
+
+@staff_member_required
+@require_GET
+def profile_download(request, artifact_id, ext):
+    path = profiling.artifact_path(artifact_id, ext)
+    if path is None:
+        raise Http404
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f"profile-{artifact_id}.{ext}")
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 class CollectionConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'collection'
+
+    def ready(self):
+        # connects the write-through catalog snapshot to catalog_changed
+        from . import snapshot  # noqa: F401
@@ -0,0 +1,202 @@
+"""
+Async versions of the payment-bound and polled endpoints, routed in when
+ASYNC_VIEWS is on (see ygostore/asgi.py).
+
+Stock is reserved with conditional UPDATEs before the gateway is called,
+so no row lock or DB connection is held while waiting on Stripe; a
+failed call releases the reservation again. Anything that needs a
+transaction runs through sync_to_async, since the async ORM has none.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse
+from django.conf import settings
+from django.shortcuts import aget_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET
+
+from . import generations, inventory, metrics
+from .models import CollectionCard
+from .payments import get_gateway, PaymentGatewayUnavailable
+from .polling import poll_interval
+from .views import (
+    get_sell_price, _cart_line_item, _cart_session_params, _single_session_params,
+    reserved_items_from_metadata, record_sale, release_reserved,
+)
+
+UNAVAILABLE = "Payments are temporarily unavailable, please try again shortly"
+
+
+def _image_urls(request, c):
+    # images are prefetched; .all() doesn't query
+    images = list(c.images.all())[:1]
+    return [request.build_absolute_uri(img.img.url) for img in images]
+
+
+def _checkout_cards():
+    return CollectionCard.objects.select_related('card', 'card_set').prefetch_related('images')
+
+
+@csrf_exempt
+async def create_checkout_session(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=400)
+
+    try:
+        data = json.loads(request.body)
+        collection_card_id = int(data.get('collection_card_id'))
+        qty = int(data.get('quantity', 1))
+    except Exception:
+        return JsonResponse({'error': 'invalid payload'}, status=400)
+
+    try:
+        c = await _checkout_cards().aget(id=collection_card_id)
+    except CollectionCard.DoesNotExist:
+        return JsonResponse({'error': 'Not found'}, status=404)
+
+    items = [{"id": c.id, "qty": qty}]
+    try:
+        await sync_to_async(inventory.reserve)(items)
+    except inventory.InsufficientStock:
+        return JsonResponse({'error': 'Not enough stock'}, status=400)
+
+    try:
+        session = await get_gateway().acreate_checkout_session(
+            **_single_session_params(c, qty, _image_urls(request, c))
+        )
+    except PaymentGatewayUnavailable:
+        await sync_to_async(inventory.release)(items)
+        return JsonResponse({'error': UNAVAILABLE}, status=503)
+    except Exception as e:
+        await sync_to_async(inventory.release)(items)
+        return JsonResponse({'error': str(e)}, status=500)
+
+    metrics.inventory('reserved', qty)
+
+    return JsonResponse({'url': session.url})
+
+
+@csrf_exempt
+async def create_cart_checkout_session(request):
+    cart = await request.session.aget("cart", {})
+    if not cart:
+        return JsonResponse({"error": "Cart empty"}, status=400)
+    cart = await sync_to_async(generations.remap_cart)(cart)
+
+    reserved_items = [{"id": int(card_id), "qty": qty} for card_id, qty in cart.items()]
+    cards = await _checkout_cards().ain_bulk([item["id"] for item in reserved_items])
+    if len(cards) != len(reserved_items):
+        return JsonResponse({"error": "Checkout failed"}, status=500)
+
+    try:
+        await sync_to_async(inventory.reserve)(reserved_items)
+    except inventory.InsufficientStock as e:
+        return JsonResponse({"error": f"Not enough stock for {cards[e.card_id].card.name}"}, status=409)
+
+    line_items = [
+        _cart_line_item(cards[item["id"]], item["qty"], _image_urls(request, cards[item["id"]]))
+        for item in reserved_items
+    ]
+    try:
+        session = await get_gateway().acreate_checkout_session(
+            **_cart_session_params(line_items, reserved_items)
+        )
+    except PaymentGatewayUnavailable:
+        await sync_to_async(inventory.release)(reserved_items)
+        return JsonResponse({"error": UNAVAILABLE}, status=503)
+    except Exception:
+        await sync_to_async(inventory.release)(reserved_items)
+        return JsonResponse({"error": "Checkout failed"}, status=500)
+
+    metrics.inventory('reserved', sum(item["qty"] for item in reserved_items))
+
+    # Clear cart only AFTER session succeeds
+    await request.session.aset("cart", {})
+
+    return JsonResponse({"url": session.url})
+
+
+@csrf_exempt
+async def stripe_webhook(request):
+    payload = request.body
+    sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
+    webhook_secret = settings.STRIPE_WEBHOOK_SECRET
+
+    try:
+        if webhook_secret:
+            event = get_gateway().construct_event(payload, sig_header, webhook_secret)
+        else:
+            event = json.loads(payload)
+    except Exception:
+        return HttpResponse(status=400)
+
+    event_type = event.get("type")
+    sess = event["data"]["object"]
+    reserved_items = reserved_items_from_metadata(sess.get("metadata", {}))
+
+    if event_type == "checkout.session.completed":
+        await sync_to_async(record_sale)(sess, reserved_items)
+        metrics.inventory('sold', sum(item["qty"] for item in reserved_items))
+
+    elif event_type in (
+        "checkout.session.expired",
+        "payment_intent.payment_failed",
+    ):
+        await sync_to_async(release_reserved)(reserved_items)
+        metrics.inventory('released', sum(item["qty"] for item in reserved_items))
+
+    metrics.webhook_processed(event_type, event.get("created"))
+
+    return HttpResponse(status=200)
+
+
+@poll_interval
+@require_GET
+async def card_status(request, card_id):
+    card = await aget_object_or_404(CollectionCard, id=card_id)
+
+    available = card.quantity - card.reserved
+
+    return JsonResponse({
+        "id": card.id,
+        "is_sold_out": available <= 0,
+        "is_reserved": card.reserved > 0 and available > 0,
+        "quantity": card.quantity,
+        "reserved": card.reserved,
+        "available": available,
+    })
+
+
+@poll_interval
+async def cart_status(request):
+    cart = await request.session.aget('cart', {})
+    cards = await CollectionCard.objects.ain_bulk([int(card_id) for card_id in cart])
+    if len(cards) < len(cart):
+        # ids left behind by a catalog swap move to the live row for the same listing
+        cart = await sync_to_async(generations.remap_cart)(cart, live_ids=cards)
+        cards = await CollectionCard.objects.ain_bulk([int(card_id) for card_id in cart])
+
+    total = 0
+    updated_cart = cart.copy()
+    for card_id_str, qty in cart.items():
+        card = cards.get(int(card_id_str))
+        available = card.quantity - card.reserved if card else 0
+
+        if available <= 0:
+            # remove from cart if sold/reserved
+            updated_cart.pop(card_id_str, None)
+            continue
+        # cap quantity to available stock
+        if qty > available:
+            updated_cart[card_id_str] = available
+            qty = available
+        total += get_sell_price(card) * qty
+
+    await request.session.aset('cart', updated_cart)
+
+    return JsonResponse({
+        'cart': updated_cart,
+        'cart_count': sum(updated_cart.values()),
+        'total': total
+    })
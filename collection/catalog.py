@@ -0,0 +1,151 @@
+import gzip
+import time
+from typing import NamedTuple
+
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only when Brotli isn't installed
+    brotli = None
+
+# payloads are keyed by catalog version, so the timeout only bounds memory
+CATALOG_CACHE_TIMEOUT = 60 * 60
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+MIN_COMPRESS_SIZE = 200
+
+# single-flight rebuilds (coalesced_payload): how long a rebuild may hold
+# its lock, how long a request with nothing stale to serve waits on
+# someone else's rebuild before building itself, and how long the last
+# good payload is kept around to be served stale
+REBUILD_LOCK_TIMEOUT = 30
+REBUILD_WAIT = 5
+REBUILD_POLL_INTERVAL = 0.05
+STALE_TIMEOUT = 24 * 60 * 60
+STALE_WARNING = '110 - "Response is Stale"'
+REVALIDATION_FAILED_WARNING = '111 - "Revalidation Failed"'
+
+
+def _accepted_encodings(request):
+    header = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    accepted = set()
+    for part in header.split(','):
+        token, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        if token:
+            accepted.add(token.strip().lower())
+    return accepted
+
+
+def negotiate_encoding(request):
+    """Pick the best content-coding the client accepts: br > gzip > identity."""
+    accepted = _accepted_encodings(request)
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return 'identity'
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        # mtime=0 keeps the output byte-identical across workers
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    return body
+
+
+def _variants(raw):
+    variants = {'identity': raw, 'gzip': compress(raw, 'gzip')}
+    if brotli is not None:
+        variants['br'] = compress(raw, 'br')
+    return variants
+
+
+def cached_payload(key, build):
+    """
+    Return {encoding: bytes} for a payload, building and compressing it at
+    most once per cache key. `build` returns the raw (identity) bytes.
+    """
+    variants = cache.get(key)
+    if variants is None:
+        variants = _variants(build())
+        cache.set(key, variants, CATALOG_CACHE_TIMEOUT)
+    return variants
+
+
+class Payload(NamedTuple):
+    variants: dict
+    etag: str
+    # Warning header value when a stale copy is served
+    warning: str = None
+
+
+def coalesced_payload(key, build, etag, stale_key):
+    """
+    cached_payload for endpoints every poller hits right after a catalog
+    change. Only one request per key rebuilds (the lock is a cache.add, so
+    it spans workers when CACHE_URL points at a shared cache); the others
+    are served the last good payload kept under `stale_key` meanwhile, or
+    wait for the rebuild when there is none yet. A rebuild that fails on
+    the database also falls back to the stale copy.
+    """
+    variants = cache.get(key)
+    if variants is not None:
+        return Payload(variants, etag)
+
+    lock_key = f"{key}:rebuilding"
+    locked = cache.add(lock_key, 1, REBUILD_LOCK_TIMEOUT)
+    deadline = time.monotonic() + REBUILD_WAIT
+    while not locked:
+        stale = cache.get(stale_key)
+        if stale is not None:
+            return Payload(stale['variants'], stale['etag'], STALE_WARNING)
+        time.sleep(REBUILD_POLL_INTERVAL)
+        variants = cache.get(key)
+        if variants is not None:
+            return Payload(variants, etag)
+        if time.monotonic() >= deadline:
+            # the rebuild is stuck or its worker died; don't hang on it
+            break
+        locked = cache.add(lock_key, 1, REBUILD_LOCK_TIMEOUT)
+
+    try:
+        # another request may have finished it since the first look
+        variants = cache.get(key)
+        if variants is None:
+            try:
+                variants = _variants(build())
+            except DatabaseError:
+                stale = cache.get(stale_key)
+                if stale is None:
+                    raise
+                return Payload(stale['variants'], stale['etag'], REVALIDATION_FAILED_WARNING)
+            cache.set(key, variants, CATALOG_CACHE_TIMEOUT)
+            cache.set(stale_key, {'variants': variants, 'etag': etag}, STALE_TIMEOUT)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return Payload(variants, etag)
+
+
+def encoded_response(request, variants, content_type='application/json', etag=None, warning=None):
+    """Serve the precompressed variant matching the request's Accept-Encoding."""
+    encoding = negotiate_encoding(request)
+    if encoding not in variants:
+        encoding = 'identity'
+    response = HttpResponse(variants[encoding], content_type=content_type)
+    if encoding != 'identity':
+        response['Content-Encoding'] = encoding
+    if etag:
+        response['ETag'] = etag
+    if warning:
+        response['Warning'] = warning
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
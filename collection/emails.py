@@ -0,0 +1,189 @@
+"""
+Email outbox: build messages into OutboundEmail rows, and deliver them
+in batches from the send_outbox worker.
+
+Each worker thread opens one SMTP connection (STARTTLS + login once) and
+sends its whole share of the batch over it, instead of a fresh
+connection per message.
+"""
+import smtplib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Order, OutboundEmail
+
+# a claimed row whose worker died is picked up again after this long
+STALE_CLAIM = timedelta(minutes=10)
+RETRY_BASE_SECONDS = 30
+
+
+def enqueue_tracking_email(order):
+    subject = f"Your Rare Hunter TCG Order #{order.stripe_order_id} Has Shipped!"
+
+    # plain text
+    text = f"""
+Hi {order.email},
+
+Your Rare Hunter TCG order #{order.stripe_order_id} has shipped.
+Tracking Number: {order.tracking_number}
+
+Thank you for shopping with us!
+"""
+    # optional HTML version
+    html = f"""
+<html>
+  <body>
+    <p>Hi {order.email},</p>
+    <p>Your Rare Hunter TCG order <strong>#{order.stripe_order_id}</strong> has shipped.</p>
+    <p>Tracking Number: <strong>{order.tracking_number}</strong></p>
+    <p>Thank you for shopping with us!</p>
+  </body>
+</html>
+"""
+    return OutboundEmail.objects.create(
+        kind='tracking',
+        order=order,
+        to_email=order.email,
+        subject=subject,
+        text_body=text,
+        html_body=html,
+    )
+
+
+def build_message(email):
+    msg = MIMEMultipart('mixed')
+    msg['Subject'] = email.subject
+    msg['From'] = settings.EMAIL_FROM
+    msg['To'] = email.to_email
+    msg.attach(MIMEText(email.text_body, 'plain'))
+    if email.html_body:
+        msg.attach(MIMEText(email.html_body, 'html'))
+    return msg
+
+
+def open_smtp():
+    smtp = smtplib.SMTP(settings.EMAIL_SMTP_HOST, settings.EMAIL_SMTP_PORT,
+                        timeout=settings.EMAIL_SMTP_TIMEOUT)
+    smtp.ehlo()
+    if settings.EMAIL_SMTP_STARTTLS:
+        smtp.starttls()
+        smtp.ehlo()
+    if settings.SMTP2GO_USERNAME:
+        smtp.login(settings.SMTP2GO_USERNAME, settings.SMTP2GO_PASSWORD)
+    return smtp
+
+
+def _send_share(messages):
+    """
+    Send a list of (id, to, MIME string) over one connection.
+    Returns {id: error or None}.
+    """
+    results = {}
+    try:
+        smtp = open_smtp()
+    except Exception as e:
+        return {email_id: f"connect: {e}" for email_id, _, _ in messages}
+
+    try:
+        for email_id, to, payload in messages:
+            try:
+                smtp.sendmail(settings.EMAIL_FROM, [to], payload)
+                results[email_id] = None
+            except smtplib.SMTPServerDisconnected as e:
+                # connection dropped: reconnect once and carry on with the rest
+                results[email_id] = str(e)
+                try:
+                    smtp = open_smtp()
+                except Exception as e:
+                    for rest_id, _, _ in messages:
+                        results.setdefault(rest_id, f"connect: {e}")
+                    return results
+            except Exception as e:
+                results[email_id] = str(e)
+    finally:
+        try:
+            smtp.quit()
+        except Exception:
+            pass
+    return results
+
+
+def claim_batch(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            OutboundEmail.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(status='pending', next_attempt_at__lte=now)
+                | Q(status='sending', claimed_at__lt=now - STALE_CLAIM)
+            )
+            .order_by('next_attempt_at', 'id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        OutboundEmail.objects.filter(id__in=ids).update(status='sending', claimed_at=now)
+    return list(OutboundEmail.objects.filter(id__in=ids).order_by('id'))
+
+
+def send_pending(batch_size=None, concurrency=None):
+    """
+    Deliver one batch of due emails. Returns (sent, retrying, failed).
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    concurrency = max(1, concurrency or settings.EMAIL_OUTBOX_CONCURRENCY)
+
+    emails = claim_batch(batch_size)
+    if not emails:
+        return 0, 0, 0
+
+    messages = [(e.id, e.to_email, build_message(e).as_string()) for e in emails]
+    shares = [messages[i::concurrency] for i in range(concurrency)]
+    shares = [share for share in shares if share]
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(shares)) as pool:
+        for share_results in pool.map(_send_share, shares):
+            results.update(share_results)
+
+    return _record_results(emails, results)
+
+
+def _record_results(emails, results):
+    now = timezone.now()
+    sent_ids, shipped_order_ids = [], []
+    retrying = failed = 0
+
+    for email in emails:
+        error = results.get(email.id, 'not attempted')
+        if error is None:
+            sent_ids.append(email.id)
+            if email.kind == 'tracking' and email.order_id:
+                shipped_order_ids.append(email.order_id)
+            continue
+
+        email.attempts += 1
+        email.last_error = error
+        email.claimed_at = None
+        if email.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+            email.status = 'failed'
+            failed += 1
+        else:
+            email.status = 'pending'
+            email.next_attempt_at = now + timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (email.attempts - 1))
+            retrying += 1
+        email.save(update_fields=['attempts', 'last_error', 'claimed_at', 'status', 'next_attempt_at'])
+
+    with transaction.atomic():
+        OutboundEmail.objects.filter(id__in=sent_ids).update(
+            status='sent', sent_at=now, claimed_at=None, last_error='',
+        )
+        Order.objects.filter(id__in=shipped_order_ids).update(status='shipped', updated_at=now)
+
+    return len(sent_ids), retrying, failed
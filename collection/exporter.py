@@ -0,0 +1,175 @@
+"""
+Streaming export of the collection in the format run_import_batch and the
+admin ZIP import read back in.
+
+Cards are read in chunks with .iterator() and written out as they come,
+so memory stays flat however large the collection is:
+
+- json:   {"meta": {...}, "cards": [...]} (what run_import_batch takes)
+- ndjson: one card payload per line
+- zip:    export.json plus the card images under images/ (what the
+          admin import takes); entries are written to an unseekable
+          stream, so no part of the archive is ever buffered whole
+"""
+import json
+import os
+import shutil
+import zipfile
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import CollectionCard
+
+FORMATS = ('json', 'ndjson', 'zip')
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'zip': 'application/zip',
+}
+EXPORT_NAME = 'export.json'
+IMAGE_DIR = 'images'
+CHUNK_SIZE = 2000
+# cards per yielded piece of text
+FLUSH_EVERY = 200
+
+
+def _dumps(obj):
+    return json.dumps(obj, cls=DjangoJSONEncoder)
+
+
+def export_cards(queryset=None):
+    qs = CollectionCard.objects.all() if queryset is None else queryset
+    return qs.select_related('card', 'card_set').prefetch_related('images').order_by('id')
+
+
+def _first_image(c):
+    # images are prefetched; the importers attach one image per card
+    images = list(c.images.all())
+    return images[0] if images else None
+
+
+def _archive_name(image):
+    return f"{IMAGE_DIR}/{os.path.basename(image.img.name)}"
+
+
+def card_payload(c, in_archive=False):
+    card_set = c.card_set
+    payload = {
+        'id': c.exported_id or c.id,
+        'konami_id': c.card.konami_id,
+        'name': c.card.name,
+        'set': {
+            'name': card_set.name,
+            'code': card_set.code,
+            'release_date': card_set.release_date,
+        } if card_set else None,
+        'edition': c.edition,
+        'condition': c.condition,
+        'quantity': c.quantity,
+        'misprint': c.misprint,
+        'psa': c.psa,
+        'notes': c.notes,
+        'pricing': {
+            'low': c.value_low,
+            'mid': c.value_mid,
+            'high': c.value_high,
+            'effective_mid': c.effective_mid,
+            'source': c.pricing_source,
+        },
+    }
+    image = _first_image(c)
+    if image:
+        payload['images'] = {'img': _archive_name(image) if in_archive else image.img.name}
+    return payload
+
+
+def _meta():
+    return {'exported_at': timezone.now()}
+
+
+def iter_json(queryset=None, in_archive=False):
+    """Yield the export document as str pieces."""
+    yield '{"meta": ' + _dumps(_meta()) + ', "cards": ['
+    pieces = []
+    first = True
+    for c in export_cards(queryset).iterator(chunk_size=CHUNK_SIZE):
+        pieces.append(('' if first else ',') + '\n' + _dumps(card_payload(c, in_archive)))
+        first = False
+        if len(pieces) >= FLUSH_EVERY:
+            yield ''.join(pieces)
+            pieces = []
+    pieces.append('\n]}\n')
+    yield ''.join(pieces)
+
+
+def iter_ndjson(queryset=None):
+    pieces = []
+    for c in export_cards(queryset).iterator(chunk_size=CHUNK_SIZE):
+        pieces.append(_dumps(card_payload(c)) + '\n')
+        if len(pieces) >= FLUSH_EVERY:
+            yield ''.join(pieces)
+            pieces = []
+    if pieces:
+        yield ''.join(pieces)
+
+
+class _ChunkSink:
+    """Write-only file for ZipFile; whatever it writes is handed on by drain()."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def iter_zip(queryset=None):
+    """Yield a ZIP archive (export.json + images) as bytes pieces."""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        # size unknown up front, so allow for >4GB
+        with zf.open(EXPORT_NAME, 'w', force_zip64=True) as entry:
+            for piece in iter_json(queryset, in_archive=True):
+                entry.write(piece.encode('utf-8'))
+                yield sink.drain()
+
+        # a second pass for the images: only one entry can be open at a time
+        written = set()
+        for c in export_cards(queryset).iterator(chunk_size=CHUNK_SIZE):
+            image = _first_image(c)
+            if not image:
+                continue
+            name = _archive_name(image)
+            if name in written:
+                continue
+            try:
+                src = image.img.open('rb')
+            except (FileNotFoundError, ValueError):
+                continue
+            with src, zf.open(name, 'w', force_zip64=True) as entry:
+                shutil.copyfileobj(src, entry)
+            written.add(name)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def stream(fmt, queryset=None):
+    """Bytes pieces of the export in `fmt` (one of FORMATS)."""
+    if fmt == 'zip':
+        return (piece for piece in iter_zip(queryset) if piece)
+    pieces = iter_ndjson(queryset) if fmt == 'ndjson' else iter_json(queryset)
+    return (piece.encode('utf-8') for piece in pieces)
+
+
+def filename(fmt):
+    return f"collection-{timezone.now():%Y%m%d-%H%M%S}.{fmt}"
@@ -0,0 +1,145 @@
+"""
+Facet counts for the storefront filters, aggregated in SQL.
+
+Each facet is counted with every *other* active filter applied, so e.g.
+the set dropdown still shows how many cards the other sets have while
+one set is selected.
+"""
+from django.db.models import Case, CharField, Count, F, FloatField, Q, Value, When
+from django.db.models.functions import Coalesce, NullIf
+
+from .models import CollectionCard
+
+# (key, label, min dollars inclusive, max dollars exclusive)
+PRICE_BUCKETS = [
+    ('0-5', 'Under $5', 0, 5),
+    ('5-10', '$5 - $10', 5, 10),
+    ('10-25', '$10 - $25', 10, 25),
+    ('25-50', '$25 - $50', 25, 50),
+    ('50-100', '$50 - $100', 50, 100),
+    ('100-250', '$100 - $250', 100, 250),
+    ('250+', '$250 and up', 250, None),
+]
+
+FILTER_PARAMS = ('q', 'set', 'edition', 'condition', 'graded', 'price')
+MAX_FILTER_LENGTH = 100
+
+UNGRADED = Q(psa__isnull=True) | Q(psa='')
+
+
+def parse_filters(params):
+    """The known, non-empty filters from a QueryDict."""
+    filters = {}
+    for name in FILTER_PARAMS:
+        value = params.get(name, '').strip()
+        if value:
+            filters[name] = value[:MAX_FILTER_LENGTH]
+    return filters
+
+
+def market_price():
+    # effective_mid or value_mid or 0; what the pricing rules start from
+    return Coalesce(
+        NullIf(F('effective_mid'), Value(0.0)),
+        NullIf(F('value_mid'), Value(0.0)),
+        Value(0.0),
+        output_field=FloatField(),
+    )
+
+
+def sell_price():
+    # SQL version of products.get_sell_price: the repriced price, else the market price
+    return Coalesce(F('sell_price'), market_price(), output_field=FloatField())
+
+
+def _price_bucket():
+    return Case(
+        *[When(price__lt=high, then=Value(key)) for key, _, _, high in PRICE_BUCKETS if high is not None],
+        default=Value(PRICE_BUCKETS[-1][0]),
+        output_field=CharField(),
+    )
+
+
+def _filter_q(name, value):
+    if name == 'q':
+        # same fields the storefront search box matches on
+        return (
+            Q(card__name__icontains=value)
+            | Q(card__konami_id__icontains=value)
+            | Q(card_set__name__icontains=value)
+            | Q(card_set__code__icontains=value)
+            | Q(edition__icontains=value)
+            | Q(condition__icontains=value)
+            | Q(misprint__icontains=value)
+        )
+    if name == 'set':
+        return Q(card_set__name=value)
+    if name == 'edition':
+        return Q(edition=value)
+    if name == 'condition':
+        return Q(condition=value)
+    if name == 'graded':
+        return ~UNGRADED if value.lower() in ('1', 'true', 'yes') else UNGRADED
+    if name == 'price':
+        for key, _, low, high in PRICE_BUCKETS:
+            if key == value:
+                q = Q(price__gte=low)
+                if high is not None:
+                    q &= Q(price__lt=high)
+                return q
+        return Q(pk__in=[])
+    raise ValueError(name)
+
+
+def facet_counts(filters):
+    base = CollectionCard.objects.annotate(price=sell_price())
+
+    def narrowed(facet=None):
+        q = Q()
+        for name, value in filters.items():
+            if name != facet:
+                q &= _filter_q(name, value)
+        return base.filter(q)
+
+    def value_counts(facet, field):
+        rows = (
+            narrowed(facet)
+            .exclude(**{f'{field}__isnull': True}).exclude(**{field: ''})
+            .values(field).annotate(count=Count('id')).order_by(field)
+        )
+        return [{'value': row[field], 'count': row['count']} for row in rows]
+
+    sets = [
+        {'name': row['value'], 'count': row['count']}
+        for row in value_counts('set', 'card_set__name')
+    ]
+
+    graded = narrowed('graded').aggregate(
+        graded=Count('id', filter=~UNGRADED),
+        ungraded=Count('id', filter=UNGRADED),
+    )
+
+    bucket_counts = dict(
+        narrowed('price').annotate(bucket=_price_bucket())
+        .values('bucket').annotate(count=Count('id')).values_list('bucket', 'count')
+    )
+    prices = [
+        {
+            'key': key,
+            'label': label,
+            'min_cents': low * 100,
+            'max_cents': high * 100 if high is not None else None,
+            'count': bucket_counts.get(key, 0),
+        }
+        for key, label, low, high in PRICE_BUCKETS
+    ]
+
+    return {
+        'filters': filters,
+        'total': narrowed().count(),
+        'sets': sets,
+        'editions': value_counts('edition', 'edition'),
+        'conditions': value_counts('condition', 'condition'),
+        'graded': graded,
+        'prices': prices,
+    }
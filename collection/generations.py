@@ -0,0 +1,200 @@
+"""
+Blue/green catalog generations for replace imports.
+
+A replace import writes its CollectionCard rows into a new generation
+beside the live one (begin), then activate() switches
+CatalogState.active_generation in one short transaction of its own, run
+after the build has committed. Until then the storefront, carts and
+checkouts keep using the live rows untouched, and nothing holds locks on
+them while the import runs. Every stock move (reserve, release, sale)
+first takes hold_live_generation(), so none can land on an old row while
+activate() is carrying reservations over.
+
+Retired rows stay in place so checkouts started before the swap still
+complete: activate() carries open reservations over to the matching new
+row (by exported_id) and records it as the old row's successor, which
+forward() follows when the sale or release comes in. Carts holding old
+ids are moved over by remap_cart(). collect_garbage() (`manage.py
+gc_catalog`) deletes retired generations once no checkout can refer to
+them any more.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import rollups
+from .models import CatalogGeneration, CatalogState, CollectionCard
+
+GC_CHUNK_SIZE = 500
+
+
+def begin(import_batch=None):
+    """A new, empty generation to build into."""
+    return CatalogGeneration.objects.create(import_batch=import_batch)
+
+
+def hold_live_generation():
+    """
+    Lock the CatalogState row FOR KEY SHARE until the current transaction
+    ends. Stock moves hold it together, while activate()'s FOR UPDATE needs
+    it exclusively, so a swap waits for the reservations in flight and
+    later ones see the new generation. KEY SHARE rather than SHARE: the
+    version bump on every commit is a plain UPDATE, which KEY SHARE doesn't
+    block, so bumps never queue behind checkouts waiting on Stripe.
+    """
+    conn = transaction.get_connection()
+    if not conn.features.has_select_for_update:
+        # SQLite: one writer at a time already
+        return
+    CatalogState.objects.get_or_create(pk=CatalogState.SINGLETON_ID)
+    table = conn.ops.quote_name(CatalogState._meta.db_table)
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT 1 FROM {table} WHERE id = %s FOR KEY SHARE", [CatalogState.SINGLETON_ID])
+
+
+def activate(generation):
+    """
+    Make `generation` the live catalog. Call it once the build has
+    committed, outside any transaction, so the swap is its own short one.
+    Returns the number of carried reservations.
+    """
+    if transaction.get_connection().in_atomic_block:
+        raise RuntimeError("activate() must not run inside another transaction")
+    now = timezone.now()
+    carried = 0
+    with transaction.atomic():
+        # waits for stock moves holding hold_live_generation(), and blocks new ones until the swap commits
+        state, _ = CatalogState.objects.select_for_update().get_or_create(pk=CatalogState.SINGLETON_ID)
+        previous = state.active_generation
+
+        # only rows mid-checkout; the rest of the old generation isn't touched
+        held = (
+            CollectionCard.all_generations.select_for_update()
+            .filter(generation=previous, reserved__gt=0, exported_id__isnull=False)
+            .values_list('id', 'exported_id', 'reserved')
+        )
+        for old_id, exported_id, reserved in held:
+            new_id = (
+                CollectionCard.all_generations.filter(generation=generation.pk, exported_id=exported_id)
+                .order_by('id').values_list('id', flat=True).first()
+            )
+            if new_id is None:
+                continue
+            CollectionCard.all_generations.filter(id=new_id).update(reserved=F('reserved') + reserved)
+            CollectionCard.all_generations.filter(id=old_id).update(successor_id=new_id)
+            carried += 1
+
+        CatalogState.objects.filter(pk=state.pk).update(active_generation=generation.pk)
+        CatalogGeneration.objects.filter(pk=previous).update(status='retired', retired_at=now)
+        CatalogGeneration.objects.filter(pk=generation.pk).update(status='live', activated_at=now)
+        CatalogState.bump()
+        # the rollups group the live generation
+        rollups.schedule_rebuild()
+    return carried
+
+
+def locked_current(card_id):
+    """
+    The row now holding card_id's reservation, locked. Successors are
+    followed under the lock, so a swap that commits while we wait on it
+    is seen.
+    """
+    c = CollectionCard.all_generations.select_for_update().get(id=card_id)
+    while c.successor_id:
+        c = CollectionCard.all_generations.select_for_update().get(id=c.successor_id)
+    return c
+
+
+def forward(items):
+    """
+    [{"id", "qty"}, ...] with each id replaced by the row its reservation
+    was carried over to, following successors across several swaps.
+    """
+    successors = {}
+    pending = {item["id"] for item in items}
+    while pending:
+        step = dict(
+            CollectionCard.all_generations.filter(id__in=pending, successor__isnull=False)
+            .values_list('id', 'successor_id')
+        )
+        successors.update(step)
+        pending = set(step.values()) - successors.keys()
+
+    def final(card_id):
+        while card_id in successors:
+            card_id = successors[card_id]
+        return card_id
+
+    return [{**item, "id": final(item["id"])} for item in items]
+
+
+def remap_cart(cart, live_ids=None):
+    """
+    The session cart with ids left behind by a swap moved to the live
+    row for the same listing (successor, else same exported_id); ids with
+    no live equivalent are kept and dropped by the caller as sold out.
+    `live_ids` are ids already known to be live, to save the lookup.
+    """
+    ids = {int(card_id) for card_id in cart}
+    if live_ids is None:
+        live_ids = set(CollectionCard.objects.filter(id__in=ids).values_list('id', flat=True))
+    stale = ids - set(live_ids)
+    if not stale:
+        return cart
+
+    moved = {}
+    by_export = {}
+    for old_id, successor_id, exported_id in (
+        CollectionCard.all_generations.filter(id__in=stale).values_list('id', 'successor_id', 'exported_id')
+    ):
+        if successor_id:
+            moved[old_id] = successor_id
+        elif exported_id is not None:
+            by_export[exported_id] = old_id
+    if by_export:
+        for exported_id, live_id in (
+            CollectionCard.objects.filter(exported_id__in=list(by_export)).order_by('-id')
+            .values_list('exported_id', 'id')
+        ):
+            moved[by_export[exported_id]] = live_id
+
+    remapped = {}
+    for card_id, qty in cart.items():
+        key = str(moved.get(int(card_id), card_id))
+        remapped[key] = remapped.get(key, 0) + qty
+    return remapped
+
+
+def collect_garbage(grace_seconds=None):
+    """
+    Delete the rows of generations retired (or abandoned mid-build) more
+    than `grace_seconds` ago, in small transactions. Rows still holding a
+    reservation that wasn't carried over are kept until it resolves.
+    Returns (generations collected, rows deleted).
+    """
+    if grace_seconds is None:
+        grace_seconds = settings.CATALOG_GC_GRACE_SECONDS
+    cutoff = timezone.now() - timedelta(seconds=grace_seconds)
+    doomed = CatalogGeneration.objects.filter(
+        Q(status='retired', retired_at__lt=cutoff) | Q(status='building', created_at__lt=cutoff)
+    ).exclude(pk=CatalogState.live_generation())
+
+    collected = deleted = 0
+    for generation in doomed:
+        rows = CollectionCard.all_generations.filter(generation=generation.pk).exclude(
+            reserved__gt=0, successor__isnull=True,
+        )
+        while True:
+            ids = list(rows.values_list('id', flat=True)[:GC_CHUNK_SIZE])
+            if not ids:
+                break
+            with transaction.atomic():
+                CollectionCard.all_generations.filter(id__in=ids).delete()
+            deleted += len(ids)
+        if not CollectionCard.all_generations.filter(generation=generation.pk).exists():
+            CatalogGeneration.objects.filter(pk=generation.pk).update(status='collected')
+            collected += 1
+    return collected, deleted
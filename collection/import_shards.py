@@ -0,0 +1,144 @@
+"""
+Per-shard work for the parallel importer (importer.run_parallel_import).
+
+Runs in spawned worker processes, so this module must not touch Django:
+no models, no settings, no DB connection. Each shard of card payloads is
+normalized the same way run_import_batch reads them, validated against
+the CollectionCard column limits, fingerprinted, and has its image
+located, checked and copied into MEDIA_ROOT. The parent's single writer
+only has to match and save the rows.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+try:
+    from PIL import Image
+except ImportError:  # images are copied unchecked
+    Image = None
+
+# CollectionCard column limits
+MAX_LENGTHS = {'edition': 50, 'condition': 20, 'psa': 255, 'pricing_source': 64}
+
+# image basename -> path, per extracted export, built once per worker
+_image_indexes = {}
+
+
+def _image_index(image_dir):
+    index = _image_indexes.get(image_dir)
+    if index is None:
+        index = {}
+        for root, _, files in os.walk(image_dir):
+            for name in files:
+                index.setdefault(name, os.path.join(root, name))
+        _image_indexes[image_dir] = index
+    return index
+
+
+def _float(value, field):
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} is not a number: {value!r}")
+
+
+def _int(value, field):
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} is not an integer: {value!r}")
+
+
+def normalize(payload):
+    """Column values for one card payload, with run_import_batch's defaults."""
+    pricing = payload.get('pricing') or {}
+    misprint = payload.get('misprint') or payload.get('misprints')
+    if isinstance(misprint, dict):
+        misprint = misprint.get('description')
+    mid = _float(pricing.get('mid'), 'pricing.mid')
+
+    row = {
+        'edition': payload.get('edition') or 'Unlimited',
+        'condition': payload.get('condition') or '',
+        'quantity': _int(payload.get('quantity'), 'quantity') or 1,
+        'misprint': misprint,
+        'psa': payload.get('psa'),
+        'notes': payload.get('notes'),
+        'value_low': _float(pricing.get('low'), 'pricing.low'),
+        'value_mid': mid,
+        'value_high': _float(pricing.get('high'), 'pricing.high'),
+        'effective_mid': _float(pricing.get('effective_mid'), 'pricing.effective_mid') or mid,
+        'pricing_source': pricing.get('source'),
+        'exported_id': _int(payload.get('id'), 'id'),
+    }
+    if row['quantity'] < 0:
+        raise ValueError(f"quantity is negative: {row['quantity']}")
+    for field, limit in MAX_LENGTHS.items():
+        if row[field] is not None:
+            row[field] = str(row[field])
+            if len(row[field]) > limit:
+                raise ValueError(f"{field} is longer than {limit} characters")
+    return row
+
+
+def fingerprint(row):
+    return hashlib.sha1(json.dumps(row, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def prepare_image(payload, image_dir, media_root):
+    """Copy the payload's image into media_root; returns its stored name or None."""
+    img = payload.get('images')
+    path_in_json = img.get('img') if isinstance(img, dict) else None
+    if not path_in_json:
+        return None
+    name = os.path.basename(path_in_json)
+    src = _image_index(image_dir).get(name)
+    if not src:
+        return None
+    if Image is not None:
+        with Image.open(src) as im:
+            im.verify()
+
+    # write beside the target and rename, so two shards carrying the
+    # same file never leave a half-written copy behind
+    os.makedirs(media_root, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=media_root, prefix='.import-')
+    try:
+        with os.fdopen(fd, 'wb') as out, open(src, 'rb') as f:
+            shutil.copyfileobj(f, out)
+        os.replace(tmp, os.path.join(media_root, name))
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return name
+
+
+def prepare_shard(args):
+    """
+    (payloads, first index, image_dir or None, media_root) ->
+    {'rows': [(index, row, fingerprint, image name)], 'errors': [(index, message)]}
+    """
+    payloads, start, image_dir, media_root = args
+    rows, errors = [], []
+    for offset, payload in enumerate(payloads):
+        index = start + offset
+        try:
+            row = normalize(payload)
+        except ValueError as e:
+            errors.append((index, str(e)))
+            continue
+        image = None
+        if image_dir:
+            # a bad scan shouldn't cost the card its row
+            try:
+                image = prepare_image(payload, image_dir, media_root)
+            except Exception as e:
+                errors.append((index, f"image: {e}"))
+        rows.append((index, row, fingerprint(row), image))
+    return {'rows': rows, 'errors': errors}
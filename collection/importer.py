@@ -1,8 +1,15 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from django.utils import timezone
 from django.utils.dateparse import parse_datetime, parse_date
 from django.db import transaction
-from .models import Card, CardSet, CollectionCard, ImportBatch, CollectionImage
+from .models import Card, CardSet, CatalogState, CollectionCard, ImportBatch, CollectionImage, lookup_key
 import os
+import time
 from django.conf import settings
+from . import generations, import_shards, metrics, rollups
+from .pricing import reprice
+from .valuation import record_price_history
 
 def _normalize(s):
     return (s or '').strip()
@@ -14,9 +21,9 @@ def _find_or_create_card_and_set(card_payload):
 
     card_set = None
     if set_code:
-        card_set = CardSet.objects.filter(code__iexact=set_code).first()
+        card_set = CardSet.objects.filter(code_key=lookup_key(set_code)).first()
     if not card_set and set_name:
-        card_set = CardSet.objects.filter(name__iexact=set_name).first()
+        card_set = CardSet.objects.filter(name_key=lookup_key(set_name)).first()
     if not card_set:
         release_date = None
         rd = set_data.get('release_date')
@@ -34,7 +41,7 @@ def _find_or_create_card_and_set(card_payload):
     if konami_id:
         card = Card.objects.filter(konami_id=konami_id).first()
     if not card:
-        card = Card.objects.filter(name__iexact=card_name).first()
+        card = Card.objects.filter(name_key=lookup_key(card_name)).first()
     if not card:
         card = Card.objects.create(name=card_name, konami_id=konami_id)
 
@@ -81,6 +88,7 @@ def run_import_batch(import_batch: ImportBatch, json_data: dict):
     deleted_count = 0
     new_ids = set()
     mode = import_batch.mode
+    started = time.perf_counter()
 
     with transaction.atomic():
         # ---- REPLACE MODE: remove all old cards for this batch ----
@@ -165,4 +173,293 @@ def run_import_batch(import_batch: ImportBatch, json_data: dict):
                 if exported_id:
                     new_ids.add(int(exported_id))
 
+        reprice(CollectionCard.objects.filter(import_batch=import_batch))
+        record_price_history(import_batch)
+        rollups.schedule_rebuild()
+
+    metrics.import_finished('json', created + updated, 0, time.perf_counter() - started)
+
     return created, updated, deleted_count
+
+
+# ---- Parallel import ----
+#
+# Same semantics as run_import_batch, split across cores for large exports:
+# Card/CardSet are resolved once up front, payload shards are normalized,
+# validated, fingerprinted and have their images copied in worker
+# processes (import_shards), and this process alone writes the rows back,
+# one transaction per shard, as the shards come in. Replace mode differs:
+# it builds a new catalog generation and swaps it in at the end.
+
+LOOKUP_CHUNK = 900  # stays under SQLite's bound-parameter limit
+
+
+def _chunks(values, size=LOOKUP_CHUNK):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _konami_id(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _resolve_dimensions(cards):
+    """
+    [(card_id, card_set_id)] per payload, matched and created like
+    _find_or_create_card_and_set but with a handful of bulk queries.
+    """
+    set_refs, card_refs = [], []
+    for payload in cards:
+        set_data = payload.get('set') or {}
+        set_refs.append((_normalize(set_data.get('code') or ''), _normalize(set_data.get('name') or ''), set_data))
+        card_refs.append((_konami_id(payload.get('konami_id')), _normalize(payload.get('name') or '')))
+
+    sets_by_code, sets_by_name = {}, {}
+    codes = {lookup_key(code) for code, _, _ in set_refs if code}
+    names = {lookup_key(name) for _, name, _ in set_refs if name}
+    for chunk in _chunks(codes):
+        for s in CardSet.objects.filter(code_key__in=chunk).order_by('-id'):
+            sets_by_code[s.code_key] = s  # lowest id wins, like .first()
+    for chunk in _chunks(names):
+        for s in CardSet.objects.filter(name_key__in=chunk).order_by('-id'):
+            sets_by_name[s.name_key] = s
+
+    cards_by_konami, cards_by_name = {}, {}
+    konami_ids = {k for k, _ in card_refs if k}
+    card_names = {lookup_key(name) for _, name in card_refs}
+    for chunk in _chunks(konami_ids):
+        for c in Card.objects.filter(konami_id__in=chunk).order_by('-id'):
+            cards_by_konami[c.konami_id] = c
+    for chunk in _chunks(card_names):
+        for c in Card.objects.filter(name_key__in=chunk).order_by('-id'):
+            cards_by_name[c.name_key] = c
+
+    new_sets, new_cards, resolved = [], [], []
+    for (code, name, set_data), (konami_id, card_name) in zip(set_refs, card_refs):
+        card_set = sets_by_code.get(lookup_key(code)) if code else None
+        if not card_set and name:
+            card_set = sets_by_name.get(lookup_key(name))
+        if not card_set:
+            try:
+                release_date = parse_date(set_data.get('release_date') or '')
+            except ValueError:
+                release_date = None
+            card_set = CardSet(name=name, code=code or None, release_date=release_date,
+                               name_key=lookup_key(name), code_key=lookup_key(code))
+            new_sets.append(card_set)
+            if code:
+                sets_by_code.setdefault(card_set.code_key, card_set)
+            sets_by_name.setdefault(card_set.name_key, card_set)
+
+        card = cards_by_konami.get(konami_id) if konami_id else None
+        if not card:
+            card = cards_by_name.get(lookup_key(card_name))
+        if not card:
+            card = Card(name=card_name, konami_id=konami_id, name_key=lookup_key(card_name))
+            new_cards.append(card)
+            if konami_id:
+                cards_by_konami.setdefault(konami_id, card)
+            cards_by_name.setdefault(card.name_key, card)
+
+        resolved.append((card, card_set))
+
+    # bulk_create fills in the pks on the instances referenced above
+    with transaction.atomic():
+        CardSet.objects.bulk_create(new_sets, batch_size=500)
+        Card.objects.bulk_create(new_cards, batch_size=500)
+    return [(card.pk, card_set.pk) for card, card_set in resolved]
+
+
+MERGE_FIELDS = ('condition', 'misprint', 'psa', 'notes', 'value_low', 'value_mid',
+                'value_high', 'effective_mid', 'pricing_source')
+
+
+def _match_key_matches(cc, edition, psa):
+    # _identify_collection_card's edition/psa comparison
+    if (cc.edition or '').lower() != edition.lower():
+        return False
+    return not psa or (cc.psa or '').lower() == psa.lower()
+
+
+def _write_shard(import_batch, prepared, dimensions, is_replace, now, generation=None):
+    """Match and save one prepared shard in a single transaction (into `generation` if given)."""
+    created = updated = images = 0
+    rows = prepared['rows']
+    seen = set()
+
+    with transaction.atomic():
+        # bulk_create skips CollectionCard.save(), which normally fills this in
+        if generation is None:
+            generation = CatalogState.live_generation()
+        by_exported_id, by_card = {}, {}
+        existing_images = set()
+        if not is_replace:
+            exported_ids = {row['exported_id'] for _, row, _, _ in rows if row['exported_id']}
+            card_ids = {dimensions[index][0] for index, _, _, _ in rows}
+            # one instance per row, so a merge through either lookup is seen by the other
+            loaded = {}
+            for chunk in _chunks(exported_ids):
+                for cc in CollectionCard.objects.filter(exported_id__in=chunk).order_by('-id'):
+                    by_exported_id[cc.exported_id] = loaded.setdefault(cc.pk, cc)
+            for chunk in _chunks(card_ids):
+                for cc in CollectionCard.objects.filter(card_id__in=chunk).order_by('id'):
+                    by_card.setdefault((cc.card_id, cc.card_set_id), []).append(loaded.setdefault(cc.pk, cc))
+            for chunk in _chunks(loaded):
+                existing_images.update(
+                    CollectionImage.objects.filter(collection_card_id__in=chunk)
+                    .values_list('collection_card_id', 'img')
+                )
+
+        to_create, to_update, new_images = [], {}, []
+        for index, row, fp, image in rows:
+            card_id, card_set_id = dimensions[index]
+            if not is_replace:
+                # the fingerprint covers the row, not what it was resolved to
+                key = (fp, card_id, card_set_id, image)
+                if key in seen:
+                    # identical payload already merged by this shard; again is a no-op
+                    updated += 1
+                    continue
+                seen.add(key)
+
+            cc = None
+            if not is_replace:
+                if row['exported_id']:
+                    cc = by_exported_id.get(row['exported_id'])
+                if cc is None:
+                    cc = next(
+                        (c for c in by_card.get((card_id, card_set_id), ())
+                         if _match_key_matches(c, row['edition'], row['psa'])),
+                        None,
+                    )
+
+            if cc is not None:
+                for field in MERGE_FIELDS:
+                    _merge(cc, field, row[field])
+                if cc.quantity in (None, 0):
+                    cc.quantity = row['quantity']
+                if not cc.exported_id and row['exported_id']:
+                    cc.exported_id = row['exported_id']
+                cc.import_batch = import_batch
+                cc.updated_at = now
+                if cc.pk:
+                    to_update[cc.pk] = cc
+                updated += 1
+            else:
+                cc = CollectionCard(
+                    card_id=card_id, card_set_id=card_set_id, import_batch=import_batch, generation=generation, **row,
+                )
+                to_create.append(cc)
+                # later payloads in this shard can merge into it
+                if row['exported_id']:
+                    by_exported_id.setdefault(row['exported_id'], cc)
+                by_card.setdefault((card_id, card_set_id), []).append(cc)
+                created += 1
+
+            if image:
+                new_images.append((cc, image))
+
+        CollectionCard.objects.bulk_create(to_create, batch_size=500)
+        CollectionCard.objects.bulk_update(
+            list(to_update.values()),
+            MERGE_FIELDS + ('quantity', 'exported_id', 'import_batch', 'updated_at'),
+            batch_size=500,
+        )
+        attached = set()
+        image_rows = []
+        for cc, image in new_images:
+            if (cc.pk, image) not in existing_images and (cc.pk, image) not in attached:
+                attached.add((cc.pk, image))
+                image_rows.append(CollectionImage(collection_card=cc, img=image))
+        CollectionImage.objects.bulk_create(image_rows, batch_size=500)
+        images = len(image_rows)
+
+    return created, updated, images
+
+
+def run_parallel_import(import_batch: ImportBatch, json_data: dict, image_dir=None, workers=None, shard_size=None):
+    """
+    run_import_batch across a process pool. `image_dir` is an extracted
+    export whose images (payload['images']['img'], matched by file name)
+    are copied into MEDIA_ROOT and attached. Shards commit one by one, so
+    a failure part way leaves the shards before it imported.
+
+    A replace import builds a new catalog generation like the admin's ZIP
+    import and activates it at the end (collection.generations): the live
+    catalog and its reservations stay untouched until the swap, and a
+    failed run leaves an unfinished generation for gc_catalog instead of
+    a half-deleted catalog.
+
+    Returns (created, updated, deleted, errors), errors being
+    [(payload index, message)] for payloads or images that were skipped.
+    """
+    meta = json_data.get('meta') or {}
+    cards = json_data.get('cards') or []
+    workers = workers or settings.IMPORT_WORKERS or os.cpu_count() or 1
+    shard_size = shard_size or settings.IMPORT_SHARD_SIZE
+    is_replace = import_batch.mode == 'replace'
+    started = time.perf_counter()
+
+    exported_at = meta.get('exported_at')
+    if exported_at:
+        try:
+            import_batch.exported_at = parse_datetime(exported_at)
+            import_batch.save()
+        except (TypeError, ValueError):
+            pass
+
+    deleted_count = 0
+    generation = None
+    if is_replace:
+        generation = generations.begin(import_batch)
+        # retired by the swap, deleted later by gc_catalog
+        deleted_count = CollectionCard.objects.count()
+
+    dimensions = _resolve_dimensions(cards)
+
+    shards = [
+        (cards[i:i + shard_size], i, image_dir, settings.MEDIA_ROOT)
+        for i in range(0, len(cards), shard_size)
+    ]
+    created = updated = images = 0
+    errors = []
+    now = timezone.now()
+
+    def write(prepared):
+        nonlocal created, updated, images
+        c, u, i = _write_shard(import_batch, prepared, dimensions, is_replace, now,
+                               generation.pk if generation else None)
+        created += c
+        updated += u
+        images += i
+        errors.extend(prepared['errors'])
+
+    if workers > 1 and len(shards) > 1:
+        # spawned, not forked: children must not inherit this process's DB connections
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(shards)),
+                                   mp_context=multiprocessing.get_context('spawn'))
+        with pool:
+            # results arrive in shard order while later shards are still being prepared
+            for prepared in pool.map(import_shards.prepare_shard, shards):
+                write(prepared)
+    else:
+        for shard in shards:
+            write(import_shards.prepare_shard(shard))
+
+    with transaction.atomic():
+        reprice(CollectionCard.all_generations.filter(import_batch=import_batch))
+        record_price_history(import_batch, generation=generation.pk if generation else None)
+        # bulk writes skip the save signals
+        CatalogState.bump()
+        if generation is None:
+            rollups.schedule_rebuild()
+    if generation:
+        generations.activate(generation)
+
+    metrics.import_finished('parallel', created + updated, images, time.perf_counter() - started)
+
+    return created, updated, deleted_count, errors
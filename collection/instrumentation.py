@@ -0,0 +1,117 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates, Template
+
+_current = ContextVar('request_timer', default=None)
+
+
+class QueryRecorder:
+    """execute_wrapper that counts and times every SQL statement."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        # keyed by the parametrized SQL, so an N+1 shows up as one hot entry
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += perf_counter() - start
+            self.count += 1
+            self.statements[sql] += 1
+
+    def repeated(self, limit=5):
+        return [(sql, n) for sql, n in self.statements.most_common(limit) if n > 1]
+
+
+class RequestTimer:
+    def __init__(self):
+        self.started = perf_counter()
+        self.queries = QueryRecorder()
+        self.spans = {}
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    @property
+    def elapsed(self):
+        return perf_counter() - self.started
+
+    def server_timing(self):
+        parts = [f'db;dur={self.queries.duration * 1000:.1f};desc="{self.queries.count} queries"']
+        for name, seconds in self.spans.items():
+            parts.append(f'{name};dur={seconds * 1000:.1f}')
+        parts.append(f'total;dur={self.elapsed * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def _record_query(execute, sql, params, many, context):
+    # installed on every connection; a no-op outside a timed request. The
+    # timer lives in a contextvar, which asgiref carries into sync_to_async
+    # threads, so async views are measured too.
+    timer = _current.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer.queries(execute, sql, params, many, context)
+
+
+def _add_query_wrapper(sender, connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def install_query_instrumentation():
+    connection_created.connect(_add_query_wrapper, dispatch_uid='collection.instrumentation')
+    for conn in connections.all(initialized_only=True):
+        _add_query_wrapper(None, conn)
+
+
+def start_request_timer():
+    timer = RequestTimer()
+    return timer, _current.set(timer)
+
+
+def stop_request_timer(token):
+    _current.reset(token)
+
+
+def current_timer():
+    return _current.get()
+
+
+@contextmanager
+def timed(name):
+    """Add the duration of the block to the current request's `name` span."""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, perf_counter() - start)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with timed('render'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates backend that reports render time to the request timer."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
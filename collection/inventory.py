@@ -0,0 +1,49 @@
+"""
+Stock reservation as single conditional UPDATEs, for callers that must
+not hold row locks across a payment gateway round trip (the async
+checkout views reserve first, call out, and release on failure).
+"""
+from django.db import transaction
+from django.db.models import F
+
+from . import generations, rollups
+from .models import CatalogState, CollectionCard
+
+
+class InsufficientStock(Exception):
+    def __init__(self, card_id):
+        super().__init__(f"Not enough stock for card {card_id}")
+        self.card_id = card_id
+
+
+def reserve(items):
+    """
+    Reserve [{"id": int, "qty": int}, ...] all-or-nothing.
+    Raises InsufficientStock naming the first card that can't be covered.
+    """
+    with transaction.atomic():
+        # no catalog swap while stock moves (see generations)
+        generations.hold_live_generation()
+        # fixed order so two overlapping carts can't deadlock each other
+        for item in sorted(items, key=lambda i: i["id"]):
+            updated = (
+                CollectionCard.objects
+                .filter(id=item["id"], quantity__gte=F("reserved") + item["qty"])
+                .update(reserved=F("reserved") + item["qty"])
+            )
+            if not updated:
+                raise InsufficientStock(item["id"])
+        # .update() skips the post_save signal that normally bumps it
+        CatalogState.bump()
+        rollups.stock_moved(items, reserved=1)
+
+
+def release(items):
+    with transaction.atomic():
+        generations.hold_live_generation()
+        # a catalog swap may have carried the reservation to a new row
+        items = generations.forward(items)
+        for item in sorted(items, key=lambda i: i["id"]):
+            CollectionCard.all_generations.filter(id=item["id"]).update(reserved=F("reserved") - item["qty"])
+        CatalogState.bump()
+        rollups.stock_moved(items, reserved=-1)
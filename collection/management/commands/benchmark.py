@@ -0,0 +1,315 @@
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import zipfile
+
+import django
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from collection.admin import ImportBatchAdmin
+from collection import generations, pricing, snapshot
+from collection.importer import run_import_batch, run_parallel_import
+from collection.metrics import registry
+from collection.models import CollectionCard, ImportBatch, PricingRule
+from collection.payments import FakeGateway, use_gateway
+
+EDITIONS = ['1st Edition', 'Unlimited', 'Limited']
+CONDITIONS = ['NM', 'LP', 'MP', 'HP']
+
+
+def percentile(sorted_values, pct):
+    # nearest-rank percentile
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+
+def summarize(samples_ms, queries):
+    s = sorted(samples_ms)
+    return {
+        'n': len(s),
+        'mean_ms': round(statistics.fmean(s), 3) if s else None,
+        'p50_ms': round(percentile(s, 50), 3) if s else None,
+        'p90_ms': round(percentile(s, 90), 3) if s else None,
+        'p95_ms': round(percentile(s, 95), 3) if s else None,
+        'p99_ms': round(percentile(s, 99), 3) if s else None,
+        'max_ms': round(s[-1], 3) if s else None,
+        'queries_per_call': round(queries / len(s), 2) if s else None,
+    }
+
+
+def tiny_png():
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new('RGB', (8, 10), (30, 41, 59)).save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def synthetic_export(n_cards, n_sets, with_images, seed):
+    """Build an export dict in the same shape the importers accept."""
+    rng = random.Random(seed)
+    sets = [
+        {'name': f"Bench Set {i:04d}", 'code': f"BS{i:04d}", 'release_date': '2002-03-08'}
+        for i in range(n_sets)
+    ]
+    cards = []
+    for i in range(n_cards):
+        mid = round(rng.uniform(0.5, 400), 2)
+        payload = {
+            'id': 100000 + i,
+            'konami_id': 80000000 + i,
+            'name': f"Bench Card {i:06d}",
+            'set': dict(sets[i % n_sets]),
+            'edition': rng.choice(EDITIONS),
+            'condition': rng.choice(CONDITIONS),
+            'quantity': rng.randint(1, 4),
+            'misprint': None,
+            'psa': str(rng.randint(6, 10)) if rng.random() < 0.1 else None,
+            'notes': None,
+            'pricing': {
+                'low': round(mid * 0.8, 2),
+                'mid': mid,
+                'high': round(mid * 1.3, 2),
+                'effective_mid': mid,
+                'source': 'bench',
+            },
+        }
+        if with_images:
+            payload['images'] = {'img': f"images/bench_{i:06d}.png"}
+        cards.append(payload)
+    return {'meta': {'exported_at': timezone.now().isoformat()}, 'cards': cards}
+
+
+def write_zip(data, path, with_images):
+    png = tiny_png() if with_images else None
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('export.json', json.dumps(data))
+        if with_images:
+            for c in data['cards']:
+                zf.writestr(c['images']['img'], png)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the importers and storefront/checkout views against a synthetic "
+        "catalog. Runs in a throwaway test database; prints results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, default=1000, help='Synthetic CollectionCard rows')
+        parser.add_argument('--sets', type=int, default=None, help='Synthetic CardSets (default: cards/50)')
+        parser.add_argument('--no-images', action='store_true', help='Skip image generation')
+        parser.add_argument('--requests', type=int, default=50, help='Iterations per view benchmark')
+        parser.add_argument('--cart-size', type=int, default=10, help='Items in the cart for cart_status/checkout')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Write the JSON report to this file as well')
+        parser.add_argument('--keepdb', action='store_true', help='Reuse the benchmark database between runs')
+        parser.add_argument('--workers', type=int, default=None, help='Processes for the parallel import (default: one per core)')
+
+    def handle(self, *args, **opts):
+        n_cards = opts['cards']
+        n_sets = opts['sets'] or max(1, n_cards // 50)
+        with_images = not opts['no_images']
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=opts['keepdb'])
+        workdir = tempfile.mkdtemp(prefix='rh-bench-')
+        try:
+            # everything the run writes to disk stays in workdir and no catalog
+            # snapshot is written: the test DB's ids collide with the live catalog's
+            with override_settings(MEDIA_ROOT=os.path.join(workdir, 'media'),
+                                   PRERENDER_DIR=os.path.join(workdir, 'pages'),
+                                   METRICS_DIR=os.path.join(workdir, 'metrics'),
+                                   CATALOG_SNAPSHOT=False), \
+                    use_gateway(FakeGateway(latency=0, jitter=0)):
+                report = self.run_suite(workdir, n_cards, n_sets, with_images, opts)
+                # written here now rather than to the real METRICS_DIR at exit
+                registry.flush()
+        finally:
+            snapshot.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=opts['keepdb'])
+            teardown_test_environment()
+
+        out = json.dumps(report, indent=2)
+        if opts['output']:
+            with open(opts['output'], 'w', encoding='utf-8') as f:
+                f.write(out)
+        self.stdout.write(out)
+
+    # ------------------------------------------------------------------
+
+    def run_suite(self, workdir, n_cards, n_sets, with_images, opts):
+        data = synthetic_export(n_cards, n_sets, with_images, opts['seed'])
+        zip_path = os.path.join(workdir, 'export.zip')
+        write_zip(data, zip_path, with_images)
+
+        results = {}
+        results['run_import_batch_create'] = self.bench_import(data, 'merge')
+        results['run_import_batch_merge'] = self.bench_import(data, 'merge')
+        results['admin_zip_import_replace'] = self.bench_zip_import(zip_path, n_cards, with_images)
+        results['parallel_zip_import'] = self.bench_parallel_import(zip_path, n_cards, with_images, opts['workers'])
+        results['reprice'] = self.bench_reprice()
+
+        # plenty of stock so checkout iterations never run dry
+        CollectionCard.objects.update(quantity=10 ** 6, reserved=0)
+        ids = list(CollectionCard.objects.values_list('id', flat=True))
+        rng = random.Random(opts['seed'])
+        n = opts['requests']
+
+        client = Client()
+        results['api_products_warm'] = self.bench_get(client, lambda: '/api/products/', n)
+        results['api_products_cold'] = self.bench_get(client, lambda: '/api/products/', n, before=cache.clear)
+        results['card_detail'] = self.bench_get(client, lambda: f"/api/card/{rng.choice(ids)}/", n)
+        results['card_status'] = self.bench_get(client, lambda: f"/api/card-status/{rng.choice(ids)}/", n)
+
+        cart_ids = rng.sample(ids, min(opts['cart_size'], len(ids)))
+        for cid in cart_ids:
+            client.post('/cart/add/', json.dumps({'collection_card_id': cid, 'quantity': 1}),
+                        content_type='application/json')
+        results['cart_status'] = self.bench_get(client, lambda: '/cart/status/', n)
+
+        results['checkout_single'] = self.bench_post(
+            client, '/api/create-checkout-session/',
+            lambda: {'collection_card_id': rng.choice(ids), 'quantity': 1}, n,
+        )
+
+        def refill_cart():
+            session = client.session
+            session['cart'] = {str(cid): 1 for cid in cart_ids}
+            session.save()
+
+        results['checkout_cart'] = self.bench_post(client, '/cart/checkout/', lambda: {}, n, before=refill_cart)
+
+        return {
+            'params': {
+                'cards': n_cards, 'sets': n_sets, 'images': with_images,
+                'requests': n, 'cart_size': opts['cart_size'], 'seed': opts['seed'],
+            },
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'db_vendor': connection.vendor,
+                'cpu_count': os.cpu_count(),
+            },
+            'results': results,
+        }
+
+    def bench_import(self, data, mode):
+        batch = ImportBatch.objects.create(name='benchmark', mode=mode)
+        with CaptureQueriesContext(connection) as ctx:
+            t0 = time.perf_counter()
+            created, updated, deleted = run_import_batch(batch, data)
+            elapsed = time.perf_counter() - t0
+        rows = created + updated
+        return {
+            'seconds': round(elapsed, 3),
+            'rows': rows,
+            'rows_per_s': round(rows / elapsed, 1) if elapsed else None,
+            'created': created, 'updated': updated, 'deleted': deleted,
+            'queries': len(ctx.captured_queries),
+        }
+
+    def bench_reprice(self):
+        # a markup per condition, a floor and rounding: every kind of rule the expression folds in
+        rules = [PricingRule(name=f"bench {c}", condition=c, markup_percent=5 * i) for i, c in enumerate(CONDITIONS)]
+        rules.append(PricingRule(name='bench floor', floor=0.25, rounding='99'))
+        PricingRule.objects.bulk_create(rules)
+        with CaptureQueriesContext(connection) as ctx:
+            t0 = time.perf_counter()
+            rows = pricing.reprice()
+            elapsed = time.perf_counter() - t0
+        return {
+            'seconds': round(elapsed, 3),
+            'rows': rows,
+            'rows_per_s': round(rows / elapsed, 1) if elapsed else None,
+            'queries': len(ctx.captured_queries),
+        }
+
+    def bench_zip_import(self, zip_path, n_cards, with_images):
+        batch = ImportBatch.objects.create(name='benchmark-zip', mode='replace')
+        model_admin = ImportBatchAdmin(ImportBatch, admin.site)
+        with CaptureQueriesContext(connection) as ctx:
+            t0 = time.perf_counter()
+            with tempfile.TemporaryDirectory() as tmpdir:
+                with zipfile.ZipFile(zip_path) as zf:
+                    zf.extractall(tmpdir)
+                with open(os.path.join(tmpdir, 'export.json'), encoding='utf-8') as f:
+                    data = json.load(f)
+                with transaction.atomic():
+                    created, updated, deleted, generation = model_admin.import_zip_data(batch, data, tmpdir)
+                if generation:
+                    generations.activate(generation)
+            elapsed = time.perf_counter() - t0
+        rows = created + updated
+        return {
+            'seconds': round(elapsed, 3),
+            'rows': rows,
+            'rows_per_s': round(rows / elapsed, 1) if elapsed else None,
+            'images_per_s': round(n_cards / elapsed, 1) if with_images and elapsed else None,
+            'created': created, 'updated': updated, 'deleted': deleted,
+            'queries': len(ctx.captured_queries),
+        }
+
+    def bench_parallel_import(self, zip_path, n_cards, with_images, workers):
+        batch = ImportBatch.objects.create(name='benchmark-parallel', mode='replace')
+        with CaptureQueriesContext(connection) as ctx:
+            t0 = time.perf_counter()
+            with tempfile.TemporaryDirectory() as tmpdir:
+                with zipfile.ZipFile(zip_path) as zf:
+                    zf.extractall(tmpdir)
+                with open(os.path.join(tmpdir, 'export.json'), encoding='utf-8') as f:
+                    data = json.load(f)
+                created, updated, deleted, errors = run_parallel_import(
+                    batch, data, image_dir=tmpdir if with_images else None, workers=workers,
+                )
+            elapsed = time.perf_counter() - t0
+        rows = created + updated
+        return {
+            'seconds': round(elapsed, 3),
+            'rows': rows,
+            'rows_per_s': round(rows / elapsed, 1) if elapsed else None,
+            'images_per_s': round(n_cards / elapsed, 1) if with_images and elapsed else None,
+            'created': created, 'updated': updated, 'deleted': deleted, 'skipped': len(errors),
+            'workers': workers or os.cpu_count(),
+            'queries': len(ctx.captured_queries),
+        }
+
+    def bench_get(self, client, url_fn, n, before=None):
+        return self._bench(lambda: client.get(url_fn(), HTTP_ACCEPT_ENCODING='gzip'), n, before)
+
+    def bench_post(self, client, url, body_fn, n, before=None):
+        return self._bench(
+            lambda: client.post(url, json.dumps(body_fn()), content_type='application/json'), n, before,
+        )
+
+    def _bench(self, call, n, before):
+        samples = []
+        queries = 0
+        statuses = {}
+        for _ in range(n):
+            if before:
+                before()
+            with CaptureQueriesContext(connection) as ctx:
+                t0 = time.perf_counter()
+                response = call()
+                samples.append((time.perf_counter() - t0) * 1000)
+            queries += len(ctx.captured_queries)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        summary = summarize(samples, queries)
+        summary['status_codes'] = statuses
+        return summary
@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from collection import snapshot
+
+
+class Command(BaseCommand):
+    help = "Rewrite the catalog snapshot in SNAPSHOT_DIR now (e.g. after importing from another container)"
+
+    def handle(self, *args, **opts):
+        started = time.perf_counter()
+        snapshot.refresh(force=True)
+        info = snapshot.meta()
+        self.stdout.write(
+            f"Wrote catalog version {info['version']} (products {info['products']}) "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
@@ -1,9 +1,8 @@
 from django.core.management.base import BaseCommand
 import time
-import stripe
-from django.conf import settings
+from collection import metrics
+from collection.payments import get_gateway
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
 MAX_AGE = 10 * 60  # 10 minutes
 
 class Command(BaseCommand):
@@ -13,21 +12,23 @@ class Command(BaseCommand):
         now = int(time.time())
         expired = 0
 
-        sessions = stripe.checkout.Session.list(
-            status="open",
-            limit=100
-        )
+        gateway = get_gateway()
 
-        for session in sessions.auto_paging_iter():
+        for session in gateway.list_open_sessions():
             # 🔑 THIS is the important line
             if session.metadata.get("source") != "rarehunter_cart":
                 continue
 
             if now - session.created > MAX_AGE:
                 try:
-                    stripe.checkout.Session.expire(session.id)
+                    gateway.expire_session(session.id)
                     expired += 1
                 except Exception as e:
+                    metrics.registry.inc('collection_stripe_session_expire_errors_total')
                     self.stderr.write(str(e))
 
+        metrics.registry.inc('collection_stripe_sessions_expired_total', expired)
+        metrics.registry.set('collection_expire_sessions_last_run_timestamp_seconds', now)
+        metrics.registry.flush()
+
         self.stdout.write(f"Expired {expired} RareHunter checkout sessions")
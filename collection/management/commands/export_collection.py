@@ -0,0 +1,42 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from collection import exporter
+from collection.models import CollectionCard
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream the collection out in the format the importers read back in "
+        "(json for run_import_batch, zip with images for the admin import, or ndjson)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=exporter.FORMATS, default='json')
+        parser.add_argument('--output', '-o', help='File to write (default: stdout; required for zip)')
+        parser.add_argument('--batch', type=int, help='Only export cards from this ImportBatch id')
+
+    def handle(self, *args, **opts):
+        fmt = opts['format']
+        if fmt == 'zip' and not opts['output']:
+            raise CommandError("--output is required for zip")
+
+        queryset = CollectionCard.objects.all()
+        if opts['batch']:
+            queryset = queryset.filter(import_batch_id=opts['batch'])
+
+        if opts['output']:
+            with open(opts['output'], 'wb') as out:
+                written = self._copy(fmt, queryset, out)
+            self.stderr.write(f"Wrote {written} bytes to {opts['output']}")
+        else:
+            self._copy(fmt, queryset, sys.stdout.buffer)
+            sys.stdout.flush()
+
+    def _copy(self, fmt, queryset, out):
+        written = 0
+        for piece in exporter.stream(fmt, queryset):
+            out.write(piece)
+            written += len(piece)
+        return written
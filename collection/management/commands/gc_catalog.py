@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from collection.generations import collect_garbage
+
+
+class Command(BaseCommand):
+    help = "Delete catalog generations retired by replace imports once no checkout can refer to them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep collecting periodically')
+        parser.add_argument('--interval', type=float, default=600.0, help='Seconds between runs with --loop')
+        parser.add_argument('--grace', type=int, default=None,
+                            help='Seconds a generation stays after retiring (default CATALOG_GC_GRACE_SECONDS)')
+
+    def handle(self, *args, **opts):
+        while True:
+            collected, deleted = collect_garbage(opts['grace'])
+            if collected or deleted:
+                self.stdout.write(f"Collected {collected} generations, deleted {deleted} rows")
+
+            if not opts['loop']:
+                return
+            time.sleep(opts['interval'])
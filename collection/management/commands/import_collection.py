@@ -0,0 +1,57 @@
+import json
+import os
+import tempfile
+import zipfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from collection.importer import run_parallel_import
+from collection.models import ImportBatch
+
+
+class Command(BaseCommand):
+    help = (
+        "Import an export (.json, or .zip with images) using every core: payloads are "
+        "prepared in worker processes and written back by this one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Export .json or .zip')
+        parser.add_argument('--name', help='ImportBatch name (default: the file name)')
+        parser.add_argument('--mode', choices=('merge', 'replace'), default='merge')
+        parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: IMPORT_WORKERS or one per core)')
+        parser.add_argument('--shard-size', type=int, default=None, help='Payloads per worker task')
+
+    def handle(self, *args, **opts):
+        path = opts['path']
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            if zipfile.is_zipfile(path):
+                with zipfile.ZipFile(path) as zf:
+                    zf.extractall(tmpdir)
+                json_files = sorted(
+                    os.path.join(root, f) for root, _, files in os.walk(tmpdir) for f in files if f.endswith('.json')
+                )
+                if not json_files:
+                    raise CommandError("No JSON file found in ZIP")
+                json_path, image_dir = json_files[0], tmpdir
+            else:
+                json_path, image_dir = path, None
+
+            with open(json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+
+            batch = ImportBatch.objects.create(name=opts['name'] or os.path.basename(path), mode=opts['mode'])
+            created, updated, deleted, errors = run_parallel_import(
+                batch, data, image_dir=image_dir, workers=opts['workers'], shard_size=opts['shard_size'],
+            )
+
+        for index, message in errors[:20]:
+            self.stderr.write(f"card #{index}: {message}")
+        if len(errors) > 20:
+            self.stderr.write(f"... and {len(errors) - 20} more")
+        self.stdout.write(
+            f"Import complete: {created} created, {updated} updated, {deleted} deleted, {len(errors)} skipped"
+        )
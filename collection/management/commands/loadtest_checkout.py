@@ -0,0 +1,245 @@
+import json
+import os
+import queue
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from collection import snapshot
+from collection.metrics import registry
+from collection.models import Card, CardSet, CollectionCard, Order
+from collection.payments import FakeGateway, use_gateway
+from .benchmark import percentile, summarize
+
+
+class LockTimer:
+    """execute_wrapper timing SELECT ... FOR UPDATE, i.e. time spent waiting for row locks."""
+
+    def __init__(self):
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        if 'FOR UPDATE' not in sql:
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self._lock:
+                self.samples.append((time.perf_counter() - start) * 1000)
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire concurrent cart checkouts and webhooks at a few scarce cards using the "
+        "offline payment gateway, then check for oversells and negative reservations. "
+        "Runs in a throwaway test database; use Postgres for meaningful lock behaviour."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checkouts', type=int, default=300, help='Cart checkouts to attempt')
+        parser.add_argument('--concurrency', type=int, default=32, help='Worker threads')
+        parser.add_argument('--cards', type=int, default=5, help='Scarce cards everyone competes for')
+        parser.add_argument('--stock', type=int, default=3, help='Initial quantity per scarce card')
+        parser.add_argument('--cart-size', type=int, default=2, help='Max distinct cards per cart')
+        parser.add_argument('--complete-rate', type=float, default=0.5,
+                            help='Share of sessions that pay; the rest expire')
+        parser.add_argument('--redeliver-rate', type=float, default=0.0,
+                            help='Share of webhooks delivered twice, as Stripe may do')
+        parser.add_argument('--webhook-retries', type=int, default=5,
+                            help='Redeliveries of a webhook that got a non-2xx response, as Stripe does')
+        parser.add_argument('--latency', type=float, default=0.05, help='Simulated gateway latency (s)')
+        parser.add_argument('--jitter', type=float, default=0.02)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--keepdb', action='store_true')
+
+    def handle(self, *args, **opts):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        if connection.vendor == 'sqlite' and not connection.settings_dict['TEST'].get('NAME'):
+            # the shared-cache in-memory test DB fails fast on concurrent writes;
+            # a file DB waits on its busy timeout like a real lock would
+            connection.settings_dict['TEST']['NAME'] = os.path.join(
+                tempfile.gettempdir(), 'rarehunter-loadtest.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=opts['keepdb'])
+        workdir = tempfile.mkdtemp(prefix='rh-loadtest-')
+        try:
+            gateway = FakeGateway(latency=opts['latency'], jitter=opts['jitter'])
+            # cache-backed sessions keep cart bookkeeping out of the contention we measure;
+            # pages and metrics go to workdir and no catalog snapshot is written,
+            # the test DB's ids collide with the live catalog's
+            with override_settings(STRIPE_WEBHOOK_SECRET='',
+                                   SESSION_ENGINE='django.contrib.sessions.backends.cache',
+                                   PRERENDER_DIR=os.path.join(workdir, 'pages'),
+                                   METRICS_DIR=os.path.join(workdir, 'metrics'),
+                                   CATALOG_SNAPSHOT=False), \
+                    use_gateway(gateway):
+                report = self.run(gateway, opts)
+                registry.flush()
+        finally:
+            snapshot.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=opts['keepdb'])
+            teardown_test_environment()
+
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def run(self, gateway, opts):
+        rng = random.Random(opts['seed'])
+        card_set = CardSet.objects.create(name='Load Test Set', code='LOAD')
+        scarce = [
+            CollectionCard.objects.create(
+                card=Card.objects.create(name=f"Scarce Card {i}"),
+                card_set=card_set, quantity=opts['stock'], value_mid=10.0,
+            )
+            for i in range(opts['cards'])
+        ]
+        initial = {c.id: c.quantity for c in scarce}
+        ids = list(initial)
+
+        tasks = queue.Queue()
+        lock_timer = LockTimer()
+        results = {'checkout': [], 'webhook': []}
+        statuses = {'checkout': Counter(), 'webhook': Counter()}
+        harness_errors = Counter()
+        results_lock = threading.Lock()
+        pending = threading.Semaphore(0)
+        outstanding = [opts['checkouts']]
+
+        def record(kind, elapsed_ms, status):
+            with results_lock:
+                results[kind].append(elapsed_ms)
+                statuses[kind][status] += 1
+
+        def checkout_task(client):
+            picks = rng.sample(ids, rng.randint(1, min(opts['cart_size'], len(ids))))
+            session = client.session
+            session['cart'] = {str(i): 1 for i in picks}
+            session.save()
+
+            t0 = time.perf_counter()
+            response = client.post('/cart/checkout/', '{}', content_type='application/json')
+            record('checkout', (time.perf_counter() - t0) * 1000, response.status_code)
+
+            if response.status_code == 200:
+                sid = response.json()['url'].rsplit('/', 1)[-1]
+                event_type = ('checkout.session.completed' if rng.random() < opts['complete_rate']
+                              else 'checkout.session.expired')
+                deliveries = 2 if rng.random() < opts['redeliver_rate'] else 1
+                with results_lock:
+                    outstanding[0] += deliveries
+                for _ in range(deliveries):
+                    tasks.put(('webhook', (sid, event_type, 0)))
+
+        def webhook_task(client, sid, event_type, attempt):
+            payload = json.dumps(gateway.event_for(sid, event_type))
+            t0 = time.perf_counter()
+            response = client.post('/webhook/', payload, content_type='application/json')
+            record('webhook', (time.perf_counter() - t0) * 1000, response.status_code)
+
+            if response.status_code >= 300 and attempt < opts['webhook_retries']:
+                with results_lock:
+                    outstanding[0] += 1
+                tasks.put(('webhook', (sid, event_type, attempt + 1)))
+
+        def worker():
+            client = Client(raise_request_exception=False)
+            with connection.execute_wrapper(lock_timer):
+                while True:
+                    item = tasks.get()
+                    if item is None:
+                        break
+                    kind, args = item
+                    try:
+                        if kind == 'checkout':
+                            checkout_task(client)
+                        else:
+                            webhook_task(client, *args)
+                    except Exception as exc:
+                        with results_lock:
+                            harness_errors[f"{kind}:{type(exc).__name__}"] += 1
+                    finally:
+                        pending.release()
+            connections.close_all()
+
+        for _ in range(opts['checkouts']):
+            tasks.put(('checkout', ()))
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(opts['concurrency'])]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+
+        done = 0
+        while True:
+            pending.acquire()
+            done += 1
+            with results_lock:
+                if done >= outstanding[0]:
+                    break
+        elapsed = time.perf_counter() - started
+
+        for _ in threads:
+            tasks.put(None)
+        for t in threads:
+            t.join()
+
+        return self.report(opts, elapsed, results, statuses, harness_errors, lock_timer, initial, gateway)
+
+    def report(self, opts, elapsed, results, statuses, harness_errors, lock_timer, initial, gateway):
+        anomalies = []
+        for c in CollectionCard.objects.filter(id__in=initial).select_related('card'):
+            sold = initial[c.id] - c.quantity
+            if c.reserved < 0:
+                anomalies.append({'id': c.id, 'issue': 'negative_reserved', 'reserved': c.reserved})
+            if c.quantity < 0 or sold > initial[c.id]:
+                anomalies.append({'id': c.id, 'issue': 'oversold', 'sold': sold, 'stock': initial[c.id]})
+            if c.reserved > c.quantity:
+                anomalies.append({'id': c.id, 'issue': 'reserved_exceeds_quantity',
+                                  'reserved': c.reserved, 'quantity': c.quantity})
+            if c.reserved != 0:
+                # every session was completed or expired, so nothing should stay held
+                anomalies.append({'id': c.id, 'issue': 'leaked_reservation', 'reserved': c.reserved})
+
+        locks = sorted(lock_timer.samples)
+
+        def section(kind):
+            s = summarize(results[kind], 0)
+            s.pop('queries_per_call')
+            s['per_second'] = round(len(results[kind]) / elapsed, 1) if elapsed else None
+            s['status_codes'] = {str(k): v for k, v in statuses[kind].items()}
+            return s
+
+        return {
+            'params': {k: opts[k] for k in (
+                'checkouts', 'concurrency', 'cards', 'stock', 'cart_size',
+                'complete_rate', 'redeliver_rate', 'webhook_retries', 'latency', 'jitter', 'seed')},
+            'db_vendor': connection.vendor,
+            'elapsed_s': round(elapsed, 3),
+            'checkout': section('checkout'),
+            'webhook': section('webhook'),
+            'lock_wait': {
+                'n': len(locks),
+                'total_ms': round(sum(locks), 3),
+                'p50_ms': round(percentile(locks, 50), 3) if locks else None,
+                'p95_ms': round(percentile(locks, 95), 3) if locks else None,
+                'max_ms': round(locks[-1], 3) if locks else None,
+            },
+            'harness_errors': dict(harness_errors),
+            'sessions_created': len(gateway.sessions),
+            'orders': Order.objects.count(),
+            'units_sold': sum(initial.values()) - sum(
+                CollectionCard.objects.filter(id__in=initial).values_list('quantity', flat=True)),
+            'anomalies': anomalies,
+            'ok': not anomalies,
+        }
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.http import Http404
+from django.template.loader import render_to_string
+
+from collection import prerender
+from collection.models import CatalogState, CollectionCard
+from collection.views import render_card_page
+
+
+class Command(BaseCommand):
+    help = "Render the content pages and every live card page ahead of traffic (missing ones only unless --force)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Re-render pages that are already stored')
+        parser.add_argument('--no-cards', action='store_true', help='Only the content pages')
+
+    def handle(self, *args, **opts):
+        started = time.perf_counter()
+        pruned = prerender.prune_revisions()
+
+        pages = [
+            (prerender.content_page(name), lambda template=template: (render_to_string(template), None), None)
+            for name, template in prerender.CONTENT_PAGES.items()
+        ]
+        if not opts['no_cards']:
+            pages += [
+                (prerender.card_page(card_id), lambda card_id=card_id: render_card_page(card_id),
+                 CatalogState.current)
+                for card_id in CollectionCard.objects.values_list('id', flat=True).iterator()
+            ]
+
+        rendered = 0
+        for name, build, version in pages:
+            if not opts['force'] and prerender.is_stored(name):
+                continue
+            try:
+                prerender.render(name, build, version)
+            except Http404:
+                # sold through or collected since the id list was read
+                continue
+            rendered += 1
+
+        self.stdout.write(
+            f"Rendered {rendered} of {len(pages)} pages into {prerender.root()} "
+            f"in {time.perf_counter() - started:.2f}s (pruned {pruned} old revisions)"
+        )
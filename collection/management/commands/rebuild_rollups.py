@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from collection import rollups
+from collection.models import InventoryRollup
+
+
+class Command(BaseCommand):
+    help = "Recompute the inventory report rollups from the collection"
+
+    def handle(self, *args, **opts):
+        rollups.rebuild()
+        self.stdout.write(f"Rebuilt {InventoryRollup.objects.count()} rollup rows")
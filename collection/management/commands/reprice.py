@@ -0,0 +1,15 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from collection import pricing, rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute every listing's sell price from the active pricing rules"
+
+    def handle(self, *args, **opts):
+        started = time.perf_counter()
+        n = pricing.reprice()
+        rollups.rebuild()
+        self.stdout.write(f"Repriced {n} listings in {time.perf_counter() - started:.2f}s")
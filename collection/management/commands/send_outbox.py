@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from collection.emails import send_pending
+
+
+class Command(BaseCommand):
+    help = "Deliver queued outbound emails (tracking emails etc.)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new emails')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between polls with --loop')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--concurrency', type=int, default=None, help='Parallel SMTP connections')
+
+    def handle(self, *args, **opts):
+        while True:
+            # drain everything that's due before sleeping
+            while True:
+                sent, retrying, failed = send_pending(opts['batch_size'], opts['concurrency'])
+                if sent or retrying or failed:
+                    self.stdout.write(f"Sent {sent}, retrying {retrying}, failed {failed}")
+                if not (sent or retrying or failed):
+                    break
+                if retrying and not sent:
+                    # everything in this batch bounced; don't spin on a broken SMTP server
+                    break
+
+            if not opts['loop']:
+                return
+            time.sleep(opts['interval'])
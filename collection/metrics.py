@@ -0,0 +1,297 @@
+"""
+Minimal multi-process metrics registry rendered in Prometheus text format.
+
+Each process (gunicorn worker, management command) keeps its metrics in
+memory and periodically writes them to its own JSON file under
+METRICS_DIR. The /metrics/ endpoint merges every file, so counters and
+histograms add up across workers. Files left behind by dead processes
+are folded into an archive file, so restarted workers don't lose counts
+and the directory doesn't grow forever.
+"""
+import atexit
+import bisect
+import fcntl
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.5, 1, 5, 15, 30, 60, 300, 900, 3600)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'collection_http_request_duration_seconds': (
+        'histogram', 'Request latency by view.', LATENCY_BUCKETS),
+    'collection_http_requests_total': (
+        'counter', 'Requests by view, method and status.', None),
+    'collection_inventory_units_total': (
+        'counter', 'Inventory units reserved, released and sold.', None),
+    'collection_webhook_events_total': (
+        'counter', 'Stripe webhook events processed.', None),
+    'collection_webhook_lag_seconds': (
+        'histogram', 'Delay between a Stripe event being created and processed.', LAG_BUCKETS),
+    'collection_import_rows_total': (
+        'counter', 'Collection rows imported.', None),
+    'collection_import_images_total': (
+        'counter', 'Images imported.', None),
+    'collection_import_seconds_total': (
+        'counter', 'Time spent importing.', None),
+    'collection_import_last_rows_per_second': (
+        'gauge', 'Row throughput of the most recent import.', None),
+    'collection_import_last_images_per_second': (
+        'gauge', 'Image throughput of the most recent import.', None),
+    'collection_stripe_sessions_expired_total': (
+        'counter', 'Checkout sessions expired by expire_stripe_sessions.', None),
+    'collection_stripe_session_expire_errors_total': (
+        'counter', 'Errors expiring checkout sessions.', None),
+    'collection_expire_sessions_last_run_timestamp_seconds': (
+        'gauge', 'Unix time of the last expire_stripe_sessions run.', None),
+}
+
+ARCHIVE_FILE = '_archived.json'
+LOCK_FILE = '.lock'
+
+
+def _key(name, labels):
+    return (name, tuple(sorted((labels or {}).items())))
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # one flush at a time per process; kept apart from _lock so file I/O
+        # doesn't hold up inc()/observe() on the request path
+        self._flush_lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}      # key -> (value, timestamp)
+        self.histograms = {}  # key -> [bucket counts..., +Inf], sum, count
+        self._last_flush = 0.0
+        self._dirty = False
+
+    def inc(self, name, value=1, **labels):
+        k = _key(name, labels)
+        with self._lock:
+            self.counters[k] = self.counters.get(k, 0) + value
+            self._dirty = True
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges[_key(name, labels)] = (value, time.time())
+            self._dirty = True
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        k = _key(name, labels)
+        with self._lock:
+            h = self.histograms.get(k)
+            if h is None:
+                h = self.histograms[k] = [[0] * (len(buckets) + 1), 0.0, 0]
+            h[0][bisect.bisect_left(buckets, value)] += 1
+            h[1] += value
+            h[2] += 1
+            self._dirty = True
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[n, list(l), v] for (n, l), v in self.counters.items()],
+                'gauges': [[n, list(l), v, ts] for (n, l), (v, ts) in self.gauges.items()],
+                'histograms': [[n, list(l), list(b), s, c] for (n, l), (b, s, c) in self.histograms.items()],
+            }
+
+    def maybe_flush(self):
+        interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0)
+        if self._dirty and time.monotonic() - self._last_flush >= interval:
+            self.flush()
+
+    def flush(self):
+        directory = metrics_dir()
+        if not directory:
+            return
+        with self._flush_lock:
+            if not self._dirty:
+                return
+            os.makedirs(directory, exist_ok=True)
+            self._dirty = False
+            self._last_flush = time.monotonic()
+            _write_json(os.path.join(directory, _process_filename()), self.snapshot())
+
+
+registry = Registry()
+_process_started = int(time.time())
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def _process_filename():
+    # pid alone could be reused by a later process and overwrite its data
+    return f"{os.getpid()}-{_process_started}.json"
+
+
+def _write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge(into, data):
+    for n, l, v in data.get('counters', []):
+        k = _key(n, dict(l))
+        into['counters'][k] = into['counters'].get(k, 0) + v
+    for n, l, v, ts in data.get('gauges', []):
+        k = _key(n, dict(l))
+        if k not in into['gauges'] or into['gauges'][k][1] <= ts:
+            into['gauges'][k] = (v, ts)
+    for n, l, b, s, c in data.get('histograms', []):
+        k = _key(n, dict(l))
+        h = into['histograms'].get(k)
+        if h is None:
+            into['histograms'][k] = [list(b), s, c]
+        else:
+            h[0] = [x + y for x, y in zip(h[0], b)]
+            h[1] += s
+            h[2] += c
+
+
+def _empty():
+    return {'counters': {}, 'gauges': {}, 'histograms': {}}
+
+
+def _as_snapshot(merged):
+    return {
+        'counters': [[n, list(l), v] for (n, l), v in merged['counters'].items()],
+        'gauges': [[n, list(l), v, ts] for (n, l), (v, ts) in merged['gauges'].items()],
+        'histograms': [[n, list(l), b, s, c] for (n, l), (b, s, c) in merged['histograms'].items()],
+    }
+
+
+def collect():
+    """Merge every process file (archiving dead processes) into one view."""
+    registry.flush()
+    directory = metrics_dir()
+    merged = _empty()
+    if not directory or not os.path.isdir(directory):
+        _merge(merged, registry.snapshot())
+        return merged
+
+    with open(os.path.join(directory, LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            archive_path = os.path.join(directory, ARCHIVE_FILE)
+            archive = _empty()
+            _merge(archive, _read_json(archive_path) or {})
+            archived_any = False
+
+            for name in os.listdir(directory):
+                if not name.endswith('.json') or name == ARCHIVE_FILE:
+                    continue
+                path = os.path.join(directory, name)
+                data = _read_json(path)
+                if data is None:
+                    continue
+                pid = int(name.split('-', 1)[0])
+                if pid != os.getpid() and not _pid_alive(pid):
+                    _merge(archive, data)
+                    os.remove(path)
+                    archived_any = True
+                else:
+                    _merge(merged, data)
+
+            if archived_any:
+                _write_json(archive_path, _as_snapshot(archive))
+            _merge(merged, _as_snapshot(archive))
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return merged
+
+
+def _labels(pairs, extra=()):
+    pairs = list(pairs) + list(extra)
+    if not pairs:
+        return ''
+    body = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in pairs
+    )
+    return '{' + body + '}'
+
+
+def _fmt(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def render_prometheus():
+    merged = collect()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == 'counter':
+            for (n, l), v in sorted(merged['counters'].items()):
+                if n == name:
+                    lines.append(f"{name}{_labels(l)} {_fmt(v)}")
+        elif kind == 'gauge':
+            for (n, l), (v, _) in sorted(merged['gauges'].items()):
+                if n == name:
+                    lines.append(f"{name}{_labels(l)} {_fmt(v)}")
+        else:
+            for (n, l), (counts, total, count) in sorted(merged['histograms'].items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, c in zip(list(buckets) + ['+Inf'], counts):
+                    cumulative += c
+                    lines.append(f"{name}_bucket{_labels(l, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(l)} {_fmt(total)}")
+                lines.append(f"{name}_count{_labels(l)} {count}")
+    return '\n'.join(lines) + '\n'
+
+
+# --- convenience helpers used by views / importers / commands ---
+
+def inventory(event, units):
+    registry.inc('collection_inventory_units_total', units, event=event)
+
+
+def webhook_processed(event_type, created):
+    registry.inc('collection_webhook_events_total', event_type=event_type or 'unknown')
+    if created:
+        registry.observe('collection_webhook_lag_seconds', max(time.time() - created, 0),
+                         event_type=event_type or 'unknown')
+
+
+def import_finished(source, rows, images, seconds):
+    registry.inc('collection_import_rows_total', rows, source=source)
+    registry.inc('collection_import_images_total', images, source=source)
+    registry.inc('collection_import_seconds_total', seconds, source=source)
+    if seconds > 0:
+        registry.set('collection_import_last_rows_per_second', rows / seconds, source=source)
+        registry.set('collection_import_last_images_per_second', images / seconds, source=source)
+    registry.flush()
+
+
+atexit.register(registry.flush)
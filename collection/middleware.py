@@ -0,0 +1,237 @@
+import logging
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import patch_vary_headers
+
+from .catalog import MIN_COMPRESS_SIZE, compress, negotiate_encoding
+from .instrumentation import install_query_instrumentation, start_request_timer, stop_request_timer
+from .metrics import registry
+from .profiling import PROFILE_ID_HEADER, RequestProfile, install_query_log, requested
+from .routers import enable_replica_reads, replica_configured, reset_replica_reads
+
+logger = logging.getLogger('collection.timing')
+
+
+class HybridMiddleware:
+    """
+    Base for middleware that runs natively under both WSGI and ASGI, so
+    async views aren't bounced through a thread for our own bookkeeping.
+    Subclasses implement before(request) -> state and
+    after(request, response, state) -> response; neither may do I/O.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = self.before(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.finish(state)
+        return self.after(request, response, state)
+
+    async def __acall__(self, request):
+        state = self.before(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.finish(state)
+        return self.after(request, response, state)
+
+    def before(self, request):
+        return None
+
+    def finish(self, state):
+        pass
+
+    def after(self, request, response, state):
+        return response
+
+
+class CompressedJSONMiddleware(HybridMiddleware):
+    """
+    gzip/brotli-compress JSON responses.
+
+    Restricted to JSON on purpose: HTML pages carry the CSRF token and
+    compressing them would expose it to BREACH-style attacks. Views that
+    already set Content-Encoding (e.g. the precompressed catalog) are
+    passed through untouched.
+    """
+
+    def after(self, request, response, state):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if not response.get('Content-Type', '').startswith('application/json'):
+            return response
+        if len(response.content) < MIN_COMPRESS_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = negotiate_encoding(request)
+        if encoding == 'identity':
+            return response
+
+        compressed = compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+
+        # the body changed, so a strong ETag no longer matches byte-for-byte
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+
+        return response
+
+
+class RequestTimingMiddleware(HybridMiddleware):
+    """
+    Per-request SQL count, DB time and render/serialize spans. Requests
+    slower than SLOW_REQUEST_MS are logged with their most repeated
+    statements, which is where N+1s show up. With SERVER_TIMING on, the
+    spans also go out as a Server-Timing header (dev / internal deploys).
+
+    Disabled entirely (removed from the chain) when REQUEST_TIMING is off.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_TIMING', False):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.slow_ms = getattr(settings, 'SLOW_REQUEST_MS', 500)
+        self.send_header = getattr(settings, 'SERVER_TIMING', False)
+        install_query_instrumentation()
+
+    def before(self, request):
+        return start_request_timer()
+
+    def finish(self, state):
+        stop_request_timer(state[1])
+
+    def after(self, request, response, state):
+        timer = state[0]
+        if self.send_header:
+            response['Server-Timing'] = timer.server_timing()
+
+        elapsed_ms = timer.elapsed * 1000
+        if elapsed_ms >= self.slow_ms:
+            repeated = timer.queries.repeated()
+            logger.warning(
+                "Slow request %s %s: %.0fms, %d queries (%.0fms in DB)%s",
+                request.method, request.path, elapsed_ms,
+                timer.queries.count, timer.queries.duration * 1000,
+                ''.join(f"\n  x{n}: {sql}" for sql, n in repeated),
+            )
+
+        return response
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """Record request latency and status per URL name for /metrics/."""
+
+    def before(self, request):
+        return perf_counter()
+
+    def after(self, request, response, state):
+        elapsed = perf_counter() - state
+
+        match = getattr(request, 'resolver_match', None)
+        # url_name where routes have one, otherwise the (low-cardinality) route pattern
+        view = (match.url_name or match.route) if match else 'unmatched'
+        registry.observe('collection_http_request_duration_seconds', elapsed,
+                         view=view, method=request.method)
+        registry.inc('collection_http_requests_total',
+                     view=view, method=request.method, status=response.status_code)
+        registry.maybe_flush()
+        return response
+
+
+class ReadReplicaMiddleware(HybridMiddleware):
+    """
+    Let GET/HEAD requests read from the replica. Any other request sets a
+    short-lived cookie that keeps that browser's reads on the primary for
+    REPLICA_STICKY_SECONDS, so e.g. the cart status poll right after an
+    add-to-cart or checkout sees its own write despite replication lag.
+
+    Removed from the chain when no replica is configured.
+    """
+    PIN_COOKIE = 'rh_primary'
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        if not replica_configured():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.sticky_seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+
+    def before(self, request):
+        replica = request.method in self.SAFE_METHODS and self.PIN_COOKIE not in request.COOKIES
+        return enable_replica_reads(replica)
+
+    def finish(self, state):
+        reset_replica_reads(state)
+
+    def after(self, request, response, state):
+        if request.method not in self.SAFE_METHODS:
+            response.set_cookie(
+                self.PIN_COOKIE, '1', max_age=self.sticky_seconds,
+                httponly=True, samesite='Lax', secure=request.is_secure(),
+            )
+        return response
+
+
+class ProfilingMiddleware(HybridMiddleware):
+    """
+    Run the request under collection.profiling when a staff user asks for
+    it with ?_profile=1 or X-Profile: 1. Must come after
+    AuthenticationMiddleware. Removed from the chain when PROFILING is off.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING', False):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        install_query_log()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not (requested(request) and request.user.is_staff):
+            return self.get_response(request)
+        profile = RequestProfile()
+        profile.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profile.stop()
+        response[PROFILE_ID_HEADER] = profile.save(request, response)
+        return response
+
+    async def __acall__(self, request):
+        if not requested(request):
+            return await self.get_response(request)
+        user = await request.auser()
+        if not user.is_staff:
+            return await self.get_response(request)
+        profile = RequestProfile()
+        profile.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profile.stop()
+        response[PROFILE_ID_HEADER] = await sync_to_async(profile.save)(request, response)
+        return response
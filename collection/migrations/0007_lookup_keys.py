@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:59
+
+from django.db import migrations, models
+
+from collection.models import lookup_key
+
+BACKFILL_BATCH = 2000
+
+
+def _backfill(model, fields):
+    # in Python, not SQL Lower(Trim()): TRIM only strips spaces and SQLite's
+    # LOWER is ASCII-only, so those keys wouldn't match what imports compute
+    batch = []
+    for obj in model.objects.only('pk', *fields).iterator(chunk_size=BACKFILL_BATCH):
+        for field in fields:
+            setattr(obj, f"{field}_key", lookup_key(getattr(obj, field)))
+        batch.append(obj)
+        if len(batch) >= BACKFILL_BATCH:
+            model.objects.bulk_update(batch, [f"{field}_key" for field in fields])
+            batch = []
+    if batch:
+        model.objects.bulk_update(batch, [f"{field}_key" for field in fields])
+
+
+def backfill_lookup_keys(apps, schema_editor):
+    _backfill(apps.get_model('collection', 'Card'), ['name'])
+    _backfill(apps.get_model('collection', 'CardSet'), ['name', 'code'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collection', '0006_catalogstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='name_key',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='cardset',
+            name='code_key',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='cardset',
+            name='name_key',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='collectioncard',
+            index=models.Index(fields=['card', 'card_set', 'edition', 'psa'], name='cc_match_idx'),
+        ),
+        migrations.RunPython(backfill_lookup_keys, migrations.RunPython.noop),
+    ]
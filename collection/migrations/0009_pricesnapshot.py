@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def seed_price_history(apps, schema_editor):
+    # start the history from the prices currently on the collection
+    CollectionCard = apps.get_model('collection', 'CollectionCard')
+    PriceSnapshot = apps.get_model('collection', 'PriceSnapshot')
+    now = timezone.now()
+    rows = CollectionCard.objects.values_list(
+        'id', 'card_id', 'card_set_id', 'edition', 'import_batch_id', 'quantity',
+        'value_low', 'value_mid', 'value_high', 'effective_mid',
+    ).iterator(chunk_size=2000)
+    PriceSnapshot.objects.bulk_create(
+        (
+            PriceSnapshot(
+                listing_id=listing_id, card_id=card_id, card_set_id=card_set_id, edition=edition or '',
+                import_batch_id=batch_id, recorded_at=now, quantity=quantity or 0,
+                value_low=low, value_mid=mid, value_high=high, effective_mid=effective,
+            )
+            for listing_id, card_id, card_set_id, edition, batch_id, quantity, low, mid, high, effective in rows
+        ),
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collection', '0008_outboundemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('listing_id', models.BigIntegerField()),
+                ('edition', models.CharField(blank=True, max_length=50)),
+                ('recorded_at', models.DateTimeField(db_index=True)),
+                ('quantity', models.IntegerField(default=0)),
+                ('value_low', models.FloatField(blank=True, null=True)),
+                ('value_mid', models.FloatField(blank=True, null=True)),
+                ('value_high', models.FloatField(blank=True, null=True)),
+                ('effective_mid', models.FloatField(blank=True, null=True)),
+                ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_snapshots', to='collection.card')),
+                ('card_set', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='price_snapshots', to='collection.cardset')),
+                ('import_batch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='price_snapshots', to='collection.importbatch')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['listing_id', '-recorded_at'], name='price_listing_idx')],
+            },
+        ),
+        migrations.RunPython(seed_price_history, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:24
+
+from django.db import migrations, models
+from django.db.models import CharField, Count, F, FloatField, Max, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+
+def seed_rollups(apps, schema_editor):
+    # same grouping as collection.rollups.rebuild, against the historical models
+    CollectionCard = apps.get_model('collection', 'CollectionCard')
+    InventoryRollup = apps.get_model('collection', 'InventoryRollup')
+    price = Coalesce(
+        NullIf(F('effective_mid'), Value(0.0)), NullIf(F('value_mid'), Value(0.0)), Value(0.0),
+        output_field=FloatField(),
+    )
+    qs = CollectionCard.objects.annotate(stock_value=price * F('quantity'))
+    dimensions = {
+        'set': ('card_set_id', 'card_set__name'),
+        'edition': ('edition', None),
+        'batch': ('import_batch_id', 'import_batch__name'),
+        'source': ('pricing_source', None),
+    }
+    for dimension, (field, label_field) in dimensions.items():
+        aggregates = dict(listings=Count('id'), units=Sum('quantity'),
+                          reserved_units=Sum('reserved'), value=Sum('stock_value'))
+        if label_field:
+            aggregates['label'] = Max(label_field)
+        rows = (
+            qs.annotate(rollup_key=Coalesce(Cast(field, CharField()), Value('')))
+            .values('rollup_key').annotate(**aggregates).order_by()
+        )
+        InventoryRollup.objects.bulk_create([
+            InventoryRollup(
+                dimension=dimension, key=row['rollup_key'],
+                label=(row['label'] or '') if label_field else row['rollup_key'],
+                listings=row['listings'], units=row['units'] or 0,
+                reserved=row['reserved_units'] or 0, value=row['value'] or 0,
+            )
+            for row in rows
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collection', '0009_pricesnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('set', 'Card set'), ('edition', 'Edition'), ('batch', 'Import batch'), ('source', 'Pricing source')], max_length=16)),
+                ('key', models.CharField(blank=True, max_length=255)),
+                ('label', models.CharField(blank=True, max_length=255)),
+                ('listings', models.IntegerField(default=0)),
+                ('units', models.IntegerField(default=0)),
+                ('reserved', models.IntegerField(default=0)),
+                ('value', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'key'), name='uq_rollup_dimension_key')],
+            },
+        ),
+        migrations.RunPython(seed_rollups, migrations.RunPython.noop),
+    ]
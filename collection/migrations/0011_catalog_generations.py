@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def seed_generation(apps, schema_editor):
+    # the existing catalog becomes the first live generation
+    CatalogGeneration = apps.get_model('collection', 'CatalogGeneration')
+    CatalogState = apps.get_model('collection', 'CatalogState')
+    CollectionCard = apps.get_model('collection', 'CollectionCard')
+    generation = CatalogGeneration.objects.create(status='live', activated_at=timezone.now())
+    CollectionCard.objects.update(generation=generation.pk)
+    CatalogState.objects.update_or_create(pk=1, defaults={'active_generation': generation.pk})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collection', '0010_inventoryrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogstate',
+            name='active_generation',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='collectioncard',
+            name='generation',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='collectioncard',
+            name='successor',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='collection.collectioncard'),
+        ),
+        migrations.CreateModel(
+            name='CatalogGeneration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('building', 'Building'), ('live', 'Live'), ('retired', 'Retired'), ('collected', 'Collected')], default='building', max_length=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('activated_at', models.DateTimeField(blank=True, null=True)),
+                ('retired_at', models.DateTimeField(blank=True, null=True)),
+                ('import_batch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='generations', to='collection.importbatch')),
+            ],
+        ),
+        migrations.RunPython(seed_generation, migrations.RunPython.noop),
+    ]
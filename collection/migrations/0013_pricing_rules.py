@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collection', '0012_order_lines'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collectioncard',
+            name='sell_price',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='PricingRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('active', models.BooleanField(default=True)),
+                ('priority', models.PositiveIntegerField(default=100, help_text='Lower runs first when picking the rounding')),
+                ('condition', models.CharField(blank=True, max_length=20)),
+                ('edition', models.CharField(blank=True, max_length=50)),
+                ('psa', models.CharField(blank=True, max_length=255, verbose_name='PSA grade')),
+                ('markup_percent', models.FloatField(default=0, help_text='e.g. 15 for +15%, -10 for -10%')),
+                ('floor', models.FloatField(blank=True, help_text='Minimum price in dollars', null=True)),
+                ('rounding', models.CharField(blank=True, choices=[('', 'Nearest cent'), ('whole', 'Up to whole dollars'), ('99', 'Up to x.99'), ('49_99', 'Up to x.49 / x.99')], max_length=8)),
+                ('card_set', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='pricing_rules', to='collection.cardset')),
+            ],
+            options={
+                'ordering': ('priority', 'id'),
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collection', '0013_pricing_rules'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collectioncard',
+            name='markup_percent',
+            field=models.FloatField(default=0, help_text='e.g. 10 for +10%, -5 for -5%'),
+        ),
+    ]
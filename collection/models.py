@@ -1,23 +1,88 @@
-from django.db import models
-from django.db.models.signals import post_delete
-from django.dispatch import receiver
+from django.db import models, transaction
+from django.db.models import F, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
 import os
 from django.conf import settings
 
+from . import prerender
+
 class Order(models.Model):
     stripe_order_id = models.CharField(max_length=255, unique=True)
-    email = models.EmailField()
-    status = models.CharField(max_length=50, default='paid')  # paid, shipped, etc.
+    email = models.EmailField(db_index=True)
+    status = models.CharField(max_length=50, default='paid', db_index=True)  # paid, shipped, etc.
     shipping_name = models.CharField(max_length=255, blank=True)
     shipping_address = models.JSONField(blank=True, null=True)
-    items = models.JSONField()  # list of line items: description + quantity
+    items = models.JSONField()  # list of line items: description + quantity (OrderLine has the rows)
     tracking_number = models.CharField(max_length=255, blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Order {self.stripe_order_id} ({self.email})"
 
+class OrderLine(models.Model):
+    """
+    One sold listing of an Order, written by record_sale from the
+    reservation. Card and set are copied off the listing so sales reports
+    survive the listing being replaced or deleted.
+    """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    collection_card = models.ForeignKey('CollectionCard', on_delete=models.SET_NULL, null=True, blank=True, related_name='order_lines')
+    card = models.ForeignKey('Card', on_delete=models.SET_NULL, null=True, blank=True, related_name='order_lines')
+    card_set = models.ForeignKey('CardSet', on_delete=models.SET_NULL, null=True, blank=True, related_name='order_lines')
+    edition = models.CharField(max_length=50, blank=True, default='')
+    description = models.CharField(max_length=255)
+    quantity = models.PositiveIntegerField()
+    unit_amount = models.PositiveIntegerField()  # cents
+
+    def __str__(self):
+        return f"{self.quantity} x {self.description}"
+
+    @property
+    def subtotal(self):
+        return self.quantity * self.unit_amount
+
+class OutboundEmail(models.Model):
+    """
+    Outbox row for mail sent by the send_outbox worker, so admin actions
+    only enqueue and failures are retried instead of lost.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+    KIND_CHOICES = (
+        ('tracking', 'Tracking'),
+    )
+
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='emails')
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    text_body = models.TextField()
+    html_body = models.TextField(blank=True)
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} email to {self.to_email} ({self.status})"
+
 class CollectionImport(models.Model):
     uploaded_at = models.DateTimeField(auto_now_add=True)
     file = models.FileField(upload_to="imports/")
@@ -26,21 +91,59 @@ class CollectionImport(models.Model):
     def __str__(self):
         return f"Import @ {self.uploaded_at}"
 
+def lookup_key(value):
+    """Case-insensitive match key stored alongside names/codes so importer
+    lookups are plain indexed equality instead of unindexable iexact."""
+    return (value or '').strip().lower()
+
+
+def _with_key_fields(update_fields, mapping):
+    # keep *_key columns in step when save() is called with update_fields
+    if update_fields is None:
+        return None
+    update_fields = set(update_fields)
+    for source, key in mapping.items():
+        if source in update_fields:
+            update_fields.add(key)
+    return update_fields
+
+
 class CardSet(models.Model):
     name = models.CharField(max_length=255)
     code = models.CharField(max_length=64, null=True, blank=True, db_index=True)
     release_date = models.DateField(null=True, blank=True)
 
+    # normalized lower-case copies used by the importer
+    name_key = models.CharField(max_length=255, blank=True, default='', db_index=True, editable=False)
+    code_key = models.CharField(max_length=64, blank=True, default='', db_index=True, editable=False)
+
     def __str__(self):
         return f"{self.name} ({self.code})" if self.code else self.name
 
+    def save(self, *args, **kwargs):
+        self.name_key = lookup_key(self.name)
+        self.code_key = lookup_key(self.code)
+        kwargs['update_fields'] = _with_key_fields(
+            kwargs.get('update_fields'), {'name': 'name_key', 'code': 'code_key'}
+        )
+        super().save(*args, **kwargs)
+
 class Card(models.Model):
     name = models.CharField(max_length=255, db_index=True)
     konami_id = models.BigIntegerField(null=True, blank=True, db_index=True)
 
+    name_key = models.CharField(max_length=255, blank=True, default='', db_index=True, editable=False)
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.name_key = lookup_key(self.name)
+        kwargs['update_fields'] = _with_key_fields(
+            kwargs.get('update_fields'), {'name': 'name_key'}
+        )
+        super().save(*args, **kwargs)
+
 class ImportBatch(models.Model):
     name = models.CharField(max_length=255, db_index=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
@@ -51,6 +154,17 @@ class ImportBatch(models.Model):
     def __str__(self):
         return f"{self.name} @ {self.uploaded_at.isoformat()} ({self.mode})"
 
+class LiveCollectionCardManager(models.Manager):
+    """
+    Only the rows of the live catalog generation. Replace imports build the
+    next generation beside it and switch CatalogState.active_generation
+    (see collection.generations); the pointer is read in the same query.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(generation=CatalogState.live_generation_expression())
+
+
 class CollectionCard(models.Model):
     card = models.ForeignKey(Card, on_delete=models.CASCADE, related_name='collection_entries')
     card_set = models.ForeignKey(CardSet, on_delete=models.SET_NULL, null=True, blank=True, related_name='collection_entries')
@@ -67,6 +181,10 @@ class CollectionCard(models.Model):
     value_high = models.FloatField(null=True, blank=True)
     effective_mid = models.FloatField(null=True, blank=True)
     pricing_source = models.CharField(max_length=64, null=True, blank=True)
+    # this listing's own markup on top of the PricingRules (admin "Set markup" action)
+    markup_percent = models.FloatField(default=0, help_text='e.g. 10 for +10%, -5 for -5%')
+    # storefront price after the PricingRules, written in bulk by pricing.reprice()
+    sell_price = models.FloatField(null=True, blank=True, editable=False)
 
     import_batch = models.ForeignKey(ImportBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='cards')
     exported_id = models.IntegerField(null=True, blank=True, db_index=True)
@@ -74,6 +192,27 @@ class CollectionCard(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # catalog generation the row belongs to; filled in from the live one on save
+    generation = models.PositiveIntegerField(db_index=True, editable=False)
+    # set when a swap carries this row's open reservation over to the next generation
+    successor = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+')
+
+    objects = LiveCollectionCardManager()
+    # every generation: retired rows still referenced by checkouts, staging rows
+    all_generations = models.Manager()
+
+    class Meta:
+        indexes = [
+            # serves _identify_collection_card: (card, card_set) narrows to a
+            # handful of rows before the edition/psa comparison
+            models.Index(fields=['card', 'card_set', 'edition', 'psa'], name='cc_match_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.generation is None:
+            self.generation = CatalogState.live_generation()
+        super().save(*args, **kwargs)
+
         # optional: helper property for available stock
     @property
     def available(self):
@@ -103,10 +242,233 @@ class CollectionImage(models.Model):
         return f"Image for {self.collection_card}"
 
 
+class PriceSnapshot(models.Model):
+    """
+    Prices and quantity of one listing as recorded by one import run.
+    A listing keeps its last recorded value until a later run records it
+    again, or records it at zero once the listing has been deleted.
+    """
+    # CollectionCard id, kept as a plain column so the history outlives the row
+    listing_id = models.BigIntegerField()
+    card = models.ForeignKey(Card, on_delete=models.CASCADE, related_name='price_snapshots')
+    card_set = models.ForeignKey(CardSet, on_delete=models.SET_NULL, null=True, blank=True, related_name='price_snapshots')
+    edition = models.CharField(max_length=50, blank=True)
+    import_batch = models.ForeignKey(ImportBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='price_snapshots')
+    recorded_at = models.DateTimeField(db_index=True)
+
+    quantity = models.IntegerField(default=0)
+    value_low = models.FloatField(null=True, blank=True)
+    value_mid = models.FloatField(null=True, blank=True)
+    value_high = models.FloatField(null=True, blank=True)
+    effective_mid = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['listing_id', '-recorded_at'], name='price_listing_idx'),
+        ]
+
+    def __str__(self):
+        return f"Listing {self.listing_id} @ {self.recorded_at.isoformat()}"
+
+
+class PricingRule(models.Model):
+    """
+    Adjustment applied to the market price (effective_mid, else value_mid)
+    of every listing matching all of the rule's non-blank fields. Markups
+    of all matching rules multiply, the highest matching floor wins, and
+    the first matching rule (by priority) with a rounding picks it.
+    See collection.pricing.
+    """
+    ROUNDING_CHOICES = (
+        ('', 'Nearest cent'),
+        ('whole', 'Up to whole dollars'),
+        ('99', 'Up to x.99'),
+        ('49_99', 'Up to x.49 / x.99'),
+    )
+
+    name = models.CharField(max_length=100)
+    active = models.BooleanField(default=True)
+    priority = models.PositiveIntegerField(default=100, help_text='Lower runs first when picking the rounding')
+
+    condition = models.CharField(max_length=20, blank=True)
+    edition = models.CharField(max_length=50, blank=True)
+    psa = models.CharField(max_length=255, blank=True, verbose_name='PSA grade')
+    card_set = models.ForeignKey(CardSet, on_delete=models.CASCADE, null=True, blank=True, related_name='pricing_rules')
+
+    markup_percent = models.FloatField(default=0, help_text='e.g. 15 for +15%, -10 for -10%')
+    floor = models.FloatField(null=True, blank=True, help_text='Minimum price in dollars')
+    rounding = models.CharField(max_length=8, choices=ROUNDING_CHOICES, blank=True)
+
+    class Meta:
+        ordering = ('priority', 'id')
+
+    def __str__(self):
+        return self.name
+
+
+class InventoryRollup(models.Model):
+    """
+    Stock totals for one set / edition / import batch / pricing source,
+    maintained by collection.rollups so the admin report never has to
+    aggregate the whole collection.
+    """
+    DIMENSION_CHOICES = (
+        ('set', 'Card set'),
+        ('edition', 'Edition'),
+        ('batch', 'Import batch'),
+        ('source', 'Pricing source'),
+    )
+
+    dimension = models.CharField(max_length=16, choices=DIMENSION_CHOICES)
+    # pk of the set/batch, or the edition/source itself; '' for none
+    key = models.CharField(max_length=255, blank=True)
+    label = models.CharField(max_length=255, blank=True)
+
+    listings = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    reserved = models.IntegerField(default=0)
+    value = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'key'], name='uq_rollup_dimension_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_dimension_display()}: {self.label or '(none)'}"
+
+    @property
+    def available(self):
+        return self.units - self.reserved
+
+
+class CatalogGeneration(models.Model):
+    """One generation of the catalog, built by a replace import."""
+    STATUS_CHOICES = (
+        ('building', 'Building'),
+        ('live', 'Live'),
+        ('retired', 'Retired'),
+        ('collected', 'Collected'),
+    )
+
+    import_batch = models.ForeignKey(ImportBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='generations')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='building')
+    created_at = models.DateTimeField(auto_now_add=True)
+    activated_at = models.DateTimeField(null=True, blank=True)
+    retired_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Generation {self.pk} ({self.status})"
+
+
+class CatalogState(models.Model):
+    """
+    Single-row counter bumped whenever storefront-visible data changes.
+    Cached catalog payloads are keyed by this version so every worker
+    sees the same invalidation without a shared cache.
+    """
+    version = models.BigIntegerField(default=0)
+    # CatalogGeneration whose CollectionCard rows the storefront sees
+    active_generation = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    SINGLETON_ID = 1
+
+    def __str__(self):
+        return f"Catalog v{self.version}"
+
+    @classmethod
+    def current(cls):
+        # read through the router like the catalog rows themselves, so a
+        # lagging replica never caches old rows under a newer version
+        version = cls.objects.filter(pk=cls.SINGLETON_ID).values_list('version', flat=True).first()
+        if version is None:
+            version = cls.objects.get_or_create(pk=cls.SINGLETON_ID)[0].version
+        return version
+
+    @classmethod
+    def live_generation(cls):
+        generation = cls.objects.filter(pk=cls.SINGLETON_ID).values_list('active_generation', flat=True).first()
+        return generation or 0
+
+    @classmethod
+    def live_generation_expression(cls):
+        # subquery, so filtering on it costs no extra round trip
+        return Coalesce(
+            Subquery(cls.objects.filter(pk=cls.SINGLETON_ID).values('active_generation')[:1]),
+            Value(0),
+            output_field=models.PositiveIntegerField(),
+        )
+
+    @classmethod
+    def _increment(cls):
+        if not cls.objects.filter(pk=cls.SINGLETON_ID).update(version=F('version') + 1):
+            cls.objects.get_or_create(pk=cls.SINGLETON_ID, defaults={'version': 1})
+
+    @classmethod
+    def bump(cls):
+        """
+        Schedule one increment for when the current transaction commits.
+        Repeated calls inside the same transaction (e.g. an import saving
+        thousands of rows) collapse into a single UPDATE, so the counter
+        row is never held locked for the length of a long transaction.
+        """
+        conn = transaction.get_connection()
+        if conn.in_atomic_block and any(
+            getattr(entry[1], 'catalog_bump', False) for entry in conn.run_on_commit
+        ):
+            return
+        transaction.on_commit(_catalog_bump_callback)
+
+
+# sent once the catalog version has moved (collection.snapshot listens)
+catalog_changed = Signal()
+
+
+def _catalog_bump_callback():
+    CatalogState._increment()
+    catalog_changed.send(sender=CatalogState)
+
+
+_catalog_bump_callback.catalog_bump = True
+
+
+@receiver(post_save, sender=CollectionCard)
+@receiver(post_delete, sender=CollectionCard)
+@receiver(post_save, sender=CollectionImage)
+@receiver(post_delete, sender=CollectionImage)
+@receiver(post_save, sender=Card)
+@receiver(post_save, sender=CardSet)
+def bump_catalog_version(sender, **kwargs):
+    CatalogState.bump()
+
+
+@receiver(post_save, sender=CollectionCard)
+@receiver(post_delete, sender=CollectionCard)
+def refresh_card_page(sender, instance, **kwargs):
+    prerender.card_changed(instance, deleted='created' not in kwargs)
+
+
+@receiver(post_save, sender=CollectionImage)
+@receiver(post_delete, sender=CollectionImage)
+def refresh_card_page_images(sender, instance, **kwargs):
+    prerender.drop_cards([instance.collection_card_id])
+
+
+@receiver(post_save, sender=Card)
+@receiver(post_save, sender=CardSet)
+def refresh_all_card_pages(sender, **kwargs):
+    prerender.drop_all_cards()
+
+
 @receiver(post_delete, sender=CollectionImage)
 def delete_image_file(sender, instance, **kwargs):
     """Delete the image file from disk when CollectionImage is deleted."""
     if instance.img:
+        # a replace import's new generation can point at the same file
+        if CollectionImage.objects.filter(img=instance.img.name).exists():
+            return
         img_path = os.path.join(settings.MEDIA_ROOT, str(instance.img))
         if os.path.exists(img_path):
             os.remove(img_path)
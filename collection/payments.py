@@ -0,0 +1,303 @@
+"""
+Payment gateway interface used by the checkout views, the webhook and
+expire_stripe_sessions.
+
+settings.PAYMENT_GATEWAY names the implementation (dotted path). The
+default talks to Stripe; FakeGateway is an offline stand-in with
+simulated latency for benchmarks and load tests.
+"""
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import requests
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+try:
+    import httpx
+except ImportError:  # async Stripe calls fall back to a worker thread
+    httpx = None
+
+DEFAULT_GATEWAY = 'collection.payments.StripeGateway'
+
+
+class PaymentGatewayUnavailable(Exception):
+    """Raised without calling out when the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds, then lets a single trial call through
+    (half-open). A success closes it again.
+    """
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == 'open' or (state == 'half-open' and self._trial_in_flight):
+                raise PaymentGatewayUnavailable("Payment provider unavailable (circuit open)")
+            if state == 'half-open':
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+    def call(self, fn, *args, failure_types=(Exception,), **kwargs):
+        self.before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except failure_types:
+            self.record_failure()
+            raise
+        except Exception:
+            # e.g. card declined / invalid request: the provider answered fine
+            self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    async def acall(self, fn, *args, failure_types=(Exception,), **kwargs):
+        self.before_call()
+        try:
+            result = await fn(*args, **kwargs)
+        except failure_types:
+            self.record_failure()
+            raise
+        except Exception:
+            self.record_success()
+            raise
+        self.record_success()
+        return result
+
+
+class PaymentGateway:
+    def create_checkout_session(self, **params):
+        """Create a hosted checkout session; returns an object with .id and .url."""
+        raise NotImplementedError
+
+    def construct_event(self, payload, sig_header, secret):
+        """Verify and parse a webhook payload; returns a dict-like event."""
+        raise NotImplementedError
+
+    def list_open_sessions(self):
+        """Iterate open checkout sessions (objects with .id, .created, .metadata)."""
+        raise NotImplementedError
+
+    def expire_session(self, session_id):
+        raise NotImplementedError
+
+    # Async variants for the ASGI views. The defaults run the sync call in a
+    # worker thread; gateways with a native async client override them.
+
+    async def acreate_checkout_session(self, **params):
+        return await sync_to_async(self.create_checkout_session, thread_sensitive=False)(**params)
+
+
+def _requests_client_class():
+    # top-level since stripe 8; lived in stripe.http_client before that
+    return getattr(stripe, 'RequestsClient', None) or stripe.http_client.RequestsClient
+
+
+class StripeGateway(PaymentGateway):
+    """
+    Stripe behind one pooled keep-alive HTTP session with strict
+    connect/read timeouts. The stripe library retries connection errors
+    and retryable responses (409/5xx) with jittered exponential backoff
+    and idempotency keys, up to PAYMENT_MAX_RETRIES. On top of that a
+    circuit breaker fails fast while Stripe is down, so sync workers
+    (and the row locks held by checkout) aren't tied up waiting on it.
+    """
+
+    # outages and overload, as opposed to errors about the request itself
+    FAILURE_TYPES = (
+        stripe.error.APIConnectionError,
+        stripe.error.APIError,
+        stripe.error.RateLimitError,
+    )
+
+    def __init__(self):
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        stripe.api_base = settings.STRIPE_API_BASE
+        stripe.max_network_retries = settings.PAYMENT_MAX_RETRIES
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=settings.PAYMENT_POOL_SIZE,
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        client_kwargs = {}
+        self.native_async = httpx is not None and hasattr(stripe.checkout.Session, 'create_async')
+        if self.native_async:
+            # stripe's *_async methods go through this pooled httpx client
+            client_kwargs['async_fallback_client'] = stripe.HTTPXClient(
+                timeout=httpx.Timeout(settings.PAYMENT_READ_TIMEOUT,
+                                      connect=settings.PAYMENT_CONNECT_TIMEOUT),
+            )
+        stripe.default_http_client = _requests_client_class()(
+            timeout=(settings.PAYMENT_CONNECT_TIMEOUT, settings.PAYMENT_READ_TIMEOUT),
+            session=self.session,
+            **client_kwargs,
+        )
+
+        self.breaker = CircuitBreaker(
+            settings.PAYMENT_BREAKER_THRESHOLD, settings.PAYMENT_BREAKER_RESET,
+        )
+
+    def _call(self, fn, *args, **kwargs):
+        return self.breaker.call(fn, *args, failure_types=self.FAILURE_TYPES, **kwargs)
+
+    def create_checkout_session(self, **params):
+        return self._call(stripe.checkout.Session.create, **params)
+
+    def construct_event(self, payload, sig_header, secret):
+        # local signature check, no network involved
+        return stripe.Webhook.construct_event(payload, sig_header, secret)
+
+    def list_open_sessions(self):
+        page = self._call(stripe.checkout.Session.list, status="open", limit=100)
+        while True:
+            yield from page.data
+            if not page.has_more:
+                return
+            page = self._call(stripe.checkout.Session.list, status="open", limit=100,
+                              starting_after=page.data[-1].id)
+
+    def expire_session(self, session_id):
+        return self._call(stripe.checkout.Session.expire, session_id)
+
+    async def acreate_checkout_session(self, **params):
+        if not self.native_async:
+            return await super().acreate_checkout_session(**params)
+        return await self.breaker.acall(stripe.checkout.Session.create_async,
+                                        failure_types=self.FAILURE_TYPES, **params)
+
+
+class FakeGateway(PaymentGateway):
+    """
+    In-memory gateway. Every call sleeps `latency` seconds (+/- `jitter`)
+    to mimic the network round trip the real views block on.
+    """
+
+    def __init__(self, latency=None, jitter=None):
+        self.latency = settings.PAYMENT_FAKE_LATENCY if latency is None else latency
+        self.jitter = settings.PAYMENT_FAKE_JITTER if jitter is None else jitter
+        self.sessions = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        delay = self._delay()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _delay(self):
+        return max(self.latency + random.uniform(-self.jitter, self.jitter), 0)
+
+    def create_checkout_session(self, **params):
+        self._wait()
+        return self._new_session(params)
+
+    async def acreate_checkout_session(self, **params):
+        await asyncio.sleep(self._delay())
+        return self._new_session(params)
+
+    def _new_session(self, params):
+        with self._lock:
+            sid = f"cs_fake_{next(self._ids)}"
+            session = SimpleNamespace(
+                id=sid,
+                url=f"https://checkout.invalid/{sid}",
+                created=int(time.time()),
+                status='open',
+                metadata=dict(params.get('metadata') or {}),
+            )
+            self.sessions[sid] = session
+        return session
+
+    def construct_event(self, payload, sig_header, secret):
+        return json.loads(payload)
+
+    def list_open_sessions(self):
+        self._wait()
+        return [s for s in list(self.sessions.values()) if s.status == 'open']
+
+    def expire_session(self, session_id):
+        self._wait()
+        self.sessions[session_id].status = 'expired'
+
+    def event_for(self, session_id, event_type, email='loadtest@example.com'):
+        """Build the webhook payload Stripe would send for this session."""
+        session = self.sessions[session_id]
+        return {
+            'id': f"evt_{session_id}_{event_type}",
+            'type': event_type,
+            'created': int(time.time()),
+            'data': {'object': {
+                'id': session_id,
+                'metadata': session.metadata,
+                'customer_details': {'email': email},
+                'shipping': {'name': 'Load Test', 'address': {'country': 'US'}},
+            }},
+        }
+
+
+_gateways = {}
+_override = None
+
+
+def get_gateway():
+    if _override is not None:
+        return _override
+    path = getattr(settings, 'PAYMENT_GATEWAY', DEFAULT_GATEWAY)
+    gateway = _gateways.get(path)
+    if gateway is None:
+        gateway = _gateways[path] = import_string(path)()
+    return gateway
+
+
+@contextmanager
+def use_gateway(gateway):
+    """Temporarily route all payment calls to `gateway` (benchmarks, load tests)."""
+    global _override
+    previous, _override = _override, gateway
+    try:
+        yield gateway
+    finally:
+        _override = previous
@@ -0,0 +1,27 @@
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+POLL_INTERVAL_HEADER = 'X-Poll-Interval'
+
+
+def poll_interval(view):
+    """
+    Add the X-Poll-Interval hint (seconds) that static/collection/poll.js
+    follows, so polling load can be turned down from settings without a
+    frontend deploy.
+    """
+    def add_hint(response):
+        response[POLL_INTERVAL_HEADER] = str(settings.POLL_INTERVAL_SECONDS)
+        return response
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def _wrapped(request, *args, **kwargs):
+            return add_hint(await view(request, *args, **kwargs))
+    else:
+        @wraps(view)
+        def _wrapped(request, *args, **kwargs):
+            return add_hint(view(request, *args, **kwargs))
+    return _wrapped
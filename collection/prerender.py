@@ -0,0 +1,235 @@
+"""
+Pre-rendered HTML for the pages that don't depend on the visitor.
+
+The content pages (about, terms, ...) and each listing's card page are
+rendered once and written under PRERENDER_DIR: <name>.html, its .gz/.br
+copies and <name>.json holding the fingerprint (a hash of the HTML, sent
+as the ETag). Later hits are answered from those files by serve(), with
+no template rendering and no database work, which is what crawlers and
+shared-link spikes mostly hit.
+
+Card pages leave the stock state out: they always render the buy
+buttons and card_detail.html swaps them using /api/card-status/. A page
+is written on its first hit (or by `manage.py prerender`) and dropped
+once its listing changes: ORM saves/deletes (signals in models.py) and
+pricing.reprice drop the affected files on commit and the next hit
+renders them again. Each template revision gets its own directory, so a
+deploy that edits a template starts from scratch.
+
+Card pages are rendered from the primary, and a render that overlaps a
+change could still store the old data after that change's drop has run.
+So render() reads the catalog version before building and again after
+writing, and drops its own page if it moved: every change that drops
+pages bumps the version first (both on commit), so either the re-check
+sees the bump or the change's drop comes after the write.
+
+WhiteNoise indexes its files once at startup and doesn't see pages
+rewritten while the process runs, so serve() does the same job for this
+directory: the precompressed variant for the Accept-Encoding, ETag and
+304s. None of these pages carries a CSRF token or anything per visitor,
+so unlike other HTML (see CompressedJSONMiddleware) they can be
+compressed.
+"""
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponseNotModified
+from django.utils.http import parse_etags
+
+from . import catalog
+from .routers import use_replica
+
+CONTENT_PAGES = {
+    'about': 'collection/about.html',
+    'terms': 'collection/terms.html',
+    'privacy': 'collection/privacy.html',
+    'success': 'collection/success.html',
+    'cancel': 'collection/cancel.html',
+}
+CONTENT_TYPE = 'text/html; charset=utf-8'
+EXTENSIONS = {'identity': '.html', 'gzip': '.html.gz', 'br': '.html.br'}
+
+# the listing fields a card page shows; a save that leaves them alone
+# (a reservation, a stock edit) keeps the page
+CARD_FIELDS = (
+    'card_id', 'card_set_id', 'edition', 'condition', 'misprint', 'psa', 'notes',
+    'sell_price', 'effective_mid', 'value_mid',
+)
+
+
+@lru_cache(maxsize=None)
+def template_revision():
+    """Short hash of the app's templates, the same on every instance of a deploy."""
+    digest = hashlib.sha1()
+    templates = Path(__file__).resolve().parent / 'templates'
+    for path in sorted(templates.rglob('*.html')):
+        digest.update(str(path.relative_to(templates)).encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:12]
+
+
+def root():
+    return os.path.join(settings.PRERENDER_DIR, template_revision())
+
+
+def _cards_dir():
+    return os.path.join(root(), 'cards')
+
+
+def content_page(name):
+    return os.path.join('pages', name)
+
+
+def card_page(card_id):
+    return os.path.join('cards', str(int(card_id)))
+
+
+def card_key(card):
+    """What a card page's content depends on, to tell whether a save changed it."""
+    return repr(tuple(getattr(card, field) for field in CARD_FIELDS))
+
+
+def _path(name, suffix):
+    return os.path.join(root(), name + suffix)
+
+
+def _meta(name):
+    try:
+        with open(_path(name, '.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_stored(name):
+    return os.path.exists(_path(name, '.json'))
+
+
+def write(name, html, key=None):
+    """Store a rendered page and its compressed copies; returns its ETag."""
+    raw = html.encode('utf-8')
+    etag = f'"{hashlib.sha1(raw).hexdigest()[:16]}"'
+    os.makedirs(os.path.dirname(_path(name, '')), exist_ok=True)
+    tmp = f".{uuid.uuid4().hex[:8]}.tmp"
+    files = [(EXTENSIONS[encoding], body) for encoding, body in catalog._variants(raw).items()]
+    # the fingerprint goes last: a reader never pairs the new one with old bytes
+    files.append(('.json', json.dumps({'etag': etag, 'key': key}).encode()))
+    for suffix, body in files:
+        with open(_path(name, suffix + tmp), 'wb') as f:
+            f.write(body)
+        os.replace(_path(name, suffix + tmp), _path(name, suffix))
+    return etag
+
+
+def drop(name):
+    # the fingerprint goes first, so serve() treats the page as missing
+    for suffix in ('.json', *EXTENSIONS.values()):
+        try:
+            os.remove(_path(name, suffix))
+        except FileNotFoundError:
+            pass
+
+
+def render(name, build, version=None):
+    """
+    Render `name` through `build()` and store it; returns (html, etag).
+    `version()`, for pages that show catalog data, returns the catalog
+    version: the page is only kept if it didn't move while rendering.
+    """
+    # a replica may not have the change that dropped the page yet
+    with use_replica(False):
+        before = version() if version else None
+        html, key = build()
+        etag = write(name, html, key)
+        if version and version() != before:
+            drop(name)
+    return html, etag
+
+
+def serve(request, name, build, version=None):
+    """
+    Respond with the stored page `name`, rendering it first through `build`
+    when missing. `build()` returns (html, key) and may raise Http404;
+    `version` is as for render().
+    """
+    meta = _meta(name)
+    if meta is None:
+        html, etag = render(name, build, version)
+        meta = {'etag': etag}
+
+    etag = meta['etag']
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    encoding = catalog.negotiate_encoding(request)
+    if encoding not in EXTENSIONS:
+        encoding = 'identity'
+    try:
+        with open(_path(name, EXTENSIONS[encoding]), 'rb') as f:
+            body = f.read()
+    except FileNotFoundError:
+        # dropped (or written without Brotli) since the fingerprint was read
+        html, etag = render(name, build, version)
+        return catalog.encoded_response(request, catalog._variants(html.encode('utf-8')),
+                                        CONTENT_TYPE, etag)
+    return catalog.encoded_response(request, {encoding: body}, CONTENT_TYPE, etag)
+
+
+def _on_commit(callback):
+    # a page re-rendered before the change commits would keep the old data
+    transaction.on_commit(callback)
+
+
+def card_changed(card, deleted=False):
+    """Drop the card's page once the save/delete commits, unless the save left its content alone."""
+    name = card_page(card.id)
+    key = None if deleted else card_key(card)
+
+    def refresh():
+        meta = _meta(name)
+        if meta is not None and (key is None or meta.get('key') != key):
+            drop(name)
+    _on_commit(refresh)
+
+
+def drop_cards(card_ids):
+    card_ids = list(card_ids)
+    _on_commit(lambda: [drop(card_page(card_id)) for card_id in card_ids])
+
+
+def drop_all_cards():
+    """Drop every card page (repricing everything, card or set renames)."""
+    def clear():
+        cards = _cards_dir()
+        # move it out of the way first so nothing is served from a half-deleted directory
+        doomed = f"{cards}.{uuid.uuid4().hex[:8]}.old"
+        try:
+            os.rename(cards, doomed)
+        except FileNotFoundError:
+            return
+        shutil.rmtree(doomed, ignore_errors=True)
+    _on_commit(clear)
+
+
+def prune_revisions():
+    """Delete the pages of template revisions other than the current one."""
+    current = template_revision()
+    try:
+        names = os.listdir(settings.PRERENDER_DIR)
+    except FileNotFoundError:
+        return 0
+    pruned = 0
+    for entry in names:
+        if entry != current:
+            shutil.rmtree(os.path.join(settings.PRERENDER_DIR, entry), ignore_errors=True)
+            pruned += 1
+    return pruned
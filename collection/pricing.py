@@ -0,0 +1,104 @@
+"""
+Storefront prices from the PricingRules, computed in SQL.
+
+The rules, then the listing's own markup_percent, are folded into one
+expression over each listing's market price (facets.market_price) and
+written to CollectionCard.sell_price with a single UPDATE, so repricing
+the whole catalog is one statement however many listings there are, and
+storefront requests only read the column. reprice() runs after every
+import and whenever a rule or a listing changes in the admin.
+"""
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Ceil, Greatest, Round
+from django.db.models.lookups import GreaterThan
+
+from . import prerender, rollups
+from .facets import market_price
+from .models import CatalogState, CollectionCard, PricingRule
+
+
+def _matches(rule):
+    q = Q()
+    if rule.condition:
+        q &= Q(condition=rule.condition)
+    if rule.edition:
+        q &= Q(edition=rule.edition)
+    if rule.psa:
+        q &= Q(psa=rule.psa)
+    if rule.card_set_id:
+        q &= Q(card_set_id=rule.card_set_id)
+    return q
+
+
+def _rounded(price, rounding):
+    if rounding == 'whole':
+        return Ceil(price)
+    if rounding == '99':
+        return Ceil(price) - Value(0.01)
+    if rounding == '49_99':
+        return Ceil(price * Value(2.0)) / Value(2.0) - Value(0.01)
+    return price
+
+
+def _when(q, then, default):
+    # a rule with no criteria matches everything
+    return Case(When(q, then=then), default=default, output_field=FloatField()) if q else then
+
+
+def price_expression(rules=None):
+    """SQL expression for a listing's sell price under `rules` (default: the active ones)."""
+    if rules is None:
+        rules = PricingRule.objects.filter(active=True).order_by('priority', 'id')
+    rules = list(rules)
+
+    price = market_price()
+    for rule in rules:
+        if rule.markup_percent:
+            price = price * _when(_matches(rule), Value(1 + rule.markup_percent / 100), Value(1.0))
+    # per-listing markup, before the floors and rounding
+    price = price * (Value(1.0) + F('markup_percent') / Value(100.0))
+    for rule in rules:
+        if rule.floor is not None:
+            price = Greatest(price, _when(_matches(rule), Value(float(rule.floor)), Value(0.0)))
+
+    # unpriced listings stay at 0 rather than rounding up to 0.99
+    priced = GreaterThan(price, Value(0.0))
+    roundings = []
+    for rule in rules:
+        if rule.rounding:
+            q = _matches(rule)
+            roundings.append(When(priced & q if q else priced, then=_rounded(price, rule.rounding)))
+    if roundings:
+        price = Case(*roundings, default=price, output_field=FloatField())
+    return Round(price, 2, output_field=FloatField())
+
+
+def reprice(queryset=None):
+    """Recompute sell_price for `queryset` (default: every row of every generation). Returns the row count."""
+    qs = CollectionCard.all_generations.all() if queryset is None else queryset
+    with transaction.atomic():
+        n = qs.update(sell_price=price_expression())
+        # .update() skips the post_save signals that normally bump it and drop the card pages
+        CatalogState.bump()
+        if queryset is None:
+            prerender.drop_all_cards()
+        else:
+            prerender.drop_cards(qs.values_list('id', flat=True))
+    return n
+
+
+def _reprice_catalog():
+    reprice()
+    # stock values follow the new prices
+    rollups.rebuild()
+
+
+def schedule_reprice():
+    """Reprice everything once the current transaction commits (rule edits); once per transaction."""
+    conn = transaction.get_connection()
+    if conn.in_atomic_block:
+        savepoints = set(conn.savepoint_ids)
+        if any(entry[1] is _reprice_catalog and entry[0] == savepoints for entry in conn.run_on_commit):
+            return
+    transaction.on_commit(_reprice_catalog)
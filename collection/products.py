@@ -0,0 +1,72 @@
+"""
+The storefront's product schema, shared by /api/products/ (views) and
+the write-through snapshot's products.json (snapshot), which leaves the
+stock fields out and serves them separately in status.bin.
+"""
+from .models import CollectionCard
+
+
+def get_sell_price(card: CollectionCard) -> float:
+    # sell_price is set by pricing.reprice(); rows it hasn't reached yet use the market price
+    if card.sell_price is not None:
+        return card.sell_price
+    return card.effective_mid or card.value_mid or 0
+
+
+def product_queryset():
+    return (
+        CollectionCard.objects
+        .select_related('card', 'card_set')
+        .prefetch_related('images')
+    )
+
+
+def serialize_product(c, absolute_url, stock=True):
+    """
+    One listing as the storefront reads it. `absolute_url(path)` turns the
+    image's path into a full URL; `stock=False` drops quantity/reserved and
+    the flags derived from them.
+    """
+    # image (uses the prefetched list; .first() would re-query per card)
+    img_url = ''
+    imgs = c.images.all()
+    img = imgs[0] if imgs else None
+    if img and img.img:
+        img_url = absolute_url(img.img.url)
+
+    price = get_sell_price(c)
+
+    product = {
+        'id': c.id,
+        'name': c.card.name,
+        'konami_id': getattr(c.card, 'konami_id', None),
+
+        'set': {
+            'name': c.card_set.name if c.card_set else None,
+            'code': getattr(c.card_set, 'code', None),
+        },
+
+        # ⚠️ SAFE field access
+        'edition': getattr(c, 'edition', None),
+        'condition': getattr(c, 'condition', None),
+        'misprint': getattr(c, 'misprint', None),
+        'graded': bool(getattr(c, 'psa', None)),
+        'psa_grade': getattr(c, 'psa', None),
+
+        'price_cents': int(price * 100),
+        'currency': 'USD',
+    }
+
+    if stock:
+        available = c.quantity - c.reserved
+        product.update({
+            'quantity': c.quantity,
+            'reserved': c.reserved,
+            'available': available,
+
+            'is_sold_out': available <= 0,
+            'is_reserved': c.reserved > 0 and available > 0,
+        })
+
+    product['image'] = img_url
+    return product
@@ -0,0 +1,208 @@
+"""
+On-demand profiling of single requests, for staff only.
+
+A staff user adds ?_profile=1 (or an `X-Profile: 1` header) to any
+request. That one request runs under cProfile with every SQL statement
+recorded; afterwards the slowest SELECTs are EXPLAINed (plain EXPLAIN,
+nothing is re-executed) and the result is written to PROFILE_DIR:
+
+- <id>.json: request summary, queries in order with their plans, and
+  the top functions by cumulative time
+- <id>.prof: the raw cProfile stats, for snakeviz / pstats
+
+middleware.ProfilingMiddleware does the hooking. The id comes back in
+the X-Profile-Id header and the artifacts are listed for download at
+/admin/profiles/; only the newest PROFILE_KEEP are kept. Under ASGI the
+profiler sees the event loop thread, so for async views the SQL and
+plans are the useful part.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import uuid
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+PROFILE_PARAM = '_profile'
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+ARTIFACT_ID = re.compile(r'^\d{8}-\d{6}-[0-9a-f]{8}$')
+EXPLAIN_TOP = 5
+TOP_FUNCTIONS = 40
+
+_current = ContextVar('request_profile', default=None)
+
+
+class QueryLog:
+    """execute_wrapper keeping every statement of the profiled request, with its timing."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'alias': context['connection'].alias, 'sql': sql, 'params': params, 'many': many,
+                'ms': (perf_counter() - start) * 1000,
+            })
+
+
+def _record_query(execute, sql, params, many, context):
+    # same contextvar approach as instrumentation._record_query
+    log = _current.get()
+    if log is None:
+        return execute(sql, params, many, context)
+    return log(execute, sql, params, many, context)
+
+
+def _add_query_wrapper(sender, connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def install_query_log():
+    connection_created.connect(_add_query_wrapper, dispatch_uid='collection.profiling')
+    for conn in connections.all(initialized_only=True):
+        _add_query_wrapper(None, conn)
+
+
+def requested(request):
+    return request.GET.get(PROFILE_PARAM) == '1' or request.headers.get(PROFILE_HEADER) == '1'
+
+
+def explain(queries, top=EXPLAIN_TOP):
+    """Attach a 'plan' to the `top` slowest single SELECTs in `queries`."""
+    selects = [
+        q for q in queries
+        if not q['many'] and q['sql'].lstrip()[:6].upper() == 'SELECT'
+    ]
+    for q in sorted(selects, key=lambda q: q['ms'], reverse=True)[:top]:
+        conn = connections[q['alias']]
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"{conn.ops.explain_query_prefix()} {q['sql']}", q['params'])
+                q['plan'] = '\n'.join(' '.join(str(col) for col in row) for row in cursor.fetchall())
+        except Exception as e:
+            # e.g. the request left the transaction aborted
+            q['plan'] = f"EXPLAIN failed: {e}"
+
+
+def _path(artifact_id, ext):
+    return os.path.join(settings.PROFILE_DIR, f"{artifact_id}.{ext}")
+
+
+class RequestProfile:
+    def __init__(self):
+        self.log = QueryLog()
+        self.profiler = cProfile.Profile()
+        self.started_at = timezone.now()
+
+    def start(self):
+        self.token = _current.set(self.log)
+        self.started = perf_counter()
+        try:
+            self.profiler.enable()
+        except ValueError:
+            # another profiler is already running in this thread; keep the SQL
+            self.profiler = None
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        self.elapsed = perf_counter() - self.started
+        _current.reset(self.token)
+
+    def _functions(self):
+        if self.profiler is None:
+            return ''
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        return out.getvalue()
+
+    def save(self, request, response):
+        """Write the artifacts; returns their id."""
+        queries = self.log.queries
+        explain(queries)
+        artifact_id = f"{self.started_at:%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+        report = {
+            'id': artifact_id,
+            'method': request.method,
+            'path': request.path,
+            'query_string': request.META.get('QUERY_STRING', ''),
+            'user': request.user.get_username(),
+            'status': response.status_code,
+            'started_at': self.started_at.isoformat(),
+            'elapsed_ms': round(self.elapsed * 1000, 1),
+            'db_ms': round(sum(q['ms'] for q in queries), 1),
+            'query_count': len(queries),
+            'queries': [
+                {**q, 'params': repr(q['params']), 'ms': round(q['ms'], 2)} for q in queries
+            ],
+            'functions': self._functions(),
+        }
+
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        if self.profiler is not None:
+            self.profiler.dump_stats(_path(artifact_id, 'prof'))
+        tmp = _path(artifact_id, 'json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(report, f, indent=1, default=str)
+        os.replace(tmp, _path(artifact_id, 'json'))
+        prune()
+        return artifact_id
+
+
+def prune(keep=None):
+    """Delete all but the newest `keep` (PROFILE_KEEP) artifacts."""
+    keep = settings.PROFILE_KEEP if keep is None else keep
+    for artifact_id in artifact_ids()[keep:]:
+        for ext in ('json', 'prof'):
+            try:
+                os.remove(_path(artifact_id, ext))
+            except FileNotFoundError:
+                pass
+
+
+def artifact_ids():
+    """Ids of the saved profiles, newest first."""
+    try:
+        names = os.listdir(settings.PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    ids = {name.rsplit('.', 1)[0] for name in names if name.endswith('.json')}
+    return sorted((i for i in ids if ARTIFACT_ID.match(i)), reverse=True)
+
+
+def artifact_path(artifact_id, ext='json'):
+    """Path of a saved artifact, or None for an unknown id/extension."""
+    if not ARTIFACT_ID.match(artifact_id) or ext not in ('json', 'prof'):
+        return None
+    path = _path(artifact_id, ext)
+    return path if os.path.exists(path) else None
+
+
+def summaries():
+    """The summary fields of every saved profile, newest first."""
+    out = []
+    for artifact_id in artifact_ids():
+        try:
+            with open(_path(artifact_id, 'json')) as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            continue
+        report.pop('queries', None)
+        report.pop('functions', None)
+        report['has_prof'] = os.path.exists(_path(artifact_id, 'prof'))
+        out.append(report)
+    return out
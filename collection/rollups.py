@@ -0,0 +1,153 @@
+"""
+Materialized stock totals behind the admin inventory report
+(InventoryRollup rows per set, edition, import batch and pricing source).
+
+Imports regroup every dimension in SQL once they commit: an import can
+move listings between any groups, and replace mode empties the table.
+Reservations and sales only shift known quantities of known listings, so
+they add per-group deltas instead. Both are applied after the surrounding
+transaction commits, so the rollup rows every checkout touches are never
+held locked for its length. `manage.py rebuild_rollups` recomputes
+everything from scratch.
+"""
+from django.db import transaction
+from django.db.models import CharField, Count, F, Max, Sum, Value
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
+
+from .facets import sell_price
+from .models import CollectionCard, InventoryRollup
+
+# dimension -> (grouping column, label column; None when the key is its own label)
+DIMENSIONS = {
+    'set': ('card_set_id', 'card_set__name'),
+    'edition': ('edition', None),
+    'batch': ('import_batch_id', 'import_batch__name'),
+    'source': ('pricing_source', None),
+}
+
+
+def _key(field):
+    # NULL and '' land in the same group
+    return Coalesce(Cast(field, CharField()), Value(''))
+
+
+def rebuild():
+    """Recompute every rollup row with one grouped query per dimension."""
+    qs = CollectionCard.objects.annotate(stock_value=sell_price() * F('quantity'))
+    with transaction.atomic():
+        for dimension, (field, label_field) in DIMENSIONS.items():
+            aggregates = dict(
+                listings=Count('id'), units=Sum('quantity'),
+                reserved_units=Sum('reserved'), value=Sum('stock_value'),
+            )
+            if label_field:
+                aggregates['label'] = Max(label_field)
+            rows = qs.annotate(rollup_key=_key(field)).values('rollup_key').annotate(**aggregates).order_by()
+            rollups = [
+                InventoryRollup(
+                    dimension=dimension, key=row['rollup_key'],
+                    label=(row['label'] or '') if label_field else row['rollup_key'],
+                    listings=row['listings'], units=row['units'] or 0,
+                    reserved=row['reserved_units'] or 0, value=row['value'] or 0,
+                )
+                for row in rows
+            ]
+            InventoryRollup.objects.bulk_create(
+                rollups, update_conflicts=True, unique_fields=['dimension', 'key'],
+                update_fields=['label', 'listings', 'units', 'reserved', 'value', 'updated_at'],
+            )
+            InventoryRollup.objects.filter(dimension=dimension).exclude(
+                key__in=[r.key for r in rollups]
+            ).delete()
+
+
+def _apply_moves(moves):
+    """Add {listing id: [units, reserved]} changes to the rows of each group they fall in."""
+    keys = {dimension: _key(field) for dimension, (field, _) in DIMENSIONS.items()}
+    listings = (
+        CollectionCard.objects.filter(id__in=list(moves))
+        .annotate(price=sell_price(), **{f'{d}_key': k for d, k in keys.items()})
+        .values_list('id', 'price', *(f'{d}_key' for d in keys))
+    )
+    deltas = {}
+    for listing_id, price, *group_keys in listings:
+        units, reserved = moves[listing_id]
+        for dimension, key in zip(keys, group_keys):
+            delta = deltas.setdefault((dimension, key), [0, 0, 0.0])
+            delta[0] += units
+            delta[1] += reserved
+            delta[2] += units * price
+
+    now = timezone.now()
+    with transaction.atomic():
+        # fixed order so concurrent checkouts can't deadlock on the rows
+        for (dimension, key), (units, reserved, value) in sorted(deltas.items()):
+            # a group with no row yet is picked up by the next rebuild
+            InventoryRollup.objects.filter(dimension=dimension, key=key).update(
+                units=F('units') + units, reserved=F('reserved') + reserved,
+                value=F('value') + value, updated_at=now,
+            )
+
+
+class _PendingRefresh:
+    """on_commit callback collecting everything one transaction changed."""
+
+    def __init__(self):
+        self.rebuild = False
+        self.moves = {}
+
+    def __call__(self):
+        if self.rebuild:
+            # regrouping already sees the moves
+            rebuild()
+        elif self.moves:
+            _apply_moves(self.moves)
+
+
+def _pending(register):
+    conn = transaction.get_connection()
+    if conn.in_atomic_block:
+        savepoints = set(conn.savepoint_ids)
+        for entry in conn.run_on_commit:
+            # only merge within the same savepoint, so a rolled back one takes its changes along
+            if isinstance(entry[1], _PendingRefresh) and entry[0] == savepoints:
+                register(entry[1])
+                return
+    refresh = _PendingRefresh()
+    register(refresh)
+    # outside a transaction this runs straight away
+    transaction.on_commit(refresh)
+
+
+def schedule_rebuild():
+    """Regroup all rollups once the current transaction commits (imports, admin edits)."""
+    def register(refresh):
+        refresh.rebuild = True
+    _pending(register)
+
+
+def stock_moved(items, quantity=0, reserved=0):
+    """
+    Record that every [{"id": int, "qty": int}, ...] listing changed by
+    qty * `quantity` units and qty * `reserved` reserved units, e.g.
+    reserved=1 for a reservation or quantity=-1, reserved=-1 for a sale.
+    """
+    def register(refresh):
+        for item in items:
+            move = refresh.moves.setdefault(item["id"], [0, 0])
+            move[0] += item["qty"] * quantity
+            move[1] += item["qty"] * reserved
+    _pending(register)
+
+
+def listing_count(batch_id=None):
+    """
+    Live listings in total (or in one import batch), read from the rollups
+    instead of counting the table. None when there's no rollup for it yet.
+    """
+    if batch_id is None:
+        rows = InventoryRollup.objects.filter(dimension='edition')
+    else:
+        rows = InventoryRollup.objects.filter(dimension='batch', key=str(batch_id))
+    return rows.aggregate(listings=Sum('listings'))['listings']
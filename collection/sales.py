@@ -0,0 +1,63 @@
+"""
+Sales reports over OrderLine rows: plain grouped aggregates on indexed
+foreign keys and Order.created_at, no parsing of Order.items.
+"""
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+
+from .models import OrderLine
+
+# group -> (grouping column, label column)
+GROUPS = {
+    'card': ('card_id', 'card__name'),
+    'set': ('card_set_id', 'card_set__name'),
+}
+PERIODS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def _lines(since=None):
+    qs = OrderLine.objects.all()
+    if since is not None:
+        qs = qs.filter(order__created_at__gte=since)
+    return qs
+
+
+def _dollars(cents):
+    return round((cents or 0) / 100, 2)
+
+
+def sales_by(group='card', since=None):
+    """Units and revenue per card (or set), best sellers first."""
+    field, label = GROUPS[group]
+    rows = (
+        _lines(since).values(field)
+        .annotate(name=Max(label), orders=Count('order_id', distinct=True),
+                  units=Sum('quantity'), revenue=Sum(F('quantity') * F('unit_amount')))
+        .order_by('-revenue')
+    )
+    return [
+        {'id': row[field], 'name': row['name'] or '', 'orders': row['orders'],
+         'units': row['units'] or 0, 'revenue': _dollars(row['revenue'])}
+        for row in rows
+    ]
+
+
+def revenue_over_time(period='day', since=None):
+    """{'times': [...], 'orders': [...], 'units': [...], 'revenue': [...]} per period."""
+    rows = (
+        _lines(since).annotate(period=PERIODS[period]('order__created_at')).values('period')
+        .annotate(orders=Count('order_id', distinct=True), units=Sum('quantity'),
+                  revenue=Sum(F('quantity') * F('unit_amount')))
+        .order_by('period')
+    )
+    out = {'times': [], 'orders': [], 'units': [], 'revenue': []}
+    for row in rows:
+        out['times'].append(row['period'].isoformat())
+        out['orders'].append(row['orders'])
+        out['units'].append(row['units'] or 0)
+        out['revenue'].append(_dollars(row['revenue']))
+    return out
@@ -0,0 +1,204 @@
+"""
+Write-through catalog snapshot (CATALOG_SNAPSHOT=True).
+
+Every catalog version change (imports, sales, reservations, admin edits;
+see models.catalog_changed) makes a background thread of the process
+that committed it rewrite two files in SNAPSHOT_DIR:
+
+- products.json (+ .gz/.br): every live listing as /api/products/ has it,
+  minus the stock fields. Only rewritten when its content changed.
+- status.bin (+ .gz/.br): the stock of every listing, little-endian:
+    header   4s magic b'RHS1', uint32 catalog version,
+             8s products fingerprint, uint32 count
+    records  count x (uint32 id, uint32 quantity, uint32 reserved)
+
+The storefront loads products.json once and polls status.bin, reloading
+products.json when the fingerprint in the header moves. serve() answers
+both straight from disk, so page views and polls cost no queries; the
+writes pay for the snapshot instead. Writers in all processes take the
+same lock file and skip versions already on disk, so a burst of changes
+ends in one write of the newest state. Files are replaced atomically and
+snapshot.json (version + fingerprints) goes last.
+
+WhiteNoise indexes files at startup and can't follow files rewritten at
+runtime, hence serve(). Point SNAPSHOT_DIR at a volume shared with any
+container that edits the catalog (one-off imports).
+"""
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.dispatch import receiver
+from django.http import Http404, HttpResponseNotModified
+from django.utils.http import parse_etags
+
+from . import catalog
+from .models import CatalogState, CollectionCard, catalog_changed
+from .products import product_queryset, serialize_product
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, each process still writes one at a time
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+PRODUCTS = 'products.json'
+STATUS = 'status.bin'
+CONTENT_TYPES = {PRODUCTS: 'application/json', STATUS: 'application/octet-stream'}
+SUFFIXES = {'identity': '', 'gzip': '.gz', 'br': '.br'}
+
+STATUS_MAGIC = b'RHS1'
+STATUS_HEADER = struct.Struct('<4sI8sI')
+STATUS_RECORD = struct.Struct('<III')
+
+_pending = False
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _path(name):
+    return os.path.join(settings.SNAPSHOT_DIR, name)
+
+
+def meta():
+    try:
+        with open(_path('snapshot.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_atomic(name, body):
+    tmp = _path(f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, 'wb') as f:
+        f.write(body)
+    os.replace(tmp, _path(name))
+
+
+def _write_variants(name, raw):
+    for encoding, body in catalog._variants(raw).items():
+        _write_atomic(name + SUFFIXES[encoding], body)
+
+
+@contextmanager
+def _writer_lock():
+    with open(_path('.lock'), 'w') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _absolute_url(path):
+    return settings.BASE_URL + path
+
+
+def build_products():
+    out = [serialize_product(c, _absolute_url, stock=False) for c in product_queryset()]
+    return json.dumps(out, cls=DjangoJSONEncoder).encode('utf-8')
+
+
+def build_status(version, fingerprint):
+    rows = CollectionCard.objects.order_by('id').values_list('id', 'quantity', 'reserved')
+    records = [STATUS_RECORD.pack(card_id, quantity, max(reserved, 0)) for card_id, quantity, reserved in rows]
+    header = STATUS_HEADER.pack(STATUS_MAGIC, version & 0xFFFFFFFF, bytes.fromhex(fingerprint), len(records))
+    return header + b''.join(records)
+
+
+def refresh(force=False):
+    """Bring the snapshot up to the current catalog version; False when it already was."""
+    os.makedirs(settings.SNAPSHOT_DIR, exist_ok=True)
+    with _writer_lock():
+        # the version is read first: rows read after it are at least that new
+        version = CatalogState.current()
+        current = meta()
+        # equal, not "at least": a snapshot stamped with a higher version came
+        # from another database (a restore, a test run pointed at this directory)
+        if not force and current is not None and current['version'] == version:
+            return False
+
+        products = build_products()
+        fingerprint = hashlib.sha1(products).hexdigest()[:16]
+        if force or current is None or current['products'] != fingerprint:
+            _write_variants(PRODUCTS, products)
+        _write_variants(STATUS, build_status(version, fingerprint))
+        _write_atomic('snapshot.json', json.dumps({'version': version, 'products': fingerprint}).encode())
+    return True
+
+
+def _run():
+    global _pending, _worker
+    try:
+        while True:
+            with _worker_lock:
+                if not _pending:
+                    _worker = None
+                    return
+                _pending = False
+            try:
+                refresh()
+            except Exception:
+                logger.exception("Catalog snapshot refresh failed")
+    finally:
+        # this thread's own connection
+        connections.close_all()
+
+
+def schedule():
+    """Refresh in the background; changes made meanwhile are picked up by one more pass."""
+    global _pending, _worker
+    with _worker_lock:
+        _pending = True
+        if _worker is None:
+            # not a daemon, so a management command waits for its last write
+            _worker = threading.Thread(target=_run, name='catalog-snapshot')
+            _worker.start()
+
+
+def wait():
+    """Block until the background refresh, if any, has finished."""
+    with _worker_lock:
+        worker = _worker
+    if worker is not None:
+        worker.join()
+
+
+@receiver(catalog_changed)
+def catalog_version_changed(sender, **kwargs):
+    if settings.CATALOG_SNAPSHOT:
+        schedule()
+
+
+def serve(request, name):
+    """Serve products.json or status.bin from disk, writing the snapshot first if there's none yet."""
+    if not settings.CATALOG_SNAPSHOT or name not in CONTENT_TYPES:
+        raise Http404
+    info = meta()
+    if info is None:
+        refresh()
+        info = meta()
+
+    etag = f'"{info["products"]}"' if name == PRODUCTS else f'"status-{info["version"]}"'
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    encoding = catalog.negotiate_encoding(request)
+    if encoding not in SUFFIXES:
+        encoding = 'identity'
+    # snapshot.json is replaced last, so the files are at least as new as the ETag
+    with open(_path(name + SUFFIXES[encoding]), 'rb') as f:
+        body = f.read()
+    return catalog.encoded_response(request, {encoding: body}, CONTENT_TYPES[name], etag)
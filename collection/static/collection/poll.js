@@ -0,0 +1,143 @@
+/*
+ * Shared poller for the status endpoints.
+ *
+ * One visible tab per URL (the leader, elected with a localStorage lease)
+ * does the fetching and fans each result out to the other tabs over
+ * BroadcastChannel. Hidden tabs never poll, failures back off, and the
+ * interval follows the server's X-Poll-Interval header (seconds).
+ *
+ *   RHPoll.subscribe('/api/card-status/12/', status => ..., { interval: 3000 });
+ *   RHPoll.subscribe('/api/snapshot/status.bin', buffer => ..., { binary: true });
+ */
+(function () {
+  const TAB_ID = Math.random().toString(36).slice(2) + Date.now().toString(36);
+  const LEASE_PREFIX = 'rh-poll-lease:';
+  const MIN_INTERVAL = 1000;
+  const MAX_BACKOFF = 60000;
+  const channel = ('BroadcastChannel' in window) ? new BroadcastChannel('rh-poll') : null;
+  const topics = new Map();
+
+  function readLease(url) {
+    try { return JSON.parse(localStorage.getItem(LEASE_PREFIX + url)); } catch (e) { return null; }
+  }
+
+  function writeLease(url, ttl) {
+    try {
+      localStorage.setItem(LEASE_PREFIX + url, JSON.stringify({ id: TAB_ID, expires: Date.now() + ttl }));
+      return true;
+    } catch (e) {
+      return false;
+    }
+  }
+
+  function releaseLease(url) {
+    const lease = readLease(url);
+    if (lease && lease.id === TAB_ID) localStorage.removeItem(LEASE_PREFIX + url);
+  }
+
+  function holdsLease(url) {
+    const lease = readLease(url);
+    return !!lease && lease.id === TAB_ID;
+  }
+
+  // Take or renew the lease if it's ours or has lapsed
+  function claimLeadership(topic) {
+    if (!channel) return true; // can't share results, so poll for ourselves
+    const lease = readLease(topic.url);
+    if (lease && lease.id !== TAB_ID && lease.expires > Date.now()) return false;
+    // lasts a few ticks so one slow request doesn't hand over leadership
+    if (!writeLease(topic.url, topic.interval * 3)) return true;
+    return holdsLease(topic.url); // two tabs racing: the last writer wins
+  }
+
+  function deliver(topic, data) {
+    topic.last = data;
+    topic.lastUpdate = Date.now();
+    topic.callbacks.forEach(cb => {
+      try { cb(data); } catch (e) { console.error('poll subscriber failed', e); }
+    });
+  }
+
+  function schedule(topic, delay) {
+    clearTimeout(topic.timer);
+    topic.timer = setTimeout(() => tick(topic), delay);
+  }
+
+  async function tick(topic) {
+    if (document.hidden) return; // resumed on visibilitychange
+
+    let delay = topic.interval;
+    if (claimLeadership(topic)) {
+      try {
+        const res = await fetch(topic.url, { credentials: 'same-origin' });
+        const hint = parseFloat(res.headers.get('X-Poll-Interval'));
+        if (hint > 0) topic.interval = Math.max(MIN_INTERVAL, hint * 1000);
+        if (!res.ok) throw new Error(`HTTP ${res.status}`);
+
+        const data = topic.binary ? await res.arrayBuffer() : await res.json();
+        topic.failures = 0;
+        delay = topic.interval;
+        deliver(topic, data);
+        if (channel) channel.postMessage({ type: 'data', url: topic.url, data, interval: topic.interval });
+      } catch (e) {
+        topic.failures += 1;
+        delay = Math.min(MAX_BACKOFF, topic.interval * 2 ** topic.failures);
+        console.warn('poll failed', topic.url, e);
+      }
+    }
+    schedule(topic, delay);
+  }
+
+  if (channel) {
+    channel.addEventListener('message', e => {
+      const msg = e.data || {};
+      const topic = topics.get(msg.url);
+      if (!topic) return;
+
+      if (msg.type === 'hello') {
+        // a new tab subscribed: hand it the latest result instead of making it wait a tick
+        if (topic.last !== undefined && holdsLease(topic.url)) {
+          channel.postMessage({ type: 'data', url: topic.url, data: topic.last, interval: topic.interval });
+        }
+      } else if (msg.type === 'data') {
+        topic.interval = msg.interval || topic.interval;
+        deliver(topic, msg.data);
+      }
+    });
+  }
+
+  document.addEventListener('visibilitychange', () => {
+    topics.forEach(topic => {
+      if (document.hidden) {
+        clearTimeout(topic.timer);
+        releaseLease(topic.url); // let a visible tab take over straight away
+      } else {
+        schedule(topic, Date.now() - topic.lastUpdate >= topic.interval ? 0 : topic.interval);
+      }
+    });
+  });
+
+  window.addEventListener('pagehide', () => topics.forEach(topic => releaseLease(topic.url)));
+
+  function subscribe(url, callback, { interval = 3000, binary = false } = {}) {
+    let topic = topics.get(url);
+    if (!topic) {
+      topic = {
+        url,
+        interval: Math.max(MIN_INTERVAL, interval),
+        binary,
+        callbacks: [],
+        failures: 0,
+        last: undefined,
+        lastUpdate: Date.now(), // pages fetch their own initial state
+        timer: null,
+      };
+      topics.set(url, topic);
+      if (channel) channel.postMessage({ type: 'hello', url });
+      schedule(topic, topic.interval);
+    }
+    topic.callbacks.push(callback);
+  }
+
+  window.RHPoll = { subscribe };
+})();
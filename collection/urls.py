@@ -1,9 +1,14 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api_views, views, async_views
+
+checkout_views = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
     path('products/', views.api_products, name='api-products'),
-    path('create-checkout-session/', views.create_checkout_session, name='create-checkout-session'),
+    path('facets/', views.api_facets, name='api-facets'),
+    path('snapshot/<str:name>', api_views.catalog_snapshot, name='catalog-snapshot'),
+    path('create-checkout-session/', checkout_views.create_checkout_session, name='create-checkout-session'),
     path('card/<int:card_id>/', views.card_detail, name='card-detail'),
     
     
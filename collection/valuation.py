@@ -0,0 +1,136 @@
+"""
+Price history and collection valuation.
+
+Imports append PriceSnapshot rows (record_price_history) instead of only
+overwriting the prices on CollectionCard. Current value is a SQL
+aggregate; value over time is computed with NumPy from the snapshots,
+with each listing carrying its last recorded value forward.
+"""
+import numpy as np
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+from .facets import market_price
+from .models import CollectionCard, PriceSnapshot
+
+GROUP_FIELDS = {
+    'set': 'card_set__name',
+    'edition': 'edition',
+}
+UNGROUPED = 'total'
+
+
+def record_price_history(import_batch, generation=None):
+    """
+    Snapshot the listings `import_batch` just wrote, plus a zero row for
+    every listing that has been deleted since it was last recorded (e.g.
+    by a replace import), so it stops counting toward later totals.
+    A replace import passes the `generation` it built, which isn't live
+    yet; listings outside it count as deleted.
+    """
+    now = timezone.now()
+    cards = CollectionCard.objects if generation is None else CollectionCard.all_generations.filter(generation=generation)
+    rows = (
+        cards.filter(import_batch=import_batch)
+        .values_list('id', 'card_id', 'card_set_id', 'edition', 'quantity',
+                     'value_low', 'value_mid', 'value_high', 'effective_mid')
+        .iterator(chunk_size=2000)
+    )
+    snapshots = [
+        PriceSnapshot(
+            listing_id=listing_id, card_id=card_id, card_set_id=card_set_id, edition=edition or '',
+            import_batch=import_batch, recorded_at=now, quantity=quantity or 0,
+            value_low=low, value_mid=mid, value_high=high, effective_mid=effective,
+        )
+        for listing_id, card_id, card_set_id, edition, quantity, low, mid, high, effective in rows
+    ]
+    snapshots += [
+        PriceSnapshot(
+            listing_id=listing_id, card_id=card_id, card_set_id=card_set_id, edition=edition,
+            import_batch=import_batch, recorded_at=now, quantity=0,
+        )
+        for listing_id, card_id, card_set_id, edition in _deleted_listings(cards)
+    ]
+    PriceSnapshot.objects.bulk_create(snapshots, batch_size=2000)
+    return len(snapshots)
+
+
+def _deleted_listings(cards):
+    """Listings whose latest snapshot still holds stock but whose row is gone from `cards`."""
+    latest = PriceSnapshot.objects.filter(listing_id=OuterRef('listing_id')).order_by('-recorded_at')
+    return (
+        PriceSnapshot.objects
+        .annotate(latest_at=Subquery(latest.values('recorded_at')[:1]))
+        .filter(recorded_at=F('latest_at'), quantity__gt=0)
+        .exclude(listing_id__in=cards.values('id'))
+        .values_list('listing_id', 'card_id', 'card_set_id', 'edition')
+        .distinct()
+    )
+
+
+def current_valuation():
+    """Value of the stock on hand now, in total, by set and by edition."""
+    # market value, like the snapshots behind value_history (not the marked-up sell price)
+    qs = CollectionCard.objects.annotate(stock_value=market_price() * F('quantity'))
+    aggregates = dict(listings=Count('id'), units=Sum('quantity'), value=Sum('stock_value'))
+
+    def grouped(field):
+        return [
+            {'name': row[field], 'listings': row['listings'], 'units': row['units'] or 0,
+             'value': round(row['value'] or 0, 2)}
+            for row in qs.values(field).annotate(**aggregates).order_by('-value')
+        ]
+
+    total = qs.aggregate(**aggregates)
+    return {
+        'listings': total['listings'],
+        'units': total['units'] or 0,
+        'value': round(total['value'] or 0, 2),
+        'by_set': grouped(GROUP_FIELDS['set']),
+        'by_edition': grouped(GROUP_FIELDS['edition']),
+    }
+
+
+def value_history(group=None):
+    """
+    Collection value after each import run, optionally split by set or
+    edition: {'times': [...], 'series': {name: [value per time]}}.
+    """
+    group_field = GROUP_FIELDS.get(group)
+    fields = ['listing_id', 'recorded_at', 'quantity', 'price'] + ([group_field] if group_field else [])
+    # snapshots keep market values only
+    rows = list(PriceSnapshot.objects.annotate(price=market_price()).values_list(*fields))
+    if not rows:
+        return {'times': [], 'series': {}}
+
+    columns = list(zip(*rows))
+    _, listing_idx = np.unique(np.array(columns[0], dtype=np.int64), return_inverse=True)
+    times, time_idx = np.unique(np.array(columns[1], dtype=object), return_inverse=True)
+    values = np.array(columns[2], dtype=float) * np.array(columns[3], dtype=float)
+    if group_field:
+        names, group_idx = np.unique(np.array([g or '' for g in columns[4]], dtype=object), return_inverse=True)
+    else:
+        names, group_idx = np.array([UNGROUPED], dtype=object), np.zeros(len(rows), dtype=int)
+
+    # one point per (listing, run); np.unique sorts them by listing, then time
+    n_times = len(times)
+    keys, inverse = np.unique(listing_idx * n_times + time_idx, return_inverse=True)
+    point_values = np.bincount(inverse, weights=values)
+    point_listings, point_times = keys // n_times, keys % n_times
+    point_groups = np.empty(len(keys), dtype=int)
+    point_groups[inverse] = group_idx
+
+    # each point contributes its change from the listing's previous point;
+    # a running sum over time then carries every listing's last value forward
+    same_listing = np.r_[False, point_listings[1:] == point_listings[:-1]]
+    previous = np.r_[0.0, point_values[:-1]]
+    deltas = point_values - np.where(same_listing, previous, 0.0)
+
+    totals = np.zeros((len(names), n_times))
+    np.add.at(totals, (point_groups, point_times), deltas)
+    totals = np.round(np.cumsum(totals, axis=1), 2)
+
+    return {
+        'times': [t.isoformat() for t in times],
+        'series': {str(name): row.tolist() for name, row in zip(names, totals)},
+    }
@@ -1,48 +1,52 @@
-import os, json
+import os, json, hashlib
+from urllib.parse import urlencode
 from django.shortcuts import render
-from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest
+from django.template.loader import render_to_string
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, HttpResponseNotModified
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.http import parse_etags
 from django.views.decorators.csrf import csrf_exempt
-from .models import CollectionCard, Order
-import stripe
+from .models import CollectionCard, Order, OrderLine, CatalogState
+from . import catalog, facets, generations, prerender, rollups
+from .instrumentation import timed
+from .polling import poll_interval
+from .products import get_sell_price, product_queryset, serialize_product
+from . import metrics
+from .payments import get_gateway, PaymentGatewayUnavailable
 import time
 from django.db import transaction
 from django.shortcuts import render, get_object_or_404
 from django.views.decorators.http import require_POST
 
-def get_sell_price(card: CollectionCard) -> float:
-    return card.effective_mid or card.value_mid or 0
-
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
 def get_cart(request):
     return request.session.setdefault("cart", {})
 
 def save_cart(request):
     request.session.modified = True
 
-def about(request):
-    return render(request, "collection/about.html")
-
-def terms(request):
-    return render(request, "collection/terms.html")
-
-def privacy(request):
-    return render(request, "collection/privacy.html")
+def _content_page(name):
+    # served from prerender's files after the first hit
+    def build():
+        return render_to_string(prerender.CONTENT_PAGES[name]), None
+    return lambda request: prerender.serve(request, prerender.content_page(name), build)
 
-def success(request):
-    return render(request, "collection/success.html")
-
-def cancel(request):
-    return render(request, "collection/cancel.html")
+about = _content_page('about')
+terms = _content_page('terms')
+privacy = _content_page('privacy')
+success = _content_page('success')
+cancel = _content_page('cancel')
 
 def index(request):
     return render(request, 'collection/index.html', {
-        'stripe_publishable_key': os.getenv('STRIPE_PUBLISHABLE_KEY', 'pk_test_...')
+        'stripe_publishable_key': os.getenv('STRIPE_PUBLISHABLE_KEY', 'pk_test_...'),
+        'catalog_snapshot': settings.CATALOG_SNAPSHOT,
     })
 
+@poll_interval
 def cart_status(request):
-    cart = request.session.get('cart', {})
+    # ids left behind by a catalog swap move to the live row for the same listing
+    cart = generations.remap_cart(request.session.get('cart', {}))
     cart_count = sum(cart.values())
     total = 0
     updated_cart = cart.copy()
@@ -117,7 +121,7 @@ def remove_from_cart(request):
 
 
 def cart_view(request):
-    cart = request.session.get("cart", {})
+    cart = generations.remap_cart(request.session.get("cart", {}))
     updated_cart = {}
 
     items = []
@@ -167,67 +171,84 @@ def cart_view(request):
     })
 
 
-def api_products(request):
-    qs = (
-        CollectionCard.objects
-        .select_related('card', 'card_set')
-        .prefetch_related('images')
-    )
+def _build_products_json(request):
+    # evaluated before the span, so its queries are counted as DB time, not serialize
+    cards = list(product_queryset())
+    with timed('serialize'):
+        out = [serialize_product(c, request.build_absolute_uri) for c in cards]
+        return json.dumps(out, cls=DjangoJSONEncoder).encode('utf-8')
 
-    out = []
 
-    for c in qs:
-        # image
-        img_url = ''
-        img = c.images.first()
-        if img and img.img:
-            img_url = request.build_absolute_uri(img.img.url)
+def _not_modified(request, etag, warning=None):
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        if warning:
+            response['Warning'] = warning
+        return response
+    return None
 
-        price = get_sell_price(c)
-        available = c.quantity - c.reserved
 
-        out.append({
-            'id': c.id,
-            'name': c.card.name,
-            'konami_id': getattr(c.card, 'konami_id', None),
+def _payload_response(request, payload):
+    # a stale copy carries its own (older) ETag, which the client may already have
+    if payload.warning:
+        not_modified = _not_modified(request, payload.etag, payload.warning)
+        if not_modified:
+            return not_modified
+    return catalog.encoded_response(request, payload.variants, etag=payload.etag, warning=payload.warning)
 
-            'set': {
-                'name': c.card_set.name if c.card_set else None,
-                'code': getattr(c.card_set, 'code', None),
-            },
 
-            # ⚠️ SAFE field access
-            'edition': getattr(c, 'edition', None),
-            'condition': getattr(c, 'condition', None),
-            'misprint': getattr(c, 'misprint', None),
-            'graded': bool(getattr(c, 'psa', None)),
-            'psa_grade': getattr(c, 'psa', None),
+@poll_interval
+def api_products(request):
+    # Serialized + compressed once per catalog version (and host, since image
+    # URLs are absolute), then served from cache until stock or data changes.
+    # While a new version is being built, other pollers get the previous one.
+    version = CatalogState.current()
+    etag = f'"catalog-{version}"'
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+
+    host = request.build_absolute_uri('/')
+    payload = catalog.coalesced_payload(
+        f"catalog:products:{version}:{host}", lambda: _build_products_json(request),
+        etag, stale_key=f"catalog:products:latest:{host}",
+    )
+    return _payload_response(request, payload)
 
-            'price_cents': int(price * 100),
-            'currency': 'USD',
 
-            'quantity': c.quantity,
-            'reserved': c.reserved,
-            'available': available,
+def _build_facets_json(filters):
+    with timed('facets'):
+        return json.dumps(facets.facet_counts(filters), cls=DjangoJSONEncoder).encode('utf-8')
 
-            'is_sold_out': available <= 0,
-            'is_reserved': c.reserved > 0 and available > 0,
 
-            'image': img_url,
-        })
+def api_facets(request):
+    # Cached per catalog version like api_products, and per filter combination
+    filters = facets.parse_filters(request.GET)
+    version = CatalogState.current()
+    etag = f'"facets-{version}"'
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
 
-    return JsonResponse(out, safe=False)
+    filter_key = hashlib.sha1(urlencode(sorted(filters.items())).encode('utf-8')).hexdigest()
+    payload = catalog.coalesced_payload(
+        f"catalog:facets:{version}:{filter_key}", lambda: _build_facets_json(filters),
+        etag, stale_key=f"catalog:facets:latest:{filter_key}",
+    )
+    return _payload_response(request, payload)
 
-def card_detail(request, card_id):
-    c = CollectionCard.objects \
-        .select_related('card', 'card_set') \
-        .prefetch_related('images') \
-        .get(id=card_id)
+def render_card_page(card_id):
+    """The HTML of a card page and its prerender.card_key()."""
+    c = get_object_or_404(
+        CollectionCard.objects.select_related('card', 'card_set').prefetch_related('images'),
+        id=card_id,
+    )
 
     img_url = ''
     img = c.images.first()
     if img and img.img:
-        img_url = request.build_absolute_uri(img.img.url)
+        img_url = settings.BASE_URL + img.img.url
 
     price = get_sell_price(c)
     available = c.quantity - c.reserved
@@ -243,26 +264,120 @@ def card_detail(request, card_id):
         'psa': c.psa,
         'price': price,
         'available': available,
-        'is_sold_out': available <= 0,
+        # the page is stored and reused, so stock comes from /api/card-status/ in the browser
+        'is_sold_out': False,
         'image': img_url,
         'notes': c.notes,
     }
 
-    return render(request, 'collection/card_detail.html', {
-        'product': product
-    })
+    html = render_to_string('collection/card_detail.html', {'product': product})
+    return html, prerender.card_key(c)
+
+def card_detail(request, card_id):
+    return prerender.serve(request, prerender.card_page(card_id), lambda: render_card_page(card_id),
+                           version=CatalogState.current)
+
+CHECKOUT_EXPIRY_SECONDS = 30 * 60
+
+
+def _cart_line_item(c, qty, images):
+    price = get_sell_price(c)
+    return {
+        "price_data": {
+            "currency": "usd",
+            "product_data": {
+                "name": c.card.name,
+                "description": f"{c.edition} • {c.condition}",
+                "images": images
+            },
+            "unit_amount": int(price * 100)
+        },
+        "quantity": qty
+    }
+
+
+def _items_metadata(line_items, reserved_items):
+    # [id, qty, unit cents charged] per item; compact, Stripe caps metadata values at 500 characters
+    return json.dumps(
+        [[item["id"], item["qty"], line["price_data"]["unit_amount"]]
+         for item, line in zip(reserved_items, line_items)],
+        separators=(',', ':'),
+    )
+
+
+def _cart_session_params(line_items, reserved_items):
+    return dict(
+        mode="payment",
+        payment_method_types=["card"],
+        line_items=line_items,
+        shipping_address_collection={"allowed_countries": ["US"]},
+        success_url=f"{settings.BASE_URL}/success/",
+        cancel_url=f"{settings.BASE_URL}/cancel/",
+        metadata={
+            "source": "rarehunter_cart",
+            "items": _items_metadata(line_items, reserved_items)
+        },
+        expires_at=int(time.time()) + CHECKOUT_EXPIRY_SECONDS
+    )
+
+
+def _single_session_params(c, qty, images):
+    price = get_sell_price(c)
+    unit_amount = int(price * 100)
+
+    description = f"Set: {c.card_set}, Edition: {c.edition}, Condition: {c.condition}, "
+    description += f"PSA: {c.psa or 'N/A'}, Notes: {c.notes or 'None'}, "
+    if c.misprint:
+        description += f"Misprint: {c.misprint}"
+
+    return dict(
+        payment_method_types=['card'],
+        line_items=[{
+            'price_data': {
+                'currency': 'usd',
+                'product_data': {
+                    'name': c.card.name,
+                    'description': description,
+                    'images': images
+                },
+                'unit_amount': unit_amount
+            },
+            'quantity': qty
+        }],
+        mode='payment',
+        shipping_address_collection={"allowed_countries": ["US"],},
+        success_url=f"{settings.BASE_URL}/success/",
+        cancel_url=f"{settings.BASE_URL}/cancel/",
+        expires_at=int(time.time()) + CHECKOUT_EXPIRY_SECONDS,  # <-- set expiration
+        metadata={
+            "source": "rarehunter_cart",
+            'collection_card_id': str(c.id),
+            'reserved_qty': str(qty),
+            'konami_id': str(c.card.konami_id),
+            'edition': c.edition,
+            'condition': c.condition,
+            'set_code': c.card_set.code if c.card_set else '',
+            'effective_mid': str(price),
+            'unit_amount': str(unit_amount),
+            'misprint': c.misprint or ''
+        }
+    )
+
 
 @csrf_exempt
 def create_cart_checkout_session(request):
     cart = get_cart(request)
     if not cart:
         return JsonResponse({"error": "Cart empty"}, status=400)
+    cart = generations.remap_cart(cart)
 
     line_items = []
     reserved_items = []
 
     try:
         with transaction.atomic():
+            # no catalog swap while stock moves (see generations)
+            generations.hold_live_generation()
             for card_id_str, qty in cart.items():
                 card_id = int(card_id_str)
 
@@ -281,44 +396,22 @@ def create_cart_checkout_session(request):
                 c.reserved += qty
                 c.save()
 
-                price = get_sell_price(c)
                 images = (
                     [request.build_absolute_uri(c.images.first().img.url)]
                     if c.images.exists() else []
                 )
 
-                line_items.append({
-                    "price_data": {
-                        "currency": "usd",
-                        "product_data": {
-                            "name": c.card.name,
-                            "description": f"{c.edition} • {c.condition}",
-                            "images": images
-                        },
-                        "unit_amount": int(price * 100)
-                    },
-                    "quantity": qty
-                })
+                line_items.append(_cart_line_item(c, qty, images))
 
                 reserved_items.append({
                     "id": c.id,
                     "qty": qty
                 })
 
-            expires_at = int(time.time()) + (30 * 60)
-
-            session = stripe.checkout.Session.create(
-                mode="payment",
-                payment_method_types=["card"],
-                line_items=line_items,
-                shipping_address_collection={"allowed_countries": ["US"]},
-                success_url=f"{settings.BASE_URL}/success/",
-                cancel_url=f"{settings.BASE_URL}/cancel/",
-                metadata={
-                    "source": "rarehunter_cart",
-                    "items": json.dumps(reserved_items)
-                },
-                expires_at=expires_at
+            rollups.stock_moved(reserved_items, reserved=1)
+
+            session = get_gateway().create_checkout_session(
+                **_cart_session_params(line_items, reserved_items)
             )
 
     except ValueError as e:
@@ -328,6 +421,13 @@ def create_cart_checkout_session(request):
             status=409
         )
 
+    except PaymentGatewayUnavailable:
+        # Circuit open: fail fast, reservation rolled back with the transaction
+        return JsonResponse(
+            {"error": "Payments are temporarily unavailable, please try again shortly"},
+            status=503
+        )
+
     except Exception:
         # Unexpected failure
         return JsonResponse(
@@ -335,6 +435,8 @@ def create_cart_checkout_session(request):
             status=500
         )
 
+    metrics.inventory('reserved', sum(item["qty"] for item in reserved_items))
+
     # Clear cart only AFTER session succeeds
     request.session["cart"] = {}
     request.session.modified = True
@@ -356,6 +458,7 @@ def create_checkout_session(request):
 
     try:
         with transaction.atomic():
+            generations.hold_live_generation()
             # Lock the row
             c = CollectionCard.objects.select_for_update().get(id=collection_card_id)
 
@@ -367,54 +470,22 @@ def create_checkout_session(request):
             # Reserve stock
             c.reserved += qty
             c.save()
+            rollups.stock_moved([{"id": c.id, "qty": qty}], reserved=1)
 
             # Stripe session
-            price = get_sell_price(c)
             images = [request.build_absolute_uri(c.images.first().img.url)] if c.images.exists() else []
-            expires_in_seconds = 30 * 60
-            expires_at = int(time.time()) + expires_in_seconds
-
-            description = f"Set: {c.card_set}, Edition: {c.edition}, Condition: {c.condition}, "
-            description += f"PSA: {c.psa or 'N/A'}, Notes: {c.notes or 'None'}, "
-            if c.misprint:
-                description += f"Misprint: {c.misprint}"
-
-            session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                line_items=[{
-                    'price_data': {
-                        'currency': 'usd',
-                        'product_data': {
-                            'name': c.card.name,
-                            'description': description,
-                            'images': images
-                        },
-                        'unit_amount': int(price * 100)
-                    },
-                    'quantity': qty
-                }],
-                mode='payment',
-                shipping_address_collection={"allowed_countries": ["US"],},
-                success_url=f"{settings.BASE_URL}/success/",
-                cancel_url=f"{settings.BASE_URL}/cancel/",
-                expires_at=expires_at,  # <-- set expiration
-                metadata={
-                    "source": "rarehunter_cart",
-                    'collection_card_id': str(c.id),
-                    'reserved_qty': str(qty),
-                    'konami_id': str(c.card.konami_id),
-                    'edition': c.edition,
-                    'condition': c.condition,
-                    'set_code': c.card_set.code if c.card_set else '',
-                    'effective_mid': str(price),
-                    'misprint': c.misprint or ''
-                }
+            session = get_gateway().create_checkout_session(
+                **_single_session_params(c, qty, images)
             )
     except CollectionCard.DoesNotExist:
         return JsonResponse({'error': 'Not found'}, status=404)
+    except PaymentGatewayUnavailable:
+        return JsonResponse({'error': 'Payments are temporarily unavailable, please try again shortly'}, status=503)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+    metrics.inventory('reserved', qty)
+
     return JsonResponse({'url': session.url})
 
 @csrf_exempt
@@ -426,7 +497,7 @@ def stripe_webhook(request):
     # --- Verify webhook ---
     try:
         if webhook_secret:
-            event = stripe.Webhook.construct_event(
+            event = get_gateway().construct_event(
                 payload, sig_header, webhook_secret
             )
         else:
@@ -436,70 +507,107 @@ def stripe_webhook(request):
 
     event_type = event.get("type")
     sess = event["data"]["object"]
-    metadata = sess.get("metadata", {})
-
-    # --- helper to parse reserved items ---
-    def get_reserved_items():
-        """
-        Returns a list of dicts:
-        [{ "id": int, "qty": int }, ...]
-        """
-        # Cart checkout
-        if "items" in metadata:
-            return json.loads(metadata["items"])
-
-        # Single-item checkout (legacy)
-        if "collection_card_id" in metadata and "reserved_qty" in metadata:
-            return [{
-                "id": int(metadata["collection_card_id"]),
-                "qty": int(metadata["reserved_qty"])
-            }]
-
-        return []
-
-    reserved_items = get_reserved_items()
+    reserved_items = reserved_items_from_metadata(sess.get("metadata", {}))
 
     # --- PAYMENT COMPLETED ---
     if event_type == "checkout.session.completed":
-        with transaction.atomic():
-            for item in reserved_items:
-                c = CollectionCard.objects.select_for_update().get(id=item["id"])
-                qty = item["qty"]
-
-                c.quantity -= qty
-                c.reserved -= qty
-                c.save()
-
-                print(f"Sold {qty} of {c.card.name}")
-
-            # Create order (once per session)
-            items = stripe.checkout.Session.list_line_items(sess["id"], limit=100)
-            shipping = sess.get("shipping") or {}
-            customer_email = sess.get("customer_details", {}).get("email", "")
-
-            Order.objects.create(
-                stripe_order_id=sess["id"],
-                email=customer_email,
-                shipping_name=shipping.get("name", ""),
-                shipping_address=shipping.get("address", {}),
-                status="paid",
-                items=[
-                    {"description": li.description, "quantity": li.quantity}
-                    for li in items.data
-                ]
-            )
+        # order lines come from the reservation, no line item lookup at Stripe
+        record_sale(sess, reserved_items)
+        metrics.inventory('sold', sum(item["qty"] for item in reserved_items))
 
     # --- PAYMENT FAILED OR SESSION EXPIRED ---
     elif event_type in (
         "checkout.session.expired",
         "payment_intent.payment_failed",
     ):
-        with transaction.atomic():
-            for item in reserved_items:
-                c = CollectionCard.objects.select_for_update().get(id=item["id"])
-                c.reserved -= item["qty"]
-                c.save()
+        release_reserved(reserved_items)
+        metrics.inventory('released', sum(item["qty"] for item in reserved_items))
 
-                print(f"Released {item['qty']} of {c.card.name}")
+    metrics.webhook_processed(event_type, event.get("created"))
 
     return HttpResponse(status=200)
+
+
+def reserved_items_from_metadata(metadata):
+    """
+    Returns a list of dicts:
+    [{ "id": int, "qty": int, "cents": int or None }, ...]
+    "cents" is the unit amount charged; None for sessions that predate it.
+    """
+    # Cart checkout: [[id, qty, cents], ...], or [{"id", "qty"}, ...] from older sessions
+    if "items" in metadata:
+        return [
+            {"id": item["id"], "qty": item["qty"], "cents": None} if isinstance(item, dict)
+            else {"id": item[0], "qty": item[1], "cents": item[2]}
+            for item in json.loads(metadata["items"])
+        ]
+
+    # Single-item checkout (legacy)
+    if "collection_card_id" in metadata and "reserved_qty" in metadata:
+        return [{
+            "id": int(metadata["collection_card_id"]),
+            "qty": int(metadata["reserved_qty"]),
+            "cents": int(metadata["unit_amount"]) if metadata.get("unit_amount") else None,
+        }]
+
+    return []
+
+
+def record_sale(sess, reserved_items):
+    with transaction.atomic():
+        generations.hold_live_generation()
+        sold_items = []
+        lines = []
+        for item in reserved_items:
+            # the session may predate a catalog swap; follow the reservation to its row
+            c = generations.locked_current(item["id"])
+            qty = item["qty"]
+
+            c.quantity -= qty
+            c.reserved -= qty
+            c.save()
+            sold_items.append({"id": c.id, "qty": qty})
+            lines.append(OrderLine(
+                collection_card=c, card_id=c.card_id, card_set_id=c.card_set_id, edition=c.edition or '',
+                description=c.card.name, quantity=qty,
+                # what the customer was charged, not the price after any reprice since
+                unit_amount=item["cents"] if item.get("cents") is not None else int(get_sell_price(c) * 100),
+            ))
+
+            print(f"Sold {qty} of {c.card.name}")
+
+        rollups.stock_moved(sold_items, quantity=-1, reserved=-1)
+
+        # Create order (once per session)
+        shipping = sess.get("shipping") or {}
+        customer_email = sess.get("customer_details", {}).get("email", "")
+
+        order = Order.objects.create(
+            stripe_order_id=sess["id"],
+            email=customer_email,
+            shipping_name=shipping.get("name", ""),
+            shipping_address=shipping.get("address", {}),
+            status="paid",
+            items=[
+                {"description": line.description, "quantity": line.quantity}
+                for line in lines
+            ]
+        )
+        for line in lines:
+            line.order = order
+        OrderLine.objects.bulk_create(lines)
+
+
+def release_reserved(reserved_items):
+    with transaction.atomic():
+        generations.hold_live_generation()
+        released_items = []
+        for item in reserved_items:
+            c = generations.locked_current(item["id"])
+            c.reserved -= item["qty"]
+            c.save()
+            released_items.append({"id": c.id, "qty": item["qty"]})
+
+            print(f"Released {item['qty']} of {c.card.name}")
+
+        rollups.stock_moved(released_items, reserved=-1)
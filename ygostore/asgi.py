@@ -0,0 +1,14 @@
+"""
+ASGI entry point. Serves the checkout, webhook and status endpoints with
+the async views, so a worker can keep many checkouts waiting on Stripe
+at once instead of one per process:
+
+    gunicorn ygostore.asgi:application -k uvicorn.workers.UvicornWorker
+"""
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ygostore.settings')
+os.environ.setdefault('ASYNC_VIEWS', 'True')
+application = get_asgi_application()
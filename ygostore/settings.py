@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 import environ
 import dj_database_url
@@ -38,19 +39,24 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'whitenoise.middleware.WhiteNoiseMiddleware',  # add near the top, after SecurityMiddleware
     'django.middleware.security.SecurityMiddleware',
+    'collection.middleware.MetricsMiddleware',
+    'collection.middleware.ReadReplicaMiddleware',
+    'collection.middleware.RequestTimingMiddleware',
+    'collection.middleware.CompressedJSONMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'collection.middleware.ProfilingMiddleware',  # needs request.user
 ]
 
 ROOT_URLCONF = 'ygostore.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'collection.instrumentation.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -65,6 +71,10 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'ygostore.wsgi.application'
+ASGI_APPLICATION = 'ygostore.asgi.application'
+
+# Route checkout/webhook/status to collection.async_views (set by asgi.py)
+ASYNC_VIEWS = env.bool('ASYNC_VIEWS', default=False)
 
 DATABASES = {
     'default': dj_database_url.config(
@@ -74,6 +84,26 @@ DATABASES = {
     )
 }
 
+# Shared cache for the catalog payloads, so gunicorn workers reuse (and
+# coalesce rebuilds of) one copy, e.g. CACHE_URL=redis://host:6379/1.
+# The default is per process.
+CACHES = {'default': env.cache('CACHE_URL', default='locmemcache://')}
+
+# Optional read replica for storefront reads (see collection/routers.py).
+# Locally, point it at a copy of the primary, e.g. sqlite:////path/to/replica.sqlite3
+REPLICA_DATABASE_URL = env('REPLICA_DATABASE_URL', default='')
+if REPLICA_DATABASE_URL:
+    DATABASES['replica'] = dj_database_url.parse(
+        REPLICA_DATABASE_URL,
+        conn_max_age=600,
+        ssl_require=not REPLICA_DATABASE_URL.startswith('sqlite'),
+    )
+    # tests run against a single database
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+DATABASE_ROUTERS = ['collection.routers.PrimaryReplicaRouter']
+# how long a browser's reads stay on the primary after it writes
+REPLICA_STICKY_SECONDS = env.int('REPLICA_STICKY_SECONDS', default=5)
+
 AUTH_PASSWORD_VALIDATORS = []
 
 LANGUAGE_CODE = 'en-us'
@@ -93,6 +123,74 @@ CSRF_COOKIE_SECURE = True      # if using HTTPS
 # Stripe configuration
 STRIPE_SECRET_KEY = env('STRIPE_SECRET_KEY', default='')
 STRIPE_WEBHOOK_SECRET = env('STRIPE_WEBHOOK_SECRET', default='')
+# Payment gateway implementation; collection.payments.FakeGateway works offline
+PAYMENT_GATEWAY = env('PAYMENT_GATEWAY', default='collection.payments.StripeGateway')
+PAYMENT_FAKE_LATENCY = env.float('PAYMENT_FAKE_LATENCY', default=0.2)
+PAYMENT_FAKE_JITTER = env.float('PAYMENT_FAKE_JITTER', default=0.05)
+# Stripe client: pooled keep-alive session, bounded timeouts/retries, circuit breaker.
+# Point STRIPE_API_BASE at a local stub (e.g. stripe-mock) to test offline.
+STRIPE_API_BASE = env('STRIPE_API_BASE', default='https://api.stripe.com')
+PAYMENT_CONNECT_TIMEOUT = env.float('PAYMENT_CONNECT_TIMEOUT', default=3.0)
+PAYMENT_READ_TIMEOUT = env.float('PAYMENT_READ_TIMEOUT', default=10.0)
+PAYMENT_MAX_RETRIES = env.int('PAYMENT_MAX_RETRIES', default=2)
+PAYMENT_POOL_SIZE = env.int('PAYMENT_POOL_SIZE', default=10)
+PAYMENT_BREAKER_THRESHOLD = env.int('PAYMENT_BREAKER_THRESHOLD', default=5)
+PAYMENT_BREAKER_RESET = env.float('PAYMENT_BREAKER_RESET', default=30.0)
 BASE_URL = env('BASE_URL', default='https://collection.rarehuntertcg.com')
 SMTP2GO_USERNAME = env('SMTP2GO_USERNAME', default='')
 SMTP2GO_PASSWORD = env('SMTP2GO_PASSWORD', default='')
+
+# Outbound email (delivered by `manage.py send_outbox`). For a local sink use
+# EMAIL_SMTP_HOST=localhost EMAIL_SMTP_PORT=1025 EMAIL_SMTP_STARTTLS=False.
+EMAIL_SMTP_HOST = env('EMAIL_SMTP_HOST', default='mail.smtp2go.com')
+EMAIL_SMTP_PORT = env.int('EMAIL_SMTP_PORT', default=2525)  # could also be 587, 8025, or 25
+EMAIL_SMTP_STARTTLS = env.bool('EMAIL_SMTP_STARTTLS', default=True)
+EMAIL_SMTP_TIMEOUT = env.float('EMAIL_SMTP_TIMEOUT', default=30.0)
+EMAIL_FROM = env('EMAIL_FROM', default='orders@rarehuntertcg.com')
+EMAIL_OUTBOX_BATCH_SIZE = env.int('EMAIL_OUTBOX_BATCH_SIZE', default=100)
+EMAIL_OUTBOX_CONCURRENCY = env.int('EMAIL_OUTBOX_CONCURRENCY', default=4)
+EMAIL_MAX_ATTEMPTS = env.int('EMAIL_MAX_ATTEMPTS', default=5)
+
+# Request instrumentation: slow requests are logged with their query
+# counts; SERVER_TIMING also sends the spans to the client as a
+# Server-Timing header, so leave it off where anyone can read it
+REQUEST_TIMING = env.bool('REQUEST_TIMING', default=True)
+SERVER_TIMING = env.bool('SERVER_TIMING', default=False)
+SLOW_REQUEST_MS = env.int('SLOW_REQUEST_MS', default=500)
+
+# Staff-only request profiling (?_profile=1 or X-Profile: 1, see
+# collection/profiling.py): where the artifacts go and how many are kept
+PROFILING = env.bool('PROFILING', default=True)
+PROFILE_DIR = env('PROFILE_DIR', default=os.path.join(tempfile.gettempdir(), 'rarehunter-profiles'))
+PROFILE_KEEP = env.int('PROFILE_KEEP', default=50)
+
+# Pre-rendered content and card pages (collection/prerender.py). Point it at
+# a volume shared with whatever edits the catalog (one-off import
+# containers) so their changes drop the pages the web process serves.
+PRERENDER_DIR = env('PRERENDER_DIR', default=os.path.join(tempfile.gettempdir(), 'rarehunter-pages'))
+
+# Write-through catalog snapshot (collection/snapshot.py): every catalog
+# change rewrites products.json + status.bin in SNAPSHOT_DIR and the
+# storefront loads those instead of /api/products/. Share the directory
+# with containers that edit the catalog, like PRERENDER_DIR.
+CATALOG_SNAPSHOT = env.bool('CATALOG_SNAPSHOT', default=False)
+SNAPSHOT_DIR = env('SNAPSHOT_DIR', default=os.path.join(tempfile.gettempdir(), 'rarehunter-snapshot'))
+
+# Seconds between status polls, sent to the storefront as X-Poll-Interval;
+# raise it to shed polling load
+POLL_INTERVAL_SECONDS = env.float('POLL_INTERVAL_SECONDS', default=3.0)
+
+# Parallel importer (`manage.py import_collection`): worker processes
+# (0 = one per core) and payloads handed to each worker at a time
+IMPORT_WORKERS = env.int('IMPORT_WORKERS', default=0)
+IMPORT_SHARD_SIZE = env.int('IMPORT_SHARD_SIZE', default=1000)
+
+# Replace imports leave the previous catalog generation in place for
+# checkouts that were already open; `manage.py gc_catalog` deletes it this
+# long after the swap (keep it above the checkout session expiry)
+CATALOG_GC_GRACE_SECONDS = env.int('CATALOG_GC_GRACE_SECONDS', default=2 * 60 * 60)
+
+# Prometheus metrics: per-process files merged by /metrics/ (shared by all gunicorn workers)
+METRICS_DIR = env('METRICS_DIR', default=os.path.join(tempfile.gettempdir(), 'rarehunter-metrics'))
+METRICS_FLUSH_INTERVAL = env.float('METRICS_FLUSH_INTERVAL', default=1.0)
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
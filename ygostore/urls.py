@@ -1,20 +1,34 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
+from django.views.static import serve
 from collection import views as coll_views
 from collection import api_views
+from collection import async_views
+
+if settings.ASYNC_VIEWS:
+    checkout_views = status_views = async_views
+else:
+    checkout_views, status_views = coll_views, api_views
 
 urlpatterns = [
+    path('admin/profiles/', api_views.profiles, name='profiles'),
+    path('admin/profiles/<str:artifact_id>.<str:ext>', api_views.profile_download, name='profile-download'),
     path('admin/', admin.site.urls),
     path('', coll_views.index, name='home'),
     path('api/', include('collection.urls')),
-    path('webhook/', coll_views.stripe_webhook, name='stripe-webhook'),
-    path('api/card-status/<int:card_id>/', api_views.card_status),
+    path('webhook/', checkout_views.stripe_webhook, name='stripe-webhook'),
+    path('api/card-status/<int:card_id>/', status_views.card_status),
+    path('metrics/', api_views.metrics, name='metrics'),
+    path('api/valuation/', api_views.valuation, name='valuation'),
+    path('api/valuation/history/', api_views.valuation_history, name='valuation-history'),
+    path('api/sales/', api_views.sales, name='sales'),
+    path('api/sales/revenue/', api_views.sales_revenue, name='sales-revenue'),
     path("cart/add/", coll_views.add_to_cart),
     path("cart/remove/", coll_views.remove_from_cart),
-    path("cart/checkout/", coll_views.create_cart_checkout_session),
-    path('cart/status/', coll_views.cart_status, name='cart_status'),
+    path("cart/checkout/", checkout_views.create_cart_checkout_session),
+    path('cart/status/', checkout_views.cart_status, name='cart_status'),
      # Static pages
     path('about/', coll_views.about, name='about'),
     path('terms/', coll_views.terms, name='terms'),
@@ -23,3 +37,9 @@ urlpatterns = [
     path('cancel/', coll_views.cancel, name='cancel'),
     path('cart/', coll_views.cart_view, name='cart'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+if settings.ASYNC_VIEWS:
+    # WhiteNoise only wraps the WSGI app (wsgi.py), so Django serves media under ASGI
+    urlpatterns += [
+        re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
+    ]